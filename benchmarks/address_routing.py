@@ -0,0 +1,86 @@
+"""
+Benchmark of inbound packet routing in HAInterface._onCommand.
+
+Registers a number of devices with an HAInterface and routes packets for
+random addresses, reporting the cost per packet through the address index
+and through the previous scan calling addressMatches on every device.
+Devices only count the commands they receive so routing dominates.
+
+Usage:
+    python -m benchmarks.address_routing [packets]
+"""
+import sys
+import time
+
+from pytomation.interfaces import HAInterface
+
+
+class RoutedDevice(object):
+    """ InterfaceDevice's address matching without the state machinery """
+    def __init__(self, address):
+        self.address = address
+        self.received = 0
+
+    def addressMatches(self, address):
+        match = self.address == None or self.address == address
+        if not match:
+            try:
+                match = self.address.lower() == address.lower()
+            except Exception, ex:
+                pass
+        return match
+
+    def matchedAddresses(self):
+        return [self.address]
+
+    def _on_command(self, command, address, source):
+        self.received += 1
+
+
+class IdleInterface(object):
+    disabled = False
+
+    def read(self, bufferSize=1024):
+        time.sleep(0.1)
+        return ''
+
+    def write(self, data):
+        return True
+
+
+def scan(interface, command, address):
+    # the routing loop before the address index
+    for device in interface._devices:
+        if device.addressMatches(address):
+            device._on_command(command=command, address=address, source=interface)
+
+
+def measure(count, packets):
+    interface = HAInterface(IdleInterface())
+    addresses = ['%02X.%02X.%02X' % (i >> 16 & 0xFF, i >> 8 & 0xFF, i & 0xFF) for i in xrange(count)]
+    for address in addresses:
+        interface.onCommand(device=RoutedDevice(address))
+    targets = [addresses[(i * 7919) % count].lower() for i in xrange(packets)]
+    interface._onCommand(command='on', address=targets[0])
+
+    start = time.time()
+    for address in targets:
+        interface._onCommand(command='on', address=address)
+    indexed = (time.time() - start) / packets
+
+    start = time.time()
+    for address in targets:
+        scan(interface, 'on', address)
+    scanned = (time.time() - start) / packets
+    interface.shutdown()
+    return indexed, scanned
+
+
+def main(packets=2000):
+    for count in (10, 100, 1000):
+        indexed, scanned = measure(count, packets)
+        print "%4d devices: index %.1fus/packet scan %.1fus/packet" % (count, indexed * 1e6, scanned * 1e6)
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
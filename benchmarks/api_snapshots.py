@@ -0,0 +1,73 @@
+"""
+Benchmark of the device listing and single device requests of the API.
+
+Creates a number of devices with sub-devices and times requests for
+"devices" and "device/<id>" through PytomationAPI.get_response, which
+serves cached JSON snapshots, against the previous path that rebuilt
+every detail dict and encoded it on each request.  A device changes state
+before every listing and every fiftieth single device request, so the
+snapshots are refreshed as they would be in use.
+
+Usage:
+    python -m benchmarks.api_snapshots [devices] [requests]
+"""
+import json
+import sys
+import time
+
+from pytomation.interfaces import Command
+from pytomation.devices import StateDevice, Light
+from pytomation.common import pytomation_system
+from pytomation.common.pytomation_api import PytomationAPI
+
+
+def uncached_devices():
+    # get_devices before the snapshot cache
+    devices = []
+    for (k, v) in pytomation_system.get_instances_detail().iteritems():
+        try:
+            v.update({'id': k})
+            a = v['instance']
+            b = a.state
+            del v['instance']
+            devices.append(v)
+        except Exception, ex:
+            pass
+    return json.dumps(devices)
+
+
+def uncached_device(id):
+    detail = pytomation_system.get_instance_detail(id)
+    detail.update({'id': id})
+    del detail['instance']
+    return json.dumps(detail)
+
+
+def rate(requests, f, devices, every=1):
+    start = time.time()
+    for i in xrange(requests):
+        if i % every == 0:
+            # a device changes state between requests
+            devices[(i * 7) % len(devices)].command(Command.TOGGLE)
+        f(i)
+    return requests / (time.time() - start)
+
+
+def main(count=500, requests=200):
+    switches = [StateDevice(name='switch %d' % i) for i in xrange(count / 2)]
+    lights = [Light(switches[i], name='light %d' % i) for i in xrange(count - count / 2)]
+    devices = switches + lights
+    ids = [device.type_id for device in devices]
+    api = PytomationAPI()
+
+    cached = rate(requests, lambda i: api.get_response(method='GET', path='devices'), devices)
+    uncached = rate(requests, lambda i: uncached_devices(), devices)
+    print "%d devices, devices: cached %.0f req/s uncached %.0f req/s" % (count, cached, uncached)
+
+    cached = rate(requests * 10, lambda i: api.get_response(method='GET', path='device/' + ids[i % count]), devices, 50)
+    uncached = rate(requests * 10, lambda i: uncached_device(ids[i % count]), devices, 50)
+    print "%d devices, device/<id>: cached %.0f req/s uncached %.0f req/s" % (count, cached, uncached)
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
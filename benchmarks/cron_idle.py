@@ -0,0 +1,37 @@
+"""
+Benchmark of idle CPU used by scheduled CronTimers.
+
+Starts a number of CronTimers scheduled once a day, then sleeps and
+reports the process CPU time consumed while nothing is due.
+
+Usage:
+    python -m benchmarks.cron_idle [timers] [seconds]
+"""
+import sys
+import time
+
+import pytomation.interfaces
+from pytomation.utility import CronTimer
+
+
+def noop():
+    pass
+
+
+def main(count=200, secs=10):
+    timers = []
+    for i in xrange(count):
+        timer = CronTimer()
+        timer.interval(secs=0, min=i % 60, hour=3)
+        timer.action(noop, ())
+        timer.start()
+        timers.append(timer)
+    start = time.clock()
+    time.sleep(secs)
+    print "cpu seconds over %ds idle with %d timers: %.3f" % (secs, count, time.clock() - start)
+    for timer in timers:
+        timer.stop()
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
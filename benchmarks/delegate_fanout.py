@@ -0,0 +1,72 @@
+"""
+End to end latency of a scene delegating to many devices.
+
+A sensor commands a scene of devices, each of which waits before taking
+its state as a device sending to its interface would wait for the
+acknowledgement.  Times how long the thread delivering the sensor event
+is held and when each device of the scene has its new state, with the
+delegations run in place and then queued to the dispatcher workers.
+
+Usage:
+    python -m benchmarks.delegate_fanout [devices] [ack ms] [workers] [events]
+"""
+import sys
+import threading
+import time
+
+from pytomation.interfaces import Command
+from pytomation.devices import StateDevice
+
+
+class AckDevice(StateDevice):
+    ack = 0.02
+
+    def command(self, *args, **kwargs):
+        if kwargs.get('source') is not None and kwargs.get('source') is not self:
+            time.sleep(self.ack)
+        return super(AckDevice, self).command(*args, **kwargs)
+
+
+def run(sensor, scene, events, dispatcher):
+    held = []
+    latencies = []
+    changed = {}
+    done = threading.Event()
+    def state_changed(state, source, prev, device):
+        if device in scene:
+            changed[device] = time.time()
+            if len(changed) == len(scene):
+                done.set()
+    StateDevice.onStateChangedGlobal(state_changed)
+    for i in xrange(events):
+        changed.clear()
+        done.clear()
+        start = time.time()
+        sensor.command(Command.ON if i % 2 == 0 else Command.OFF)
+        held.append(time.time() - start)
+        done.wait(60)
+        if dispatcher:
+            dispatcher.wait()
+        latencies.extend(at - start for at in changed.values())
+    StateDevice._delegates_state_change.remove(state_changed)
+    latencies.sort()
+    return (sum(held) / len(held),
+            latencies[len(latencies) / 2],
+            latencies[int(len(latencies) * 0.99)],
+            latencies[-1])
+
+
+def main(count=50, ack=20, workers=16, events=5):
+    AckDevice.ack = ack / 1000.0
+    sensor = StateDevice(name='sensor')
+    scene = set(AckDevice(devices=sensor, name='scene %d' % i) for i in xrange(count))
+    for (name, pool) in (('in place', 0), ('dispatched', workers)):
+        dispatcher = StateDevice.dispatch_delegates(pool)
+        (held, median, p99, last) = run(sensor, scene, events, dispatcher)
+        print "%-13s %d devices %dms ack: sensor held %.1fms, state p50 %.1fms p99 %.1fms last %.1fms" % (
+            name if not pool else '%s/%d' % (name, pool), count, ack, held * 1e3, median * 1e3, p99 * 1e3, last * 1e3)
+    StateDevice.dispatch_delegates(0)
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
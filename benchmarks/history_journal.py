@@ -0,0 +1,63 @@
+"""
+Cost of keeping the history of device states.
+
+Times the commands of a set of devices with and without the journal
+recording every state change, then how fast the journal thread commits
+changes recorded faster than it can keep up with, and how long it takes
+to read back one device's history from a long journal.
+
+Usage:
+    python -m benchmarks.history_journal [devices] [commands] [events]
+"""
+import shutil
+import sys
+import tempfile
+import time
+
+from pytomation.interfaces import Command
+from pytomation.devices import StateDevice, State
+from pytomation.common.state_journal import StateJournal
+
+
+def commands(devices, count):
+    start = time.time()
+    for i in xrange(count):
+        devices[i % len(devices)].command((Command.LEVEL, i % 100))
+    return count / (time.time() - start)
+
+
+def main(count=100, command_count=20000, events=200000):
+    directory = tempfile.mkdtemp()
+    try:
+        devices = [StateDevice(name='history %d' % i) for i in xrange(count)]
+        plain = commands(devices, command_count)
+        journal = StateJournal(directory)
+        StateDevice.onStateChangedGlobal(journal.record)
+        journaled = commands(devices, command_count)
+        journal.flush()
+        StateDevice._delegates_state_change.remove(journal.record)
+        print "%d commands: %.0f/s without the journal, %.0f/s with it" % (command_count, plain, journaled)
+
+        start = time.time()
+        for i in xrange(events):
+            journal.record((State.LEVEL, i % 100), prev=State.ON, device=devices[i % count])
+        recorded = time.time() - start
+        journal.flush()
+        committed = time.time() - start
+        print "%d events: recorded in %.1fus/event, committed at %.0f events/s" % (
+            events, recorded / events * 1e6, events / committed)
+
+        start = time.time()
+        history = journal.history('history 0')
+        queried = time.time() - start
+        start = time.time()
+        recent = journal.history('history 0', start=time.time() - 60)
+        print "history of one device: %d events in %.1fms, %d of the last minute in %.1fms" % (
+            len(history), queried * 1e3, len(recent), (time.time() - start) * 1e3)
+        journal.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
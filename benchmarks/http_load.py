@@ -0,0 +1,89 @@
+"""
+Load test of the API served by pytomation.interfaces.http_server.
+
+Starts the server on a local port with a set of devices and runs
+concurrent clients requesting "/api/devices" and then a single device,
+first against the pooled
+HTTP/1.1 server with persistent connections, then against the previous
+thread per request HTTP/1.0 server with a new connection per request.
+Reports throughput and the median and 99th percentile latency.
+
+Usage:
+    python -m benchmarks.http_load [clients] [requests per client] [workers]
+"""
+import base64
+import httplib
+import sys
+import threading
+import time
+
+from pytomation.interfaces import Command
+from pytomation.interfaces.http_server import PytoHandlerClass, PooledHTTPServer, ThreadedHTTPServer
+from pytomation.devices import StateDevice
+from pytomation.common import config
+from pytomation.common.pytomation_api import PytomationAPI
+
+
+class QuietHandler(PytoHandlerClass):
+    def log_message(self, format, *args):
+        pass
+
+
+def client(port, path, requests, persistent, latencies):
+    headers = {'Authorization': 'Basic ' + base64.b64encode(config.admin_user + ':' + config.admin_password)}
+    connection = httplib.HTTPConnection('127.0.0.1', port)
+    for i in xrange(requests):
+        start = time.time()
+        if not persistent:
+            connection = httplib.HTTPConnection('127.0.0.1', port)
+        connection.request('GET', path, headers=headers)
+        response = connection.getresponse()
+        response.read()
+        if not persistent:
+            connection.close()
+        latencies.append(time.time() - start)
+    connection.close()
+
+
+def measure(server, protocol, path, clients, requests):
+    QuietHandler.protocol_version = protocol
+    serving = threading.Thread(target=server.serve_forever)
+    serving.setDaemon(True)
+    serving.start()
+    port = server.socket.getsockname()[1]
+
+    latencies = []
+    threads = [threading.Thread(target=client, args=(port, path, requests, protocol == 'HTTP/1.1', latencies))
+               for i in xrange(clients)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+    server.shutdown()
+    server.server_close()
+
+    latencies.sort()
+    return (len(latencies) / elapsed,
+            latencies[len(latencies) / 2],
+            latencies[int(len(latencies) * 0.99)])
+
+
+def main(clients=50, requests=100, workers=8):
+    devices = [StateDevice(name='device %d' % i) for i in xrange(100)]
+    for device in devices[::2]:
+        device.command(Command.ON)
+    QuietHandler.api = PytomationAPI()
+
+    for path in ('/api/devices', '/api/device/' + devices[0].type_id):
+        for (name, server, protocol) in (
+                ('pooled HTTP/1.1', PooledHTTPServer(('127.0.0.1', 0), QuietHandler, workers=workers), 'HTTP/1.1'),
+                ('threaded HTTP/1.0', ThreadedHTTPServer(('127.0.0.1', 0), QuietHandler), 'HTTP/1.0')):
+            (rate, median, p99) = measure(server, protocol, path, clients, requests)
+            print "%-18s %-24s %d clients: %.0f req/s p50 %.1fms p99 %.1fms" % (
+                name, path, clients, rate, median * 1e3, p99 * 1e3)
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
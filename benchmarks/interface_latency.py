@@ -0,0 +1,52 @@
+"""
+Benchmark of HAInterface inbound latency over a pty-backed serial device.
+
+Opens a pseudo terminal, attaches an HAInterface to the slave end through
+the regular Serial interface and writes a packet to the master end at
+random offsets, timing how long each takes to reach an onCommand
+callback.  Runs once with select() based I/O and once with the interface
+hidden behind a wrapper without fileno(), which is the sleep-polling loop.
+
+Usage:
+    python -m benchmarks.interface_latency [packets]
+"""
+import os
+import random
+import sys
+import threading
+import time
+
+from pytomation.interfaces import HAInterface, Serial
+
+
+class PollingSerial(Serial):
+    def fileno(self):
+        return None
+
+
+def measure(interface_class, count):
+    master, slave = os.openpty()
+    interface = HAInterface(interface_class(os.ttyname(slave), serialTimeout=0.01))
+    received = threading.Event()
+    interface.onCommand(callback=lambda *args, **kwargs: received.set())
+    time.sleep(0.5)
+    latencies = []
+    for i in xrange(count):
+        time.sleep(random.uniform(0, 0.5))
+        received.clear()
+        start = time.time()
+        os.write(master, 'x')
+        received.wait(5)
+        latencies.append(time.time() - start)
+    interface.shutdown()
+    latencies.sort()
+    return latencies[len(latencies) // 2], latencies[-1]
+
+
+def main(count=20):
+    print "select : median %.4fs max %.4fs" % measure(Serial, count)
+    print "polling: median %.4fs max %.4fs" % measure(PollingSerial, count)
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
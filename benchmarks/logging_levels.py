@@ -0,0 +1,71 @@
+"""
+Benchmark of StateDevice command throughput at different logging levels.
+
+Drives a small chain of devices (source -> member -> light with an idle
+timer) with alternating on/off commands and reports commands/sec with the
+device loggers set to ERROR and INFO.  Also reports the cost of a single
+disabled debug statement formatted eagerly versus through PytoLogging's
+deferred arguments.
+
+Usage:
+    python -m benchmarks.logging_levels [commands]
+"""
+import logging
+import sys
+import time
+import timeit
+
+from pytomation.interfaces import Command
+from pytomation.devices import StateDevice, Light
+from pytomation.common import PytoLogging
+
+LOGGERS = ('StateDevice', 'Light')
+
+
+def build_chain():
+    source = StateDevice(name='bench source')
+    member = StateDevice(name='bench member', devices=source)
+    light = Light(name='bench light', devices=member,
+                  idle={'command': Command.ON, 'mapped': Command.OFF, 'secs': 3600})
+    return source
+
+
+def run(source, count):
+    start = time.time()
+    for i in xrange(count):
+        if i % 2:
+            source.off()
+        else:
+            source.on()
+    return count / (time.time() - start)
+
+
+def log_call_cost(iterations=100000):
+    logger = PytoLogging('BenchmarkLogging')
+    logger.setLevel(logging.ERROR)
+    device = StateDevice(name='bench log')
+    eager = timeit.timeit(lambda: logger.debug("{name} command {command} from {source}".format(
+                                                   name=device.name,
+                                                   command=Command.ON,
+                                                   source=device.name,
+                                                   )), number=iterations)
+    deferred = timeit.timeit(lambda: logger.debug("{name} command {command} from {source}",
+                                                  name=device.name,
+                                                  command=Command.ON,
+                                                  source=device.name,
+                                                  ), number=iterations)
+    print "disabled debug, eager format : %8.0f calls/sec" % (iterations / eager)
+    print "disabled debug, deferred     : %8.0f calls/sec" % (iterations / deferred)
+
+
+def main(count=2000):
+    log_call_cost()
+    source = build_chain()
+    for level_name in ('ERROR', 'INFO'):
+        for name in LOGGERS:
+            logging.getLogger(name).setLevel(getattr(logging, level_name))
+        print "%-5s: %8.0f commands/sec" % (level_name, run(source, count))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:2]])
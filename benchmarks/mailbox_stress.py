@@ -0,0 +1,97 @@
+"""
+Concurrency stress of interlinked devices.
+
+Devices are linked in small rings delegating both ways, and threads fire
+commands at them interleaved, as interface readers, timers and the API
+would.  With the devices' command locks a cascade running around a ring
+comes back to a device it holds the lock of, or meets a cascade coming
+the other way, and stalls; a watchdog reports how far it got.  With
+mailboxes every command is queued and run in the device's turn; the run
+reports the throughput, the commands run including delegations and
+whether any device ever ran two commands at once.
+
+Usage:
+    python -m benchmarks.mailbox_stress [commands] [devices] [ring] [threads] [workers]
+"""
+import sys
+import threading
+import time
+
+from pytomation.interfaces import Command
+from pytomation.devices import StateDevice
+
+
+class CheckedDevice(StateDevice):
+    overlaps = 0
+    _running_command = False
+    _ran = 0  # commands run, never two at once on the same device
+
+    def _command(self, *args, **kwargs):
+        if self._running_command:
+            CheckedDevice.overlaps += 1
+        self._running_command = True
+        self._ran += 1
+        try:
+            return super(CheckedDevice, self)._command(*args, **kwargs)
+        finally:
+            self._running_command = False
+
+
+def build(count, ring):
+    devices = []
+    for i in xrange(count):
+        devices.append(CheckedDevice(name='stress %d' % i))
+    for start in xrange(0, count, ring):
+        members = devices[start:start + ring]
+        for (i, device) in enumerate(members):
+            device.add_device(members[i - 1])
+            members[i - 1].add_device(device)
+    for device in devices:
+        device._ran = 0
+    return devices
+
+
+def fire(devices, commands, threads, fired):
+    def run(offset):
+        for i in xrange(offset, commands, threads):
+            devices[(i * 7919) % len(devices)].command(Command.ON if i % 3 else Command.OFF)
+            fired[offset] += 1
+    workers = [threading.Thread(target=run, args=(offset, )) for offset in xrange(threads)]
+    for worker in workers:
+        worker.daemon = True
+        worker.start()
+    return workers
+
+
+def ran(devices):
+    return sum(device._ran for device in devices)
+
+
+def main(commands=100000, count=100, ring=3, threads=8, workers=8):
+    CheckedDevice.overlaps = 0
+    devices = build(count, ring)
+    fired = [0] * threads
+    start = time.time()
+    for worker in fire(devices, commands, threads, fired):
+        worker.join(10 - (time.time() - start))
+    print "command locks: %d of %d commands fired, %d run, %s after %.1fs" % (
+        sum(fired), commands, ran(devices),
+        'stalled' if sum(fired) < commands else 'finished', time.time() - start)
+
+    CheckedDevice.overlaps = 0
+    mailboxes = StateDevice.use_mailboxes(workers)
+    devices = build(count, ring)
+    fired = [0] * threads
+    start = time.time()
+    for worker in fire(devices, commands, threads, fired):
+        worker.join()
+    mailboxes.wait()
+    elapsed = time.time() - start
+    print "mailboxes/%d: %d commands fired, %d run, %.0f commands/s, %d overlapping, %d pending, states %s" % (
+        workers, sum(fired), ran(devices), ran(devices) / elapsed, CheckedDevice.overlaps,
+        mailboxes.pending(), sorted(set(device.state for device in devices)))
+    StateDevice.use_mailboxes(0)
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
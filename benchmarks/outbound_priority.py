@@ -0,0 +1,62 @@
+"""
+Benchmark of interactive command latency behind a status sweep.
+
+Queues a sweep of status requests on an HAInterface, then an interactive
+command, and reports how long the interactive command waited before
+being written.  Run once with the interactive command queued at
+Priority.INTERACTIVE and once at Priority.STATUS (plain FIFO order).
+
+Usage:
+    python -m benchmarks.outbound_priority [sweep size] [intersend delay]
+"""
+import os
+import sys
+import threading
+import time
+
+from pytomation.interfaces import HAInterface
+from pytomation.common.command_priority import Priority, command_priority
+
+
+class RecordingInterface(object):
+    disabled = False
+
+    def __init__(self):
+        self._read_fd, self._write_fd = os.pipe()
+        self.written = threading.Event()
+
+    def fileno(self):
+        return self._read_fd
+
+    def read(self, bufferSize=1024):
+        return ''
+
+    def write(self, data):
+        if data == 'interactive':
+            self.written.set()
+        return True
+
+
+def measure(priority, count, delay):
+    device = RecordingInterface()
+    interface = HAInterface(device)
+    interface._intersend_delay = delay
+    with command_priority(Priority.STATUS):
+        for i in xrange(count):
+            interface._sendInterfaceCommand('status %d' % i)
+    start = time.time()
+    with command_priority(priority):
+        interface._sendInterfaceCommand('interactive')
+    device.written.wait(count * delay * 2 + 5)
+    elapsed = time.time() - start
+    interface.shutdown()
+    return elapsed
+
+
+def main(count=50, delay=0.02):
+    print "interactive priority: %.3fs" % measure(Priority.INTERACTIVE, int(count), float(delay))
+    print "fifo (same priority): %.3fs" % measure(Priority.STATUS, int(count), float(delay))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -0,0 +1,60 @@
+"""
+Microbenchmark for StateDevice map resolution.
+
+Compares the compiled (command, source) lookup used by
+StateDevice._process_maps against the previous linear scan over
+StateDevice._maps for a device carrying a large number of mappings.
+
+Usage:
+    python -m benchmarks.process_maps [maps] [iterations]
+"""
+import sys
+import timeit
+
+from pytomation.interfaces import Command
+from pytomation.devices import StateDevice, Attribute
+
+
+def linear_process_maps(device, command, source):
+    # Reference implementation of the scan StateDevice used to perform
+    for (c, s), (target, timer) in device._maps.iteritems():
+        sources = s if isinstance(s, tuple) else (s, )
+        commands = c if isinstance(c, tuple) else (c, )
+        if command in commands and source in sources:
+            return target
+        if command in commands and None in sources:
+            return target
+    return command
+
+
+def build_device(map_count):
+    sources = [StateDevice(name='bench source %d' % i) for i in range(map_count)]
+    device = StateDevice(name='bench target')
+    for i, source in enumerate(sources):
+        device.mapped(command='bench%d' % i, source=source, mapped=Command.ON)
+        device.mapped(command='general%d' % i, mapped=Command.OFF)
+    return (device, sources)
+
+
+def main(map_count=50, iterations=100000):
+    (device, sources) = build_device(map_count)
+    source = sources[-1]
+    command = 'bench%d' % (map_count - 1)
+    kwargs = {Attribute.COMMAND: command, Attribute.SOURCE: source}
+
+    assert device._process_maps(**kwargs) == linear_process_maps(device, command, source)
+
+    compiled = timeit.timeit(lambda: device._process_maps(**kwargs), number=iterations)
+    linear = timeit.timeit(lambda: linear_process_maps(device, command, source), number=iterations)
+    miss = timeit.timeit(lambda: device._process_maps(command=Command.TOGGLE, source=source),
+                         number=iterations)
+
+    print "Maps per device: %d, iterations: %d" % (len(device._maps), iterations)
+    print "  linear scan : %8.0f lookups/sec" % (iterations / linear)
+    print "  compiled    : %8.0f lookups/sec" % (iterations / compiled)
+    print "  compiled miss: %7.0f lookups/sec" % (iterations / miss)
+    print "  speedup     : %8.1fx" % (linear / compiled)
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:3]])
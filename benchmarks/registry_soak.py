@@ -0,0 +1,47 @@
+"""
+Soak test of the object registry under API requests.
+
+Every request constructs its own PytomationAPI and answers a device
+listing or a single device, as the HTTP handlers did for each request,
+while a device keeps changing state.  Prints the registry sizes, the
+transient objects still alive and the peak memory at intervals; all of
+them stay flat when nothing created per request is kept.
+
+Usage:
+    python -m benchmarks.registry_soak [requests]
+"""
+import resource
+import sys
+import time
+
+from pytomation.interfaces import Command
+from pytomation.devices import StateDevice
+from pytomation.common import PytomationObject
+from pytomation.common.pytomation_api import PytomationAPI
+
+
+def sizes():
+    return (len(PytomationObject.instances),
+            len(PytomationObject.name_to_id_map),
+            len(PytomationObject.sorted_names_by_length),
+            len(PytomationObject.transient_instances),
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+
+def main(requests=1000000):
+    devices = [StateDevice(name='device %d' % i) for i in xrange(20)]
+    paths = ['devices'] + ['device/' + device.type_id for device in devices]
+    print "%9s %9s %9s %9s %9s %9s" % ('requests', 'instances', 'names', 'sorted', 'transient', 'maxrss KB')
+    print "%9d %9d %9d %9d %9d %9d" % ((0,) + sizes())
+    start = time.time()
+    for i in xrange(1, requests + 1):
+        if i % 100 == 0:
+            devices[i / 100 % len(devices)].command(Command.TOGGLE)
+        PytomationAPI().get_response(method='GET', path=paths[i % len(paths)])
+        if i % (requests / 10) == 0:
+            print "%9d %9d %9d %9d %9d %9d" % ((i,) + sizes())
+    print "%.1fus/request" % ((time.time() - start) / requests * 1e6)
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
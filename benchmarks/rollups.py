@@ -0,0 +1,60 @@
+"""
+Cost of the rollups of numeric devices.
+
+Feeds a set of devices a day of level samples at a fixed rate, through the
+same path as their state changes, and prints the rate samples are added,
+the memory the rollups hold per device against what keeping the raw
+samples would take, and how long reading a day of minute buckets back
+for a chart takes.
+
+Usage:
+    python -m benchmarks.rollups [devices] [seconds between samples]
+"""
+import sys
+import time
+
+from pytomation.interfaces import Command
+from pytomation.devices import StateDevice, State
+from pytomation.common.rollups import Rollups
+
+
+def main(count=20, interval=5):
+    devices = [StateDevice(name='rollups %d' % i) for i in xrange(count)]
+    rollups = Rollups()
+    samples = 86400 / interval
+    start = time.time()
+    for i in xrange(samples):
+        at = i * interval
+        for (j, device) in enumerate(devices):
+            rollups.add(device.name, 65 + (i + j) % 10, at=at)
+    added = time.time() - start
+    print "%d devices, %d samples each: %.1fus/sample, %.0f samples/s" % (
+        count, samples, added / (samples * count) * 1e6, samples * count / added)
+
+    # a (time, value) tuple of floats in a list: 8 for the slot, 72 for the tuple, 2 * 24 for the floats
+    raw = samples * (8 + 72 + 2 * 24)
+    print "memory per device: %.0fKB for the rollups, %.0fKB for the raw samples of a day" % (
+        rollups.memory() / count / 1024.0, raw / 1024.0)
+
+    start = time.time()
+    for device in devices:
+        buckets = rollups.buckets(device.name)
+    print "a day of minute buckets (%d): %.2fms/device" % (len(buckets), (time.time() - start) / count * 1e3)
+
+    # at the current time, through the state change delegate
+    rollups = Rollups()
+    StateDevice.onStateChangedGlobal(rollups.record)
+    start = time.time()
+    for i in xrange(10000):
+        devices[i % count].command((Command.LEVEL, i % 100))
+    commands = time.time() - start
+    StateDevice._delegates_state_change.remove(rollups.record)
+    start = time.time()
+    for i in xrange(10000):
+        devices[i % count].command((Command.LEVEL, i % 100 + 1))
+    print "level commands: %.1fus with the rollups, %.1fus without" % (
+        commands / 10000 * 1e6, (time.time() - start) / 10000 * 1e6)
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,40 @@
+"""
+Benchmark of Timer start/restart cost.
+
+Creates a set of long interval timers, restarts each of them repeatedly
+the way idle and delay timers are restarted by motion events, and reports
+restarts/sec and the number of threads alive afterwards.
+
+Usage:
+    python -m benchmarks.timer_restart [timers] [restarts]
+"""
+import sys
+import threading
+import time
+
+import pytomation.interfaces
+from pytomation.utility.timer import Timer
+
+
+def noop():
+    pass
+
+
+def main(count=1000, restarts=20):
+    timers = [Timer(3600) for i in xrange(count)]
+    for timer in timers:
+        timer.action(noop, ())
+    threads = threading.active_count()
+    start = time.time()
+    for i in xrange(restarts):
+        for timer in timers:
+            timer.restart()
+    elapsed = time.time() - start
+    print "restarts/sec : %8.0f" % (count * restarts / elapsed)
+    print "threads      : %8d (%d before)" % (threading.active_count(), threads)
+    for timer in timers:
+        timer.stop()
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
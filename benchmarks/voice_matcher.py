@@ -0,0 +1,84 @@
+"""
+Benchmark of finding the device and command in a voice command.
+
+Registers a number of devices with generated names and times resolving
+phrases to a device name and command word through the name matcher used
+by PytomationAPI.run_voice_command, against the previous scan calling
+find() for every registered name, longest first, and then for every
+command of the device.  Registering the names the previous way, sorting
+the whole list after each one, is timed as well.
+
+Usage:
+    python -m benchmarks.voice_matcher [devices] [phrases]
+"""
+import sys
+import time
+
+from pytomation.interfaces import Command
+from pytomation.devices import Light
+from pytomation.common import PytomationObject
+from pytomation.common.pytomation_api import PytomationAPI
+
+ROOMS = ['kitchen', 'living room', 'bedroom', 'garage', 'porch', 'office', 'hall', 'basement']
+THINGS = ['light', 'lamp', 'fan', 'outlet', 'spot', 'sconce', 'strip', 'pendant']
+
+
+def scan(names, command):
+    # run_voice_command before the name matcher
+    for dev_name in names:
+        if command.find(dev_name) != -1:
+            command = command.replace(dev_name, '')
+            device = PytomationObject.instances[PytomationObject.name_to_id_map[dev_name]]
+            for device_command in device.COMMANDS:
+                if command.find(device_command) != -1:
+                    return (dev_name, device_command)
+            return (dev_name, None)
+    return (None, None)
+
+
+def match(command):
+    dev_name = PytomationAPI._find_device_name(command)
+    if not dev_name:
+        return (None, None)
+    device = PytomationObject.instances[PytomationObject.name_to_id_map[dev_name]]
+    return (dev_name, PytomationAPI._find_device_command(device, command.replace(dev_name, '')))
+
+
+def main(count=2000, phrases=500):
+    names = ['%s %s %d' % (ROOMS[i % len(ROOMS)], THINGS[i / len(ROOMS) % len(THINGS)], i)
+             for i in xrange(count)]
+    start = time.time()
+    sorted_names = []
+    for name in names:
+        sorted_names.append(name)
+        sorted_names.sort(key=len)
+        sorted_names.reverse()
+    sorting = time.time() - start
+    start = time.time()
+    devices = [Light(name=name) for name in names]
+    registering = time.time() - start
+    print "%d devices: registering %.0fus/device, sorting the names after each took %.0fus/device" % (
+        count, registering / count * 1e6, sorting / count * 1e6)
+
+    words = [Command.ON, Command.OFF, 'dim', Command.TOGGLE]
+    utterances = ['please turn the %s %s' % (names[(i * 7919) % count], words[i % len(words)])
+                  for i in xrange(phrases)]
+    utterances.append('open the pod bay doors')
+    names = PytomationObject.sorted_names_by_length
+
+    for utterance in utterances:
+        assert scan(names, utterance) == match(utterance), utterance
+
+    start = time.time()
+    for utterance in utterances:
+        match(utterance)
+    matched = (time.time() - start) / len(utterances)
+    start = time.time()
+    for utterance in utterances:
+        scan(names, utterance)
+    scanned = (time.time() - start) / len(utterances)
+    print "%d devices: matcher %.1fus/phrase scan %.1fus/phrase" % (count, matched * 1e6, scanned * 1e6)
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
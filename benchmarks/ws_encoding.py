@@ -0,0 +1,54 @@
+"""
+Size and throughput of the websocket state change encodings.
+
+Drives thermostats and dimmed lights through level changes, the bulk of
+the traffic on /api/bridge, and encodes every state change both as the
+default JSON message and in the compact encoding.  Reports the bytes per
+message, also after deflating each message as a compressing websocket
+would, the size of the device table sent once to compact clients and the
+messages encoded per second.
+
+Usage:
+    python -m benchmarks.ws_encoding [devices] [changes]
+"""
+import sys
+import time
+import zlib
+
+from pytomation.interfaces import Command
+from pytomation.devices import StateDevice, Light, Thermostat
+from pytomation.common.pytomation_api import PytomationAPI
+
+
+def deflated(message):
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return len(compressor.compress(message) + compressor.flush(zlib.Z_SYNC_FLUSH))
+
+
+def main(count=100, changes=20000):
+    api = PytomationAPI()
+    devices = [Thermostat(name='thermostat %d' % i) for i in xrange(count / 2)] + \
+              [Light(name='light %d' % i) for i in xrange(count - count / 2)]
+    table = api.get_device_table()[1]
+
+    changed = []
+    StateDevice.onStateChangedGlobal(lambda state, source, prev, device: changed.append((state, source, prev, device)))
+    for i in xrange(changes):
+        devices[i % count].command((Command.LEVEL, 60 + i / count % 20))
+
+    for (name, encode) in (('json', api.get_state_changed_message),
+                           ('compact', api.get_compact_state_changed_message)):
+        messages = [encode(*change) for change in changed]
+        start = time.time()
+        for change in changed:
+            encode(*change)
+        elapsed = time.time() - start
+        size = sum(len(message) for message in messages)
+        print "%-8s %6.1f bytes/message %6.1f deflated %8.0f messages/s %7d bytes for %d changes" % (
+            name, float(size) / len(messages), float(sum(deflated(message) for message in messages)) / len(messages),
+            len(messages) / elapsed, size, len(messages))
+    print "compact device table: %d bytes once per client" % len(table)
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
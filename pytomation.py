@@ -36,6 +36,13 @@ if __name__ == "__main__":
             http_address=config.http_address,
             http_port=config.http_port,
             http_path=config.http_path,
+            diagnostics_time=getattr(config, 'diagnostics_time', None),
+            state_file=getattr(config, 'state_file', None),
+            state_save_time=getattr(config, 'state_save_time', 2),
+            history_path=getattr(config, 'history_path', None),
+            history_segment_time=getattr(config, 'history_segment_time', 86400),
+            history_segments=getattr(config, 'history_segments', 30),
+            rollups=getattr(config, 'rollups', False),
         )
     else:
         print "No Scripts found. Exiting"
@@ -2,4 +2,10 @@ from .pytomation_system import *
 from .config import *
 from .pyto_logging import *
 from .pytomation_object import *
+from .pattern_matcher import *
+from .command_priority import *
+from .dispatch import *
+from .state_store import *
+from .state_journal import *
+from .rollups import *
 from .pytomation_api import *
@@ -0,0 +1,112 @@
+import threading
+from contextlib import contextmanager
+
+
+class Priority(object):
+    """
+    Priority classes for commands queued to an interface.  Lower values
+    are sent first.
+    """
+    INTERACTIVE = 0
+    AUTOMATION = 1
+    STATUS = 2
+    ALL = (INTERACTIVE, AUTOMATION, STATUS)
+
+_context = threading.local()
+
+def current_priority():
+    return getattr(_context, 'priority', Priority.AUTOMATION)
+
+@contextmanager
+def command_priority(priority):
+    """
+    Commands issued by this thread inside the block are queued with the
+    given priority, e.g. interactive requests from the API or a status sweep.
+    """
+    previous = current_priority()
+    _context.priority = priority
+    try:
+        yield
+    finally:
+        _context.priority = previous
+
+def waiting_for_commands():
+    return getattr(_context, 'wait', True)
+
+@contextmanager
+def command_nowait():
+    """
+    Commands issued by this thread inside the block return as soon as they
+    are queued instead of waiting for the interface to confirm them, e.g.
+    a device passing its new state on to its interfaces.
+    """
+    previous = waiting_for_commands()
+    _context.wait = False
+    try:
+        yield
+    finally:
+        _context.wait = previous
+
+class CommandBatch(object):
+    """
+    Interfaces that queued commands inside command_batch() blocks, possibly
+    on several threads.  flush() wakes each of them once, so an interface
+    sees the whole batch at the same time and can coalesce its commands.
+    """
+    def __init__(self):
+        self._wakeups = set()
+        self._flushed = False
+        self._lock = threading.Lock()
+
+    def defer(self, wakeup):
+        with self._lock:
+            if not self._flushed:
+                self._wakeups.add(wakeup)
+                return
+        # queued on another thread after the batch ended, nothing is left to wake it
+        wakeup()
+
+    def flush(self):
+        with self._lock:
+            wakeups = list(self._wakeups)
+            self._wakeups.clear()
+            self._flushed = True
+        for wakeup in wakeups:
+            wakeup()
+
+def current_batch():
+    return getattr(_context, 'batch', None)
+
+@contextmanager
+def command_batch(batch=None):
+    """
+    Interfaces are not woken for the commands this thread queues inside the
+    block until the batch is flushed, by the block itself unless a batch
+    shared with other threads is given.
+    """
+    previous = current_batch()
+    _context.batch = batch or CommandBatch()
+    try:
+        yield _context.batch
+    finally:
+        if not batch:
+            _context.batch.flush()
+        _context.batch = previous
+
+def current_context():
+    """ The priority, waiting and batch this thread issues commands with """
+    return (current_priority(), waiting_for_commands(), current_batch())
+
+@contextmanager
+def command_context(context):
+    """
+    Commands issued by this thread inside the block are issued as they
+    would have been where current_context() was taken, e.g. on a worker
+    running a command queued from there.
+    """
+    previous = current_context()
+    (_context.priority, _context.wait, _context.batch) = context
+    try:
+        yield
+    finally:
+        (_context.priority, _context.wait, _context.batch) = previous
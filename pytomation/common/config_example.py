@@ -35,6 +35,19 @@ http_path = "./pytomation_web"
 #ssl_path = "./ssl"
 telnet_port = None
 loop_time = 1
+# Seconds between logging memory diagnostics (None to disable)
+diagnostics_time = None
+# File keeping the state of the devices across restarts (None to disable)
+state_file = None
+# Seconds between writes of the state file when devices changed
+state_save_time = 2
+# Directory keeping the history of device states (None to disable)
+history_path = None
+# Seconds of history in each file, and how many files to keep
+history_segment_time = 86400
+history_segments = 30
+# Keep min/max/avg of numeric device states by the minute, quarter hour and hour
+rollups = False
 
 device_send_always = False
 
@@ -0,0 +1,138 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from .pyto_logging import PytoLogging
+
+
+class Task(object):
+    """ A function submitted to a SerialExecutor, to wait for if needed """
+    __slots__ = ('function', 'args', 'kwargs', 'done', 'result', '_finished')
+
+    def __init__(self, function, args, kwargs, finished):
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.done = False
+        self.result = None
+        self._finished = finished
+
+    def wait(self, timeout=None):
+        """ Waits until the task has run, True unless timed out """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._finished:
+            while not self.done:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    break
+                self._finished.wait(remaining)
+            return self.done
+
+
+class SerialExecutor(object):
+    """
+    Runs tasks on a pool of worker threads.  Tasks submitted with the same
+    key run one at a time in the order they were submitted, tasks of
+    different keys run side by side.
+    """
+    def __init__(self, workers=8, name='SerialExecutor'):
+        self._logger = PytoLogging(self.__class__.__name__)
+        self._tasks = {}  # key: tasks waiting, present while the key is queued or running
+        self._ready = deque()  # keys with a task waiting and no worker on it
+        self._lock = threading.Lock()
+        self._condition = threading.Condition(self._lock)  # workers wait for tasks
+        self._finished = threading.Condition(self._lock)  # the rest wait for them to run
+        self._closed = False
+        self._running = threading.local()
+        self._threads = []
+        for i in xrange(workers):
+            thread = threading.Thread(target=self._work, name='%s-%d' % (name, i))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, key, function, *args, **kwargs):
+        task = Task(function, args, kwargs, self._finished)
+        with self._condition:
+            tasks = self._tasks.get(key)
+            if tasks is None:
+                self._tasks[key] = deque([task])
+                self._ready.append(key)
+                self._condition.notify()
+            else:
+                tasks.append(task)
+        return task
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while not self._ready and not self._closed:
+                    self._condition.wait()
+                if not self._ready:
+                    return
+                key = self._ready.popleft()
+                task = self._tasks[key].popleft()
+            self._running.key = key
+            try:
+                task.result = task.function(*task.args, **task.kwargs)
+            except Exception, ex:
+                self._logger.error("Task for {key} failed: {ex}", key=key, ex=ex)
+            self._running.key = None
+            with self._condition:
+                task.done = True
+                task.function = task.args = task.kwargs = None
+                self._finished.notify_all()
+                if self._tasks[key]:
+                    # behind the other keys waiting, so a busy key can not starve them
+                    self._ready.append(key)
+                    self._condition.notify()
+                else:
+                    del self._tasks[key]
+
+    def wait(self, timeout=None):
+        """ Waits until every task submitted has run, True unless timed out """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._finished:
+            while self._tasks:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    break
+                self._finished.wait(remaining)
+            return not self._tasks
+
+    def running(self):
+        """ The key of the task the calling thread is running, if it is a worker """
+        return getattr(self._running, 'key', None)
+
+    def pending(self):
+        with self._condition:
+            return sum(len(tasks) for tasks in self._tasks.values())
+
+    def shutdown(self):
+        """ Stops the workers once the tasks already submitted have run """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        for thread in self._threads:
+            if thread is not threading.current_thread():
+                thread.join()
+
+
+_context = threading.local()
+
+def current_cascade():
+    return getattr(_context, 'cascade', frozenset())
+
+@contextmanager
+def cascade(devices):
+    """
+    Commands issued by this thread inside the block belong to a cascade the
+    devices have already taken part in, so they are not delegated back to them.
+    """
+    previous = current_cascade()
+    _context.cascade = devices
+    try:
+        yield
+    finally:
+        _context.cascade = previous
@@ -0,0 +1,92 @@
+import threading
+from collections import deque
+
+
+class PatternMatcher(object):
+    """
+    Finds every occurrence of a set of strings in a text in one pass
+    (Aho-Corasick).  Patterns can be added at any time; adding one only
+    extends the trie, the failure links are rebuilt by the next search.
+    """
+    def __init__(self, patterns=None):
+        self._goto = [{}]  # state: {character: state}
+        self._value = [None]  # state: (length, value) of the pattern ending there
+        self._fail = None
+        self._output = None  # state: patterns ending there or at its failure states
+        self._lock = threading.Lock()
+        for pattern in patterns or ():
+            self.add(pattern)
+
+    def add(self, pattern, value=None):
+        """ Adds a pattern, found with value or else the pattern itself """
+        if not pattern:
+            return
+        with self._lock:
+            state = 0
+            for character in pattern:
+                next_state = self._goto[state].get(character)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto.append({})
+                    self._value.append(None)
+                    self._goto[state][character] = next_state
+                state = next_state
+            self._value[state] = (len(pattern), pattern if value is None else value)
+            self._fail = None
+
+    def __contains__(self, pattern):
+        state = 0
+        for character in pattern:
+            state = self._goto[state].get(character)
+            if state is None:
+                return False
+        return self._value[state] is not None
+
+    def _build(self):
+        goto = self._goto
+        fail = [0] * len(goto)
+        output = [()] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            own = (self._value[state], ) if self._value[state] else ()
+            output[state] = own + output[fail[state]]
+            for (character, next_state) in goto[state].iteritems():
+                queue.append(next_state)
+                fallback = fail[state]
+                while fallback and character not in goto[fallback]:
+                    fallback = fail[fallback]
+                fail[next_state] = goto[fallback].get(character, 0) if state else 0
+        self._fail = fail
+        self._output = output
+
+    def find_all(self, text):
+        """ Every occurrence as (start, end, value), in order of their end """
+        with self._lock:
+            if self._fail is None:
+                self._build()
+            goto = self._goto
+            fail = self._fail
+            output = self._output
+            matches = []
+            state = 0
+            for (end, character) in enumerate(text, 1):
+                while state and character not in goto[state]:
+                    state = fail[state]
+                state = goto[state].get(character, 0)
+                for (length, value) in output[state]:
+                    matches.append((end - length, end, value))
+        return matches
+
+    def find(self, text):
+        """
+        The longest occurrences not overlapping each other, taken from the
+        left, as (start, end, value).
+        """
+        matches = []
+        position = 0
+        for match in sorted(self.find_all(text), key=lambda m: (m[0], m[0] - m[1])):
+            if match[0] >= position:
+                matches.append(match)
+                position = match[1]
+        return matches
@@ -1,4 +1,5 @@
 import logging
+import string
 from logging.handlers import TimedRotatingFileHandler
 
 try:
@@ -10,9 +11,24 @@ except ImportError:
     raise
 
 
+class _MessageFormatter(string.Formatter):
+    # str.format, plus {source!n} for the name of an object, None without one
+    def convert_field(self, value, conversion):
+        if conversion == 'n':
+            return getattr(value, 'name', None)
+        return super(_MessageFormatter, self).convert_field(value, conversion)
+
+_formatter = _MessageFormatter()
+
+
 class PytoLogging(object):
     """
     Provides pytomation specific logging.
+
+    Messages can be given str.format style arguments, e.g.
+    logger.debug('{name} on from {source!n}', name=name, source=source),
+    which are only formatted when the level is enabled for this logger.
+    !n formats an object as its name, so the caller does not look it up.
     """
     loaded_handlers = []
 
@@ -55,6 +71,45 @@ class PytoLogging(object):
             self._logger.setLevel(module_level)
 
 
+    def _log(self, level, msg, args, kwargs):
+        # Only pay for formatting when the message will actually be emitted.
+        # Positional and keyword arguments are applied with str.format.
+        if not self._logger.isEnabledFor(level):
+            return
+        log_kwargs = {}
+        for key in ('exc_info', 'extra'):
+            if key in kwargs:
+                log_kwargs[key] = kwargs.pop(key)
+        if args or kwargs:
+            try:
+                if '!n' in msg:
+                    msg = _formatter.vformat(msg, args, kwargs)
+                else:
+                    msg = msg.format(*args, **kwargs)
+            except Exception, ex:
+                # a broken message must not break the command that logs it
+                self._logger.error("Could not format log message %r: %s", msg, ex)
+                return
+        self._logger.log(level, msg, **log_kwargs)
+
+    def debug(self, msg, *args, **kwargs):
+        self._log(logging.DEBUG, msg, args, kwargs)
+
+    def info(self, msg, *args, **kwargs):
+        self._log(logging.INFO, msg, args, kwargs)
+
+    def warning(self, msg, *args, **kwargs):
+        self._log(logging.WARNING, msg, args, kwargs)
+
+    def error(self, msg, *args, **kwargs):
+        self._log(logging.ERROR, msg, args, kwargs)
+
+    def critical(self, msg, *args, **kwargs):
+        self._log(logging.CRITICAL, msg, args, kwargs)
+
+    def isEnabledFor(self, level):
+        return self._logger.isEnabledFor(level)
+
     def _basic_config(self, filename):
         log_level = getattr(logging, config.logging_default_level)
         logging.basicConfig(
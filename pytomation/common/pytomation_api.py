@@ -1,9 +1,94 @@
 from .pytomation_object import PytomationObject
+from .command_priority import Priority, command_priority, command_nowait, \
+                              command_batch, CommandBatch
+from .pattern_matcher import PatternMatcher
+from .dispatch import Task
 #from .pytomation_system import *
 import pytomation_system
 import json
+import threading
+import time
 import urllib
-#from collections import OrderedDict
+import urlparse
+import weakref
+from collections import OrderedDict
+
+
+class JSONFragment(str):
+    """ A response that is already encoded as JSON """
+
+
+class DeviceSnapshots(object):
+    """
+    Cached JSON of each device for the API.  The static part (name, type,
+    commands and sub-devices) is encoded once, only the state is encoded
+    again and only after the device's state version moves on.
+    """
+    def __init__(self):
+        # device: (static key, static json, state version, json)
+        self._snapshots = weakref.WeakKeyDictionary()
+
+    def get(self, device):
+        version = getattr(device, '_state_version', None)
+        if version is None:
+            # not a state device
+            return None
+        key = (device.name, len(device.COMMANDS), device._detail_version)
+        snapshot = self._snapshots.get(device)
+        if snapshot is None or snapshot[0] != key:
+            static = json.dumps({'id': device.type_id,
+                                 'name': device.name,
+                                 'type_name': device.type_name,
+                                 'commands': device.COMMANDS,
+                                 'devices': device.device_list(),
+                                 })
+            snapshot = (key, static, None, None)
+        if snapshot[2] != version:
+            # the version is read first, so the state is never older than it
+            encoded = snapshot[1][:-1] + ', "state": ' + json.dumps(device.state) + '}'
+            snapshot = (key, snapshot[1], version, encoded)
+            self._snapshots[device] = snapshot
+        return snapshot[3]
+
+
+class DeviceNumbers(object):
+    """
+    Small numbers standing for devices in the compact websocket encoding.
+    Clients get the table of numbers, names and types once; a device
+    numbered after a client's table carries those in each of its messages
+    to that client instead.
+    """
+    def __init__(self):
+        self._numbers = {}  # device id: number
+        self._lock = threading.Lock()
+
+    def _number(self, device):
+        number = self._numbers.get(device.type_id)
+        if number is None:
+            number = self._numbers[device.type_id] = len(self._numbers)
+        return number
+
+    def number(self, device):
+        with self._lock:
+            return self._number(device)
+
+    def table(self):
+        """
+        (count, [number, id, name, type_name] of every state device), the
+        devices numbered below count are those a client of the table knows.
+        """
+        with self._lock:
+            rows = sorted([self._number(device), device.type_id, device.name, device.type_name]
+                          for device in pytomation_system.get_instances().values()
+                          if getattr(device, '_state_version', None) is not None)
+            return (len(self._numbers), rows)
+
+    def encode(self, state, prev, device, static=False):
+        message = [self.number(device), state, prev]
+        if static:
+            message += [device.type_id, device.name, device.type_name]
+        return json.dumps(message, separators=(',', ':'))
+
 
 class PytomationAPI(PytomationObject):
     """
@@ -12,48 +97,93 @@ class PytomationAPI(PytomationObject):
     VERSION = '3.0'
     JSON = 'json'
     WEBSOCKET = 'websocket'
+    COMPACT = 'compact'
+    transient = True  # created by servers and handlers, not a device
+    BATCH_WORKERS = 8  # threads running the devices of one batch
+    COMMAND_WAIT = 5  # seconds a request waits for a device's mailbox to run its command
+    _snapshots = DeviceSnapshots()
+    _numbers = DeviceNumbers()
 
     def get_map(self):
         return {
                    ('get', 'devices'): PytomationAPI.get_devices,
                    ('get', 'device'): PytomationAPI.get_device,
+                   ('get', 'diagnostics'): PytomationAPI.get_diagnostics,
                    ('post', 'device'): self.update_device,
+                   ('post', 'devices'): self.update_devices,
                    ('post', 'voice'): self.run_voice_command
         }
         
-    def run_voice_command(self, levels, data, source):
+    @classmethod
+    def _find_device_name(cls, command):
+        """
+        The longest device name anywhere in the phrase, even one overlapping
+        a shorter name, and among names as long the first of them in
+        sorted_names_by_length, as scanning that list used to find.
+        """
+        names = set(m[2] for m in cls.name_matcher.find_all(command))
+        if not names:
+            return None
+        longest = max(len(name) for name in names)
+        names = [name for name in names if len(name) == longest]
+        if len(names) > 1:
+            return min(names, key=cls.sorted_names_by_length.index)
+        return names[0]
+
+    def run_voice_command(self, levels, data, source, *args, **kwargs):
         for command in data:
             command =  command.lower()
-            for dev_name in self.sorted_names_by_length:
-                if command.find(dev_name) != -1:
-                    #remove the name from command so it doesn't interfere
-                    #with the next search
-                    command = command.replace(dev_name,'')
-                    dev_id = self.name_to_id_map[dev_name]
-                    device = self.instances[dev_id]
-                    levels = ['device', dev_id]
-                    for device_command in device.COMMANDS:
-                        if command.find(device_command) != -1:
-                            command = command.replace(device_command,'')
-                            try:
-                                numeric_command = ''.join(ele for ele in command if ele.isdigit())
-                                if numeric_command:
-                                    device_command = device_command + ',' + numeric_command
-                            except:
-                                pass
-                            return self.update_device(levels, 'command=' + device_command, source)
+            dev_name = self._find_device_name(command)
+            if dev_name:
+                #remove the name from command so it doesn't interfere
+                #with the next search
+                command = command.replace(dev_name,'')
+                dev_id = self.name_to_id_map[dev_name]
+                device = self.instances[dev_id]
+                levels = ['device', dev_id]
+                device_command = self._find_device_command(device, command)
+                if device_command:
+                    command = command.replace(device_command,'')
                     try:
                         numeric_command = ''.join(ele for ele in command if ele.isdigit())
                         if numeric_command:
-                            device_command = device.DEFAULT_NUMERIC_COMMAND + ',' + numeric_command
-                            return self.update_device(levels, 'command=' + device_command, source)
-                        else:
-                            return self.update_device(levels, 'command=' + device.DEFAULT_COMMAND, source)
+                            device_command = device_command + ',' + numeric_command
                     except:
+                        pass
+                    return self.update_device(levels, 'command=' + device_command, source)
+                try:
+                    numeric_command = ''.join(ele for ele in command if ele.isdigit())
+                    if numeric_command:
+                        device_command = device.DEFAULT_NUMERIC_COMMAND + ',' + numeric_command
+                        return self.update_device(levels, 'command=' + device_command, source)
+                    else:
                         return self.update_device(levels, 'command=' + device.DEFAULT_COMMAND, source)
+                except:
+                    return self.update_device(levels, 'command=' + device.DEFAULT_COMMAND, source)
         #Maybe we should ask the internet from here?
         return json.dumps("I'm sorry, can you please repeat that?") 
 
+    _command_matchers = {}  # device class: (commands, PatternMatcher)
+
+    @classmethod
+    def _find_device_command(cls, device, command):
+        """
+        The device's command word in the phrase, the first in COMMANDS when
+        there are several.
+        """
+        commands = device.COMMANDS
+        (known, matcher) = cls._command_matchers.get(type(device), (None, None))
+        if known != commands:
+            # thermostats add to their COMMANDS, so compare the contents
+            commands = list(commands)
+            matcher = PatternMatcher()
+            for (rank, word) in reversed(list(enumerate(commands))):
+                if isinstance(word, basestring):
+                    matcher.add(word, (rank, word))
+            cls._command_matchers[type(device)] = (commands, matcher)
+        found = [m[2] for m in matcher.find_all(command)]
+        return min(found)[1] if found else None
+
     def get_response(self, method="GET", path=None, type=None, data=None, source=None):
         response = None
         type = type.lower() if type else self.JSON
@@ -67,7 +197,10 @@ class PytomationAPI(PytomationObject):
             
             try:
                 data = data['command']
-                if path != 'voice':
+                if path == 'devices/batch':
+                    # a list of operations, already decoded
+                    pass
+                elif path != 'voice':
                     data = 'command=' + data if data else None
             except Exception, ex:
                 #If no command just send back data being requested
@@ -78,9 +211,10 @@ class PytomationAPI(PytomationObject):
             data = urllib.unquote(data).replace('&', '').replace('+', ' ').split("command[]=")
             
         method = method.lower()
+        (path, query) = self._split_query(path)
         levels = path.split('/')
         
-        if data:
+        if data and levels[:2] != ['devices', 'batch']:
             if isinstance(data, list):
                 tdata = []
                 for i in data:
@@ -91,21 +225,50 @@ class PytomationAPI(PytomationObject):
 
         f = self.get_map().get((method, levels[0]), None)
         if f:
-            response = f(levels, data=data, source=source)
+            response = f(levels, data=data, source=source, query=query)
         elif levels[0].lower() == 'device':
             try:
                 response = self.update_device(command=method, levels=levels, source=source)
             except Exception, ex:
                 pass
         if type == self.JSON:
-            return json.dumps(response)
+            return self._encode(response)
         elif type == self.WEBSOCKET:
-            if method != 'post':
-                return json.dumps(response)
+            if method != 'post' or levels[:2] == ['devices', 'batch']:
+                return self._encode(response)
             else:
                 return json.dumps("success")
         return None
 
+    @staticmethod
+    def _encode(response):
+        if isinstance(response, JSONFragment):
+            return str(response)
+        return json.dumps(response)
+
+    @staticmethod
+    def _split_query(path):
+        (path, _, query) = path.partition('?')
+        return (path, dict(urlparse.parse_qsl(query)))
+
+    def get_etag(self, path):
+        """
+        Entity tag for a GET of the path, or None when it is not versioned.
+        The device listing changes with the global state version, a single
+        device with its own.
+        """
+        levels = self._split_query(path)[0].split('/')
+        if levels[0] == 'devices':
+            version = pytomation_system.get_state_version()
+        elif levels[0] == 'device' and len(levels) == 2:
+            device = pytomation_system.get_instances().get(levels[1], None)
+            version = getattr(device, '_state_version', None)
+        else:
+            version = None
+        if not version:
+            return None
+        return '"%d"' % version
+
     def get_state_changed_message(self, state, source, prev, device):
         return json.dumps({
             'id': device.type_id,
@@ -115,26 +278,49 @@ class PytomationAPI(PytomationObject):
             'previous_state': prev
         })
 
+    def get_device_table(self):
+        """
+        (count, the static fields of the devices for the compact encoding),
+        a device numbered from count on is not in the table.
+        """
+        (count, rows) = self._numbers.table()
+        return (count, json.dumps({'encoding': self.COMPACT, 'devices': rows}))
+
+    def get_device_number(self, device):
+        return self._numbers.number(device)
+
+    def get_compact_state_changed_message(self, state, source, prev, device, static=False):
+        """
+        [number, state, previous_state], with static id, name and type_name
+        appended for a client whose table the device is missing from.
+        """
+        return self._numbers.encode(state, prev, device, static)
+
     @staticmethod
     def get_devices(path=None, *args, **kwargs):
         """
-        Returns all devices and status in JSON.
+        Returns all devices and status in JSON.  "devices?since=<version>"
+        returns the current version and only the devices changed after it.
         """
-        devices = []
-        for (k, v) in pytomation_system.get_instances_detail().iteritems():
+        since = (kwargs.get('query') or {}).get('since', None)
+        if since is not None:
             try:
-                v.update({'id': k})
-                a = v['instance']
-                b = a.state
-                del v['instance']
-#                devices.append({k: v})
-                devices.append(v)
-            except Exception, ex:
-                pass
-#        f = OrderedDict(sorted(devices.items()))
-#        odevices = OrderedDict(sorted(f.items(), key=lambda k: k[1]['type_name'])
-#                            )
-        return devices
+                since = int(since)
+            except ValueError:
+                since = 0
+            # read before the walk, later changes are picked up next time
+            version = pytomation_system.get_state_version()
+        devices = []
+        for device in pytomation_system.get_instances().values():
+            if since is not None and (getattr(device, '_state_version', None) or 0) <= since:
+                continue
+            snapshot = PytomationAPI._snapshots.get(device)
+            if snapshot:
+                devices.append(snapshot)
+        devices = '[' + ', '.join(devices) + ']'
+        if since is not None:
+            return JSONFragment('{"version": %d, "devices": %s}' % (version, devices))
+        return JSONFragment(devices)
 
     @staticmethod
     def get_device(levels, *args, **kwargs):
@@ -142,11 +328,93 @@ class PytomationAPI(PytomationObject):
         Returns one device's status in JSON.
         """
         id = levels[1]
+        if len(levels) > 2 and levels[2] == 'history':
+            return PytomationAPI.get_device_history(levels, *args, **kwargs)
+        if len(levels) > 2 and levels[2] == 'rollups':
+            return PytomationAPI.get_device_rollups(levels, *args, **kwargs)
+        snapshot = PytomationAPI._snapshots.get(pytomation_system.get_instances()[id])
+        if snapshot:
+            return JSONFragment(snapshot)
         detail = pytomation_system.get_instance_detail(id)
         detail.update({'id': id})
         del detail['instance']
         return detail
     
+    @staticmethod
+    def _parse_time(value):
+        # seconds since the epoch, or an ISO 8601 local time
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            pass
+        for format in ('%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M', '%Y-%m-%d'):
+            try:
+                return time.mktime(time.strptime(value.split('.')[0], format))
+            except ValueError:
+                pass
+        return None
+
+    @staticmethod
+    def get_device_history(levels, *args, **kwargs):
+        """
+        Returns the state changes of a device in JSON, oldest first.
+        "device/<id>/history?from=<time>&to=<time>" limits them to a time
+        range, given in seconds since the epoch or as ISO 8601 local time.
+        """
+        id = levels[1]
+        device = pytomation_system.get_instances()[id]
+        query = kwargs.get('query') or {}
+        journal = pytomation_system.get_journal()
+        history = []
+        if journal:
+            for (at, state, previous, source) in journal.history(
+                    device.name, PytomationAPI._parse_time(query.get('from')),
+                    PytomationAPI._parse_time(query.get('to'))):
+                history.append({'time': at, 'state': state, 'previous_state': previous, 'source': source})
+        return {'id': id, 'name': device.name, 'history': history}
+
+    @staticmethod
+    def get_device_rollups(levels, *args, **kwargs):
+        """
+        Returns the rollups of a numeric device in JSON for charting, as
+        [start time, min, max, avg, samples] buckets oldest first.
+        "device/<id>/rollups?resolution=<secs>&from=<time>&to=<time>" picks
+        the resolution, the finest by default, and limits the time range.
+        """
+        id = levels[1]
+        device = pytomation_system.get_instances()[id]
+        query = kwargs.get('query') or {}
+        rollups = pytomation_system.get_rollups()
+        resolution = query.get('resolution')
+        try:
+            resolution = int(resolution) if resolution else None
+        except ValueError:
+            resolution = None
+        buckets = None
+        if rollups:
+            if resolution is None:
+                resolution = rollups.resolutions[0][0]
+            buckets = rollups.buckets(device.name, resolution,
+                                      PytomationAPI._parse_time(query.get('from')),
+                                      PytomationAPI._parse_time(query.get('to')))
+        return {'id': id,
+                'name': device.name,
+                'resolution': resolution,
+                'resolutions': [r[0] for r in rollups.resolutions] if rollups else [],
+                'buckets': buckets or [],
+                }
+
+    @staticmethod
+    def get_diagnostics(levels, *args, **kwargs):
+        """
+        Returns memory diagnostics in JSON. "diagnostics/collect" forces a
+        garbage collection first.
+        """
+        collect = len(levels) > 1 and levels[1] == 'collect'
+        return pytomation_system.get_diagnostics(collect=collect)
+
     def update_device(self, levels, data=None, source=None, *args, **kwargs):
         """
         Issues command in POST from JSON format.
@@ -169,7 +437,28 @@ class PytomationAPI(PytomationObject):
                 command = e[1]
 #        print 'Set Device' + str(command) + ":::" + str(levels)
         id = levels[1]
+        command = PytomationAPI._parse_command(command)
+        try:
+            device = pytomation_system.get_instances()[id]
+            with command_priority(Priority.INTERACTIVE):
+                queued = device.command(command=command, source=source)
+            self._wait_command(queued)
+            response = PytomationAPI.get_device(levels)
+        except Exception, ex:
+            pass
+#        print 'res['+ str(response)
+        return response
+
+    def _wait_command(self, queued):
+        # a device with a mailbox answers with its state after running the command
+        if isinstance(queued, Task):
+            queued.wait(self.COMMAND_WAIT)
+
+    @staticmethod
+    def _parse_command(command):
         # look for tuples in the command and make it a tuple
+        if isinstance(command, list):
+            command = ','.join(str(i) for i in command)
         if ',' in command:
             e = command.split(',')
             l = []
@@ -182,12 +471,73 @@ class PytomationAPI(PytomationObject):
                     pass
                 l.append(t)
             command = tuple(l)
-        try:
-            detail = pytomation_system.get_instances_detail()[id]
-            device = detail['instance']
-            device.command(command=command, source=source)
-            response = PytomationAPI.get_device(levels)
-        except Exception, ex:
-            pass
-#        print 'res['+ str(response)
-        return response
+        return command
+
+    def update_devices(self, levels, data=None, source=None, *args, **kwargs):
+        """
+        Issues the list of {"id": ..., "command": ...} operations POSTed to
+        "devices/batch".  Devices run their operations in order, different
+        devices at the same time, and the result of each operation is
+        returned in the order given.  A body that is not a list comes back
+        as {"status": 400, "error": ...}.
+        """
+        if levels[1:] != ['batch']:
+            return None
+        if not source:
+            source = self
+        if isinstance(data, basestring):
+            try:
+                data = json.loads(data)
+            except ValueError, ex:
+                return {'status': 400, 'error': 'Batch is not JSON: %s' % ex}
+        if not isinstance(data, list):
+            return {'status': 400, 'error': 'Batch must be a list of operations'}
+        results = [None] * len(data)
+        by_device = OrderedDict()
+        for (index, operation) in enumerate(data):
+            id = operation.get('id') if isinstance(operation, dict) else None
+            # operations that cannot name a device are answered by the None group
+            by_device.setdefault(id if isinstance(id, basestring) else None, []).append((index, operation))
+
+        def run(operations):
+            for (index, operation) in operations:
+                if not isinstance(operation, dict):
+                    results[index] = {'id': None, 'command': None, 'success': False,
+                                      'error': 'Operation must be an object'}
+                    continue
+                result = {'id': operation.get('id'), 'command': operation.get('command')}
+                if not isinstance(operation.get('id'), basestring):
+                    result.update({'success': False, 'error': 'Operation id must be a string'})
+                    results[index] = result
+                    continue
+                try:
+                    device = pytomation_system.get_instances()[operation['id']]
+                    queued = device.command(command=self._parse_command(operation['command']), source=source)
+                    self._wait_command(queued)
+                    result.update({'success': True, 'state': device.state})
+                except Exception, ex:
+                    result.update({'success': False, 'error': str(ex) or ex.__class__.__name__})
+                results[index] = result
+
+        def work(groups, batch):
+            with command_priority(Priority.INTERACTIVE), command_nowait(), command_batch(batch):
+                while groups:
+                    try:
+                        operations = groups.pop()
+                    except IndexError:
+                        return
+                    run(operations)
+
+        groups = by_device.values()
+        groups.reverse()
+        batch = CommandBatch()
+        workers = [threading.Thread(target=work, args=(groups, batch), name='APIBatch')
+                   for i in range(min(self.BATCH_WORKERS, len(groups)) - 1)]
+        for worker in workers:
+            worker.start()
+        # this thread takes its share as well
+        work(groups, batch)
+        for worker in workers:
+            worker.join()
+        batch.flush()
+        return results
@@ -1,10 +1,22 @@
+import bisect
+import itertools
+import weakref
+
 from .pyto_logging import PytoLogging
+from .pattern_matcher import PatternMatcher
 
 class PytomationObject(object):
     """ Common PytomationObject """
     instances = {}
     name_to_id_map = {}
     sorted_names_by_length =[]
+    _negative_name_lengths = []  # sort keys of sorted_names_by_length
+    name_matcher = PatternMatcher()  # finds the registered names in a phrase
+    # objects living only as long as a request or a connection are tracked
+    # weakly and kept out of the lookups above
+    transient = False
+    transient_instances = weakref.WeakValueDictionary()
+    _transient_ids = itertools.count()
     
     def __init__(self, *args, **kwargs):
         self._type_id = None
@@ -13,18 +25,26 @@ class PytomationObject(object):
     def _po_common(self, *args, **kwargs):
         
         self._logger = PytoLogging(self.__class__.__name__)
+        if self.transient:
+            self._type_id = '%s_%d' % (self.__class__.__name__, next(self._transient_ids))
+            self.transient_instances[self._type_id] = self
+            self._name = kwargs.get('name', self._type_id)
+            return
         self._type_id = str(self.__class__.__name__) + str(len(self.instances))
         self.instances[self._type_id] = self
         self._name = kwargs.get('name', self._type_id)
-        self.name_to_id_map[self._name.lower()] = self.type_id
-        self.sorted_names_by_length.append(self._name.lower())
-        self.sorted_names_by_length.sort(key=len)
-        self.sorted_names_by_length.reverse()
+        name = self._name.lower()
+        self.name_to_id_map[name] = self.type_id
+        # longest first, and newest first among names of the same length
+        index = bisect.bisect_left(self._negative_name_lengths, -len(name))
+        self._negative_name_lengths.insert(index, -len(name))
+        self.sorted_names_by_length.insert(index, name)
+        self.name_matcher.add(name)
             
         try:
-            self._logger.debug('Object created: {name} {obj}'.format(
+            self._logger.debug('Object created: {name} {obj}',
                                                                      name=self._name,
-                                                                     obj=str(self))
+                                                                     obj=self,
                                )
         except Exception, ex:
             pass
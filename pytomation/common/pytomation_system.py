@@ -1,16 +1,71 @@
+import gc
 import time
 import select
+import threading
 from .pytomation_object import PytomationObject
+from .pyto_logging import PytoLogging
+from .state_store import StateStore
+from .state_journal import StateJournal
+from .rollups import Rollups
 from ..utility.periodic_timer import PeriodicTimer
+from ..utility.timer import Timer as _Timer
 #from ..utility.manhole import Manhole
 from ..utility.http_server import PytomationHTTPServer
 
+_state_version = 0
+_state_version_lock = threading.Lock()
+_journal = None
+_rollups = None
+
+def get_journal():
+    """ The StateJournal recording the history of the devices, None when disabled """
+    return _journal
+
+def start_journal(path, segment_time=86400, keep_segments=30):
+    global _journal
+    # here and not above, the devices import this module
+    from pytomation.devices import StateDevice
+    _journal = StateJournal(path, segment_time, keep_segments)
+    StateDevice.onStateChangedGlobal(_journal.record)
+    return _journal
+
+def get_rollups():
+    """ The Rollups of the numeric devices, None when disabled """
+    return _rollups
+
+def start_rollups(resolutions=Rollups.RESOLUTIONS):
+    global _rollups
+    from pytomation.devices import StateDevice
+    _rollups = Rollups(resolutions)
+    StateDevice.onStateChangedGlobal(_rollups.record)
+    return _rollups
+
 def get_instances():
     return PytomationObject.instances
 
-def get_instances_detail():
+def get_state_version():
+    """
+    Version of the most recent device state change.  Every device whose
+    state_version is at most this value had its state stored before it.
+    """
+    return _state_version
+
+def stamp_state_version(object):
+    global _state_version
+    with _state_version_lock:
+        _state_version += 1
+        object._state_version = _state_version
+    return _state_version
+
+def get_instances_detail(since=None):
+    """
+    Details of every object, or with since only those of devices whose
+    state changed after that version.
+    """
     details = {}
-    for object in PytomationObject.instances.itervalues():
+    for object in PytomationObject.instances.values():
+        if since is not None and (getattr(object, '_state_version', None) or 0) <= since:
+            continue
         object_detail = {'instance': object,
                          'name': object.name,
                          'type_name': object.type_name,
@@ -44,8 +99,65 @@ def get_instance_detail(object_id):
 
     return object_detail
 
+def get_diagnostics(collect=False):
+    """
+    Memory and scheduling diagnostics for the running system.  A full
+    garbage collection is only forced when collect is True.
+    """
+    gc_detail = {'enabled': gc.isenabled(),
+                 'counts': gc.get_count(),
+                 'thresholds': gc.get_threshold(),
+                 }
+    if collect:
+        gc_detail.update({'collected': gc.collect()})
+    gc_detail.update({'garbage': len(gc.garbage)})
+
+    objects = {}
+    for object in PytomationObject.instances.itervalues():
+        objects[object.type_name] = objects.get(object.type_name, 0) + 1
+
+    timers = {'threads': threading.active_count(),
+              # Timers all run from one scheduler thread, count what it has pending
+              'scheduled_timers': len(_Timer.scheduler),
+              'scheduled_jobs': 0,
+              }
+    if PeriodicTimer.sched and PeriodicTimer.sched.running:
+        timers.update({'scheduled_jobs': len(PeriodicTimer.sched.get_jobs())})
+
+    interfaces = {}
+    for object in PytomationObject.instances.values():
+        # look on the class, devices answer any attribute through __getattr__
+        if hasattr(type(object), 'outbound_metrics'):
+            interfaces[object.name] = object.outbound_metrics()
+
+    return {'gc': gc_detail,
+            'objects': objects,
+            'transient_objects': len(PytomationObject.transient_instances),
+            'timers': timers,
+            'rollups': _rollups.memory() if _rollups else None,
+            'interfaces': interfaces,
+            }
+
+def _log_diagnostics(*args, **kwargs):
+    PytoLogging('PytomationSystem').info('Diagnostics: {0}', get_diagnostics())
+
 def start(loop_action=None, loop_time=1, admin_user=None, admin_password=None, telnet_port=None, 
-          http_address=None, http_port=None, http_path=None):
+          http_address=None, http_port=None, http_path=None, diagnostics_time=None,
+          state_file=None, state_save_time=2,
+          history_path=None, history_segment_time=86400, history_segments=30,
+          rollups=False):
+    if state_file:
+        # before the startup loop, so it sees the devices as they were left
+        store = StateStore(state_file, state_save_time)
+        store.restore()
+        store.start()
+
+    if history_path:
+        start_journal(history_path, history_segment_time, history_segments)
+
+    if rollups:
+        start_rollups()
+
     if loop_action:
         # run the loop for startup once
         loop_action(startup=True)
@@ -53,7 +165,13 @@ def start(loop_action=None, loop_time=1, admin_user=None, admin_password=None, t
         myLooper = PeriodicTimer(loop_time) # loop every 1 sec
         myLooper.action(loop_action, None, {'startup': False} )
         myLooper.start()
-    
+
+    if diagnostics_time:
+        # log memory diagnostics periodically instead of on every command
+        diagnostics = PeriodicTimer(diagnostics_time)
+        diagnostics.action(_log_diagnostics, None)
+        diagnostics.start()
+
     if telnet_port:
         Manhole().start(user=admin_user, password=admin_password, port=telnet_port, instances=get_instances_detail())
 
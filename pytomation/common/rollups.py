@@ -0,0 +1,143 @@
+import threading
+import time
+from array import array
+
+
+class RollupSeries(object):
+    """
+    Minimum, maximum and average of a value over buckets of resolution
+    seconds, the last size of them kept in arrays used as a ring.
+    """
+    __slots__ = ('resolution', 'size', '_buckets', '_min', '_max', '_sum', '_count')
+
+    def __init__(self, resolution, size):
+        self.resolution = resolution
+        self.size = size
+        self._buckets = array('l', [-1]) * size  # bucket number held in each slot
+        self._min = array('d', [0.0]) * size
+        self._max = array('d', [0.0]) * size
+        self._sum = array('d', [0.0]) * size
+        self._count = array('l', [0]) * size
+
+    def add(self, at, value, held=None):
+        """
+        Adds a sample taken at a time.  held is the value before it, counted
+        once in a new bucket as the value the bucket started with.
+        """
+        bucket = int(at // self.resolution)
+        slot = bucket % self.size
+        if self._buckets[slot] != bucket:
+            if self._buckets[slot] > bucket:
+                # older than the ring
+                return
+            self._buckets[slot] = bucket
+            if held is None:
+                self._min[slot] = self._max[slot] = value
+                self._sum[slot] = 0.0
+                self._count[slot] = 0
+            else:
+                self._min[slot] = self._max[slot] = self._sum[slot] = held
+                self._count[slot] = 1
+        if value < self._min[slot]:
+            self._min[slot] = value
+        if value > self._max[slot]:
+            self._max[slot] = value
+        self._sum[slot] += value
+        self._count[slot] += 1
+
+    def buckets(self, start=None, end=None):
+        """ (start time, min, max, avg, samples) of the buckets from start to end, oldest first """
+        newest = max(self._buckets)
+        first = newest - self.size + 1
+        if start is not None:
+            first = max(first, int(start // self.resolution))
+        last = newest if end is None else min(newest, int(end // self.resolution))
+        buckets = []
+        for bucket in xrange(first, last + 1):
+            slot = bucket % self.size
+            if self._buckets[slot] != bucket or not self._count[slot]:
+                continue
+            buckets.append((bucket * self.resolution, self._min[slot], self._max[slot],
+                            self._sum[slot] / self._count[slot], self._count[slot]))
+        return buckets
+
+    def memory(self):
+        """ Bytes held by the arrays """
+        return sum(len(values) * values.itemsize
+                   for values in (self._buckets, self._min, self._max, self._sum, self._count))
+
+
+class Rollups(object):
+    """
+    Rollups of the numeric devices at several resolutions, for charting.
+    Devices get their series with their first numeric state, after which
+    their memory stays the same whatever the rate of samples.  Devices
+    only report changes, so a bucket also counts the value it started with
+    and a bucket in which a device did not change is left out.
+    """
+    # (resolution, buckets kept): a day by the minute, a week by the quarter hour, 30 days by the hour
+    RESOLUTIONS = ((60, 1440), (900, 672), (3600, 720))
+    # (State.LEVEL, value) and the temperature among a thermostat's states
+    LEVELS = ('level', 'temp')
+
+    def __init__(self, resolutions=RESOLUTIONS):
+        self.resolutions = tuple(resolutions)
+        self._devices = {}  # name: [last value, series of each resolution]
+        self._lock = threading.Lock()
+
+    @classmethod
+    def value(cls, state):
+        """ The number in a state, or None """
+        if isinstance(state, list):
+            for item in state:
+                value = cls.value(item)
+                if value is not None:
+                    return value
+            return None
+        if not isinstance(state, tuple) or len(state) != 2 or state[0] not in cls.LEVELS:
+            return None
+        try:
+            return float(state[1])
+        except (TypeError, ValueError):
+            return None
+
+    def record(self, state, source=None, prev=None, device=None):
+        """ Adds the number in a state, with the arguments of a state change delegate """
+        value = self.value(state)
+        if value is not None and device is not None:
+            self.add(device.name, value)
+
+    def add(self, name, value, at=None):
+        if at is None:
+            at = time.time()
+        with self._lock:
+            device = self._devices.get(name)
+            if device is None:
+                device = self._devices[name] = [None, [RollupSeries(resolution, size)
+                                                       for (resolution, size) in self.resolutions]]
+            for series in device[1]:
+                series.add(at, value, device[0])
+            device[0] = value
+
+    def buckets(self, name, resolution=None, start=None, end=None):
+        """
+        The buckets of the device named at a resolution, the finest when
+        None, or None when the device or resolution has no series.
+        """
+        with self._lock:
+            device = self._devices.get(name)
+            if device is None:
+                return None
+            for series in device[1]:
+                if resolution is None or series.resolution == resolution:
+                    return series.buckets(start, end)
+        return None
+
+    def names(self):
+        with self._lock:
+            return sorted(self._devices)
+
+    def memory(self):
+        """ Bytes held by the series of every device """
+        with self._lock:
+            return sum(series.memory() for device in self._devices.values() for series in device[1])
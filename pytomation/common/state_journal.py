@@ -0,0 +1,157 @@
+import glob
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+
+from .pyto_logging import PytoLogging
+from .state_store import _encode, _decode
+
+
+class StateJournal(object):
+    """
+    Append-only history of device state changes, kept in SQLite files each
+    covering segment_time seconds.  Recording a change only queues it; a
+    thread commits the queue in batches, starts a new file when a segment
+    ends and deletes the oldest beyond keep_segments.  Devices are kept by
+    name, which stays the same across restarts.
+    """
+    SCHEMA = ("CREATE TABLE IF NOT EXISTS events "
+              "(time REAL, device TEXT, state TEXT, previous TEXT, source TEXT)",
+              "CREATE INDEX IF NOT EXISTS events_device_time ON events (device, time)")
+    BATCH_SIZE = 1000  # a batch this big is committed without waiting for batch_time
+
+    def __init__(self, path, segment_time=86400, keep_segments=30, batch_time=1):
+        self.path = path
+        self.segment_time = segment_time
+        self.keep_segments = keep_segments
+        self.batch_time = batch_time
+        self._logger = PytoLogging(self.__class__.__name__)
+        self._events = deque()
+        self._queued = 0
+        self._committed = 0
+        self._condition = threading.Condition()
+        self._segment = None  # (start, connection) being written
+        self._closed = False
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self._thread = threading.Thread(target=self._run, name='StateJournal')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def record(self, state, source=None, prev=None, device=None):
+        """ Queues a state change, with the arguments of a state change delegate """
+        event = (time.time(), device.name if device else None, state, prev,
+                 source.name if getattr(type(source), 'name', None) else None)
+        with self._condition:
+            # counted with the event, flush() waits for every change recorded before it
+            self._events.append(event)
+            self._queued += 1
+            if len(self._events) >= self.BATCH_SIZE:
+                self._condition.notify()
+
+    def flush(self, timeout=None):
+        """ Waits until the changes recorded so far are committed, True unless timed out """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._condition:
+            queued = self._queued
+            self._condition.notify()
+            while self._committed < queued and self._thread.is_alive():
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            return self._committed >= queued
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if not self._closed and len(self._events) < self.BATCH_SIZE:
+                    self._condition.wait(self.batch_time)
+                closed = self._closed
+            events = []
+            while self._events:
+                events.append(self._events.popleft())
+            if events:
+                try:
+                    self._write(events)
+                except Exception, ex:
+                    self._logger.error("Could not write {count} events: {ex}", count=len(events), ex=ex)
+            with self._condition:
+                self._committed += len(events)
+                self._condition.notify_all()
+            if closed and not self._events:
+                if self._segment:
+                    self._segment[1].close()
+                return
+
+    def _segment_file(self, start):
+        return os.path.join(self.path, 'history-%d.db' % start)
+
+    def _segments(self):
+        """ (start, file) of the segments on disk, oldest first """
+        segments = []
+        for name in glob.glob(os.path.join(self.path, 'history-*.db')):
+            try:
+                segments.append((int(os.path.basename(name)[8:-3]), name))
+            except ValueError:
+                pass
+        return sorted(segments)
+
+    def _write(self, events):
+        by_segment = {}
+        for event in events:
+            start = int(event[0] // self.segment_time * self.segment_time)
+            by_segment.setdefault(start, []).append(
+                (event[0], event[1], json.dumps(_encode(event[2])), json.dumps(_encode(event[3])), event[4]))
+        for (start, rows) in sorted(by_segment.items()):
+            if not self._segment or self._segment[0] != start:
+                self._rotate(start)
+            connection = self._segment[1]
+            with connection:
+                connection.executemany("INSERT INTO events VALUES (?, ?, ?, ?, ?)", rows)
+
+    def _rotate(self, start):
+        if self._segment:
+            self._segment[1].close()
+        connection = sqlite3.connect(self._segment_file(start))
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        for statement in self.SCHEMA:
+            connection.execute(statement)
+        connection.commit()
+        self._segment = (start, connection)
+        for (old, name) in self._segments()[:-self.keep_segments]:
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(name + suffix):
+                    os.remove(name + suffix)
+
+    def history(self, name, start=None, end=None):
+        """
+        The changes of the device named, oldest first, as (time, state,
+        previous state, source) from start up to end (seconds since the epoch).
+        """
+        self.flush(self.batch_time * 5)
+        start = start or 0
+        end = end or time.time() + 1
+        events = []
+        for (segment, file) in self._segments():
+            if segment + self.segment_time <= start or segment > end:
+                continue
+            connection = sqlite3.connect(file)
+            try:
+                for (at, state, previous, source) in connection.execute(
+                        "SELECT time, state, previous, source FROM events "
+                        "WHERE device = ? AND time >= ? AND time <= ? ORDER BY time", (name, start, end)):
+                    events.append((at, _decode(json.loads(state)), _decode(json.loads(previous)), source))
+            finally:
+                connection.close()
+        return events
@@ -0,0 +1,136 @@
+import atexit
+import json
+import os
+import tempfile
+import threading
+import time
+
+from .pytomation_object import PytomationObject
+from .pyto_logging import PytoLogging
+from ..utility.periodic_timer import PeriodicTimer
+import pytomation_system
+
+
+def _encode(value):
+    # JSON has no tuples, states and commands like ('level', 50) are marked
+    if isinstance(value, tuple):
+        return {'__tuple__': [_encode(item) for item in value]}
+    if isinstance(value, list):
+        return [_encode(item) for item in value]
+    if isinstance(value, dict):
+        return dict((key, _encode(item)) for (key, item) in value.iteritems())
+    return value
+
+def _decode(value):
+    if isinstance(value, dict):
+        if value.keys() == ['__tuple__']:
+            return tuple(_decode(item) for item in value['__tuple__'])
+        return dict((str(key), _decode(item)) for (key, item) in value.iteritems())
+    if isinstance(value, list):
+        return [_decode(item) for item in value]
+    if isinstance(value, unicode):
+        try:
+            return str(value)
+        except UnicodeEncodeError:
+            return value
+    return value
+
+
+class StateStore(object):
+    """
+    Keeps the state of every device in a file, so that after a restart the
+    devices pick up where they left off instead of from State.UNKNOWN.
+
+    Devices are keyed by name.  The file is replaced by renaming a new one
+    over it, so a crash leaves either the previous or the new version, and
+    it is written at most once every save_time seconds and only after a
+    device changed.
+    """
+    VERSION = 1
+
+    def __init__(self, path, save_time=2):
+        self.path = path
+        self.save_time = save_time
+        self._saved_version = None
+        self._lock = threading.Lock()
+        self._timer = None
+        self._logger = PytoLogging(self.__class__.__name__)
+
+    @staticmethod
+    def _devices():
+        # look on the class, devices answer any attribute through __getattr__
+        return [object for object in PytomationObject.instances.values()
+                if hasattr(type(object), 'state_snapshot')]
+
+    def save(self):
+        with self._lock:
+            # read first, a change during the walk is saved again next time
+            version = pytomation_system.get_state_version()
+            devices = {}
+            for device in self._devices():
+                try:
+                    snapshot = _encode(device.state_snapshot())
+                    json.dumps(snapshot)
+                except Exception, ex:
+                    self._logger.error("Could not save the state of {name}: {ex}", name=device.name, ex=ex)
+                    continue
+                devices[device.name] = snapshot
+            self._write(json.dumps({'version': self.VERSION, 'saved': time.time(), 'devices': devices}))
+            self._saved_version = version
+            return len(devices)
+
+    def save_changed(self):
+        if pytomation_system.get_state_version() != self._saved_version:
+            return self.save()
+        return 0
+
+    def _write(self, data):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        (handle, temporary) = tempfile.mkstemp(prefix='.pytomation-state-', dir=directory)
+        try:
+            with os.fdopen(handle, 'w') as output:
+                output.write(data)
+                output.flush()
+                os.fsync(output.fileno())
+            if os.name == 'nt' and os.path.exists(self.path):
+                # no atomic replace there
+                os.remove(self.path)
+            os.rename(temporary, self.path)
+        except:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+
+    def restore(self):
+        """
+        Gives the devices their saved state, returns how many took it.  A
+        device whose state was reported since it was saved keeps that state.
+        """
+        if not os.path.exists(self.path):
+            return 0
+        try:
+            with open(self.path) as input:
+                devices = json.load(input)['devices']
+        except Exception, ex:
+            self._logger.error("Could not read the state file {path}: {ex}", path=self.path, ex=ex)
+            return 0
+        restored = 0
+        for device in self._devices():
+            snapshot = devices.get(device.name, None)
+            if snapshot is None:
+                continue
+            try:
+                if device.restore_state(_decode(snapshot)):
+                    restored += 1
+            except Exception, ex:
+                self._logger.error("Could not restore the state of {name}: {ex}", name=device.name, ex=ex)
+        self._saved_version = pytomation_system.get_state_version()
+        self._logger.info("Restored the state of {restored} devices from {path}", restored=restored, path=self.path)
+        return restored
+
+    def start(self):
+        """ Saves periodically when something changed, and on exit """
+        self._timer = PeriodicTimer(self.save_time)
+        self._timer.action(self.save_changed)
+        self._timer.start()
+        atexit.register(self.save_changed)
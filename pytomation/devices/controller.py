@@ -30,3 +30,6 @@ class Controller(object):
 
     def addressMatches(self, address):
         return self._address == address
+
+    def matchedAddresses(self):
+        return [self._address]
@@ -4,6 +4,7 @@ from pytomation.utility.timer import Timer as CTimer
 from .state import StateDevice, State
 from pytomation.interfaces import Command
 from pytomation.common import config
+from pytomation.common.command_priority import command_nowait
 
 class InterfaceDevice(StateDevice):
     
@@ -28,6 +29,7 @@ class InterfaceDevice(StateDevice):
     @address.setter
     def address(self, value):
         self._address = value
+        self._reindex_interfaces()
         return self._address
     
     def addressMatches(self, address):
@@ -38,6 +40,20 @@ class InterfaceDevice(StateDevice):
             except Exception, ex:
                 pass
         return match
+
+    def _reindex_interfaces(self):
+        # interfaces route packets by an index of their devices' addresses
+        for interface in getattr(self, '_interfaces', []):
+            try:
+                interface.reindex()
+            except Exception, ex:
+                pass
+
+    def matchedAddresses(self):
+        # every address addressMatches accepts, None when it accepts any
+        if self.address == None:
+            return None
+        return [self.address]
             
     def _add_device(self, device):
         try:
@@ -45,10 +61,10 @@ class InterfaceDevice(StateDevice):
             self._interfaces.append(device)
             self.delay(command=Command.ON, source=device, secs=0)
             self.delay(command=Command.OFF, source=device, secs=0)
-            self._logger.debug("{name} added new interface {interface}".format(
+            self._logger.debug("{name} added new interface {interface}",
                                                                                name=self.name,
                                                                                interface=device.name,
-                                                                               ))
+                                                                               )
             return True
         except Exception, ex:
             return super(InterfaceDevice, self)._add_device(device)
@@ -64,11 +80,11 @@ class InterfaceDevice(StateDevice):
                     if self._send_always or (not self._send_always and original_state != new_state):
                         self._previous_interface_command = command
                         try:
-                            self._logger.debug("{name} Send command '{command}' to interface '{interface}'".format(
+                            self._logger.debug("{name} Send command '{command}' to interface '{interface}'",
                                                                                                 name=self.name,
                                                                                                 command=command,
                                                                                                 interface=interface.name
-                                                                                             ))
+                                                                                             )
                             self._send_command_to_interface(interface, self._address, command)
 #                             if isinstance(command, tuple):
 # #                                getattr(interface, command[0])(self._address, *command[1:])
@@ -77,35 +93,37 @@ class InterfaceDevice(StateDevice):
 # #                                getattr(interface, command)(self._address)
 #                                 self._send_command_to_interface(interface, self._address, command)
                         except Exception, ex:
-                            self._logger.error("{name} Could not send command '{command}' to interface '{interface}.  Exception: {exc}'".format(
+                            self._logger.error("{name} Could not send command '{command}' to interface '{interface}.  Exception: {exc}'",
                                                                                                 name=self.name,
                                                                                                 command=command,
                                                                                                 interface=interface.name,
-                                                                                                exc=str(ex),
-                                                                                             ))
+                                                                                                exc=ex,
+                                                                                             )
                     else:
-                        self._logger.debug("{name} is already at this new state {state} originally {original_state} for command {command} -> {new_state}, do not send to interface".format(
+                        self._logger.debug("{name} is already at this new state {state} originally {original_state} for command {command} -> {new_state}, do not send to interface",
                                                                                                 name=self.name,
                                                                                                 state=self.state,
                                                                                                 original_state=original_state,
                                                                                                 command=command,
                                                                                                 new_state=new_state,
-                                                                                                                  ))
+                                                                                                                  )
                 else:
-                    self._logger.debug("{name} do not send to interface because either the current source {source} or original source {original} is the interface itself.".format(
+                    self._logger.debug("{name} do not send to interface because either the current source {source} or original source {original} is the interface itself.",
                                                                                                 name=self.name,
                                                                                                 state=self.state,
                                                                                                 source=source,
                                                                                                 original=original,
                                                                                                 command=command,
-                                                                                                                  ))
+                                                                                                                  )
         return super(InterfaceDevice, self)._delegate_command(command, *args, **kwargs)
 
     def _send_command_to_interface(self, interface, address, command):
-        if isinstance(command, tuple):
-            getattr(interface, command[0])(self._address, *command[1:])
-        else:
-            getattr(interface, command)(self._address)
+        # the interface retries the command on its own thread, don't hold the device waiting
+        with command_nowait():
+            if isinstance(command, tuple):
+                getattr(interface, command[0])(self._address, *command[1:])
+            else:
+                getattr(interface, command)(self._address)
             
     
     def sync(self, value):
@@ -1,5 +1,5 @@
 from .interface import InterfaceDevice
-from .state import State
+from .state import State, in_turn
 from pytomation.interfaces import Command
 
 class Light(InterfaceDevice):
@@ -19,21 +19,22 @@ class Light(InterfaceDevice):
         self.mapped(command=Command.CLOSE, mapped=Command.OFF)
         self.mapped(command=Command.VACATE, mapped=Command.OFF)
 
+    @in_turn
     def command(self, command, *args, **kwargs):
         source = kwargs.get('source', None)
         try:
             if source and source.state == State.DARK:
                 self.restricted = False
-                self._logger.debug('{name} received Dark from {source}.  Now unrestricted'.format(
+                self._logger.debug('{name} received Dark from {source!n}.  Now unrestricted',
                                                             name=self.name,
-                                                            source=source.name if source else str(source)
-                                                                                    ))
+                                                            source=source
+                                                                                    )
             elif source and source.state == State.LIGHT:
                 self.restricted = True
-                self._logger.debug('{name} received Light from {source}.  Now restricted'.format(
+                self._logger.debug('{name} received Light from {source!n}.  Now restricted',
                                                             name=self.name,
-                                                            source=source.name if source else str(source)
-                                                                                    ))
+                                                            source=source
+                                                                                    )
         except AttributeError, ex:
             pass
         super(Light, self).command(command, *args, **kwargs)
@@ -51,11 +52,11 @@ class Light(InterfaceDevice):
                 if self.restricted and source not in self._interfaces and not source.unrestricted:
                     m_command = None
                     m_state = None 
-                    self._logger.info("{name} is restricted. Ignoring command {command} from {source}".format(
+                    self._logger.info("{name} is restricted. Ignoring command {command} from {source}",
                                                                                          name=self.name,
                                                                                          command=command,
                                                                                          source=source.name,
-                                                                                                               ))
+                                                                                                               )
         except AttributeError, ex:
             pass #source is not a state device
         return (m_state, m_command)
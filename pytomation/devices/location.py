@@ -74,27 +74,27 @@ class Location(StateDevice):
                                      self.obs.next_setting(self.sun, use_center=True).datetime())
         self._sunrise = self._sunrise.replace(second=0, microsecond=0)
         self._sunset = self._sunset.replace(second=0, microsecond=0)
-        self._logger.info('{name} Location sunset: {sunset} sunrise: {sunrise}'.format(
+        self._logger.info('{name} Location sunset: {sunset} sunrise: {sunrise}',
                                                                                        name=self.name,
-                                                                                       sunset=str(self._sunset),
-                                                                                       sunrise=str(self._sunrise),
-                                                                                       ))
+                                                                                       sunset=self._sunset,
+                                                                                       sunrise=self._sunrise,
+                                                                                       )
         time_now = self.local_time.replace(second=0, microsecond=0)
         if (self._sunrise > self._sunset and self._sunset != time_now) or \
             self._sunrise == time_now:
             if self.state <> Command.LIGHT:
                 self.light()
             else:
-                self._logger.info("{name} Location did not flip state as it already is light".format(
+                self._logger.info("{name} Location did not flip state as it already is light",
                                                                                                      name=self.name
-                                                                                                     ))
+                                                                                                     )
         else:
             if self.state <> Command.DARK:
                 self.dark()
             else:
-                self._logger.info("{name} Location did not flip state as it already is dark".format(
+                self._logger.info("{name} Location did not flip state as it already is dark",
                                                                                                      name=self.name
-                                                                                                     ))
+                                                                                                     )
 
                          
         # Setup trigger for next transition
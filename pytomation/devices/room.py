@@ -1,4 +1,4 @@
-from pytomation.devices import State, StateDevice
+from pytomation.devices import State, StateDevice, in_turn
 from pytomation.interfaces import Command
 
 class Room(StateDevice):
@@ -13,6 +13,7 @@ class Room(StateDevice):
         self.mapped(command=Command.STILL, mapped=None)
         self.mapped(command=Command.CLOSE, mapped=Command.VACATE)
 
+    @in_turn
     def command(self, command, *args, **kwargs):
         source = kwargs.get('source', None)
         if command == Command.OCCUPY and source and getattr(source, 'state') and source in self._devices and source.state == State.OCCUPIED:
@@ -21,7 +21,7 @@ Created on Mar 11, 2013
 '''
 from .interface import InterfaceDevice
 from pytomation.interfaces.common import Command
-from .state import State
+from .state import State, in_turn
 
 class Scene(InterfaceDevice):
     STATES = [State.UNKNOWN, State.ON, State.OFF]
@@ -31,6 +31,7 @@ class Scene(InterfaceDevice):
         super(Scene, self).__init__(address=address, *args, **kwargs)
         self._controllers = kwargs.get('controllers', [])
         self._responders = kwargs.get('responders', {})       
+        self._reindex_interfaces()
         
         self._processResponders(self._responders)
 
@@ -48,6 +49,15 @@ class Scene(InterfaceDevice):
         
         return matches
 
+    def matchedAddresses(self):
+        addresses = super(Scene, self).matchedAddresses()
+        if addresses is None:
+            return None
+        for d in self._controllers:
+            addresses = addresses + d.matchedAddresses()
+        return addresses
+
+    @in_turn
     def command(self, command, *args, **kwargs):
         source = kwargs.get('source', None)
         if source in self._responders:
@@ -1,8 +1,11 @@
 from datetime import datetime
+import functools
 import gc
 import thread
+import time
 
-from pytomation.common import PytomationObject
+from pytomation.common import PytomationObject, pytomation_system, SerialExecutor, cascade, current_cascade, \
+                              command_context, current_context
 from pytomation.interfaces import Command
 from pytomation.utility import CronTimer
 from pytomation.utility.timer import Timer as CTimer
@@ -56,6 +59,21 @@ class Property(object):
     IDLE = 'idle'
     DELAY = 'delay'
     
+def in_turn(command):
+    """
+    Decorates command() so that with mailboxes in use the call is queued to
+    the device's mailbox and run in its turn.  Subclasses decorate their
+    overrides of command() too, so that all of their work runs in turn.
+    """
+    @functools.wraps(command)
+    def queued(self, *args, **kwargs):
+        mailboxes = StateDevice._mailboxes
+        if mailboxes and mailboxes.running() is not self:
+            return mailboxes.submit(self, self._command_in_turn,
+                                    (command, current_cascade(), current_context()), args, kwargs)
+        return command(self, *args, **kwargs)
+    return queued
+
 class StateDevice(PytomationObject):
     STATES = [State.UNKNOWN, State.ON, State.OFF, State.LEVEL]
     COMMANDS = [Command.ON, Command.OFF, Command.LEVEL, Command.PREVIOUS,
@@ -63,6 +81,8 @@ class StateDevice(PytomationObject):
     DEFAULT_COMMAND = Command.TOGGLE
     DEFAULT_NUMERIC_COMMAND = Command.LEVEL
     _delegates_state_change = []
+    _dispatcher = None  # SerialExecutor running delegated commands, None runs them in place
+    _mailboxes = None  # SerialExecutor running the commands of each device, None runs them in place
     
     def __init__(self, *args, **kwargs):
         self._command_lock = thread.allocate_lock()
@@ -72,8 +92,16 @@ class StateDevice(PytomationObject):
         self._initial_vars(*args, **kwargs)
         self._process_kwargs(kwargs)
         self._initial_from_devices(*args, **kwargs)
+        self._wait_turn()
         if not self.state or self.state == State.UNKNOWN:
             self.command(Command.INITIAL, source=self)
+            self._wait_turn()
+
+    def _wait_turn(self):
+        # with mailboxes, until the commands queued for the device so far have run
+        mailboxes = StateDevice._mailboxes
+        if mailboxes and mailboxes.running() is not self:
+            mailboxes.submit(self, lambda: None).wait()
 
     def _initial_vars(self, *args, **kwargs):
         self._state = State.UNKNOWN
@@ -85,6 +113,8 @@ class StateDevice(PytomationObject):
         self._delegates_state_change = []
         self._times = []
         self._maps = {}
+        self._map_index = None
+        self._map_index_general = None
         self._delays = {}
         self._delay_timers = {}
         self._triggers = {}
@@ -96,6 +126,9 @@ class StateDevice(PytomationObject):
         self._devices = []
         self._automatic = True
         self._retrigger_delay = None
+        self._state_version = 0
+        self._detail_version = 0
+        pytomation_system.stamp_state_version(self)
 #        self.invert(False)
         
         
@@ -127,11 +160,15 @@ class StateDevice(PytomationObject):
     
     def _set_state(self, value, *args, **kwargs):
         source = kwargs.get('source', None)
-        if value != self._state:
+        changed = value != self._state
+        if changed:
             self._previous_state = self._state
             self._delegate_state_change(value, prev=self._state, source=source)
         self._last_set = datetime.now()
         self._state = value
+        if changed:
+            # stamped after the state is stored so delta readers never miss it
+            pytomation_system.stamp_state_version(self)
         return self._state
     
     def __getattr__(self, name):
@@ -139,95 +176,104 @@ class StateDevice(PytomationObject):
         if self._is_valid_command(name):
             return lambda *a, **k: self.command(name, *a, sub_state=a, **k)
 
+    @in_turn
     def command(self, command, *args, **kwargs):
+        mailboxes = StateDevice._mailboxes
+        if mailboxes and mailboxes.running() is self:
+            # the mailbox runs one command at a time already
+            return self._command(command, *args, **kwargs)
         # Lets process one command at a time please
         with self._command_lock:
-            source = kwargs.get('source', None)
-            source_property = kwargs.get('source_property', None)
+            return self._command(command, *args, **kwargs)
+
+    def _command_in_turn(self, call, args, kwargs):
+        (command, chain, context) = call
+        with cascade(chain), command_context(context):
+            return command(self, *args, **kwargs)
+
+    def _command(self, command, *args, **kwargs):
+        source = kwargs.get('source', None)
+        source_property = kwargs.get('source_property', None)
 #             if source_property == Property.DELAY:
 #                 pass
 #             if source_property == Property.IDLE:
 #                 pass
 #             if source_property == None:
 #                 pass
-            if not self._is_ignored(command, source):
-                m_command = self._process_maps(*args, command=command, **kwargs)
-                if m_command != command:
-                    self._logger.debug("{name} Map from '{command}' to '{m_command}'".format(
-                                                                            name=self.name,
-                                                                            command=command,
-                                                                            m_command=m_command,
-                                                                                             ))
+        if not self._is_ignored(command, source):
+            m_command = self._process_maps(*args, command=command, **kwargs)
+            if m_command != command:
+                self._logger.debug("{name} Map from '{command}' to '{m_command}'",
+                                                                        name=self.name,
+                                                                        command=command,
+                                                                        m_command=m_command,
+                                                                                         )
 
-                (state, map_command) = self._command_state_map(m_command, *args, **kwargs)
+            (state, map_command) = self._command_state_map(m_command, *args, **kwargs)
 
-                if map_command == Command.MANUAL:
-                    self._automatic = False
-                elif map_command == Command.AUTOMATIC:
-                    self._automatic = True
+            if map_command == Command.MANUAL:
+                self._automatic = False
+            elif map_command == Command.AUTOMATIC:
+                self._automatic = True
+            
+            if self._is_restricted(map_command, source):
+                state = None
+                map_command = None
+    
+            if state and map_command and self._is_valid_state(state):
+                if not self._filter_retrigger_delay(command=map_command, source=source, new_state=state, original_state=self.state, original=command):
                 
-                if self._is_restricted(map_command, source):
-                    state = None
-                    map_command = None
-        
-                if state and map_command and self._is_valid_state(state):
-                    if not self._filter_retrigger_delay(command=map_command, source=source, new_state=state, original_state=self.state, original=command):
-                    
-                        if source == self or (not self._get_delay(map_command, source, original=command) or not self._automatic):
-                            original_state = self.state
-                            self._logger.info('{name} changed state from "{original_state}" to "{state}", by command {command} from {source}'.format(
-                                                              name=self.name,
-                                                              state=state,
-                                                              original_state=original_state,
-                                                              command=map_command,
-                                                              source=source.name if source else None,
-                                                                                                                          ))
-                            self._set_state(state, source=source)
-                            self._cancel_delays(map_command, source, original=command, source_property=source_property)
-                            if self._automatic:
-                                self._idle_start(command=map_command, source=source, original_command=command)
-                            self._previous_command = map_command
-                            self._delegate_command(map_command, original_state=original_state, *args, **kwargs)
-                            if self._automatic:
-                                self._trigger_start(map_command, source, original=command)
-                            self._logger.debug('{name} Garbarge Collection queue:{queue}'.format(
-                                                                                        name=self.name,
-                                                                                        queue=str(StateDevice.dump_garbage()),
-                                                                                                 ))
-                        else:
-                            self._logger.debug("{name} command {command} from {source} was delayed".format(
-                                                                                                       name=self.name,
-                                                                                                       command=command,
-                                                                                                       source=source.name if source else None
-                                                                                                       ))
-                            self._delay_start(map_command, source, original=command)
+                    if source == self or (not self._get_delay(map_command, source, original=command) or not self._automatic):
+                        original_state = self.state
+                        self._logger.info('{name} changed state from "{original_state}" to "{state}", by command {command} from {source!n}',
+                                                          name=self.name,
+                                                          state=state,
+                                                          original_state=original_state,
+                                                          command=map_command,
+                                                          source=source,
+                                                                                                                      )
+                        self._set_state(state, source=source)
+                        self._cancel_delays(map_command, source, original=command, source_property=source_property)
+                        if self._automatic:
+                            self._idle_start(command=map_command, source=source, original_command=command)
+                        self._previous_command = map_command
+                        self._delegate_command(map_command, original_state=original_state, *args, **kwargs)
+                        if self._automatic:
+                            self._trigger_start(map_command, source, original=command)
                     else:
-                        # retrigger
-                        self._logger.debug("{name} Retrigger delay ignored command {command} from {source}".format(
-                                                                                               name=self.name,
-                                                                                               command=command,
-                                                                                               source=source.name if source else None
-                                                                                               ))
-                elif command == Command.STATUS:
-                    # If this is a status request, dont set state just pass along the command.
-                    self._logger.debug("{name} delgating 'Status' command from {source}".format(
-                                                                                               name=self.name,
-                                                                                               command=command,
-                                                                                               source=source.name if source else None
-                                                                                               ))
-                    self._delegate_command(command, original_state=self.state, *args, **kwargs)
+                        self._logger.debug("{name} command {command} from {source!n} was delayed",
+                                                                                                   name=self.name,
+                                                                                                   command=command,
+                                                                                                   source=source
+                                                                                                   )
+                        self._delay_start(map_command, source, original=command)
                 else:
-                    self._logger.debug("{name} mapped to nothing, ignored command {command} from {source}".format(
-                                                                                               name=self.name,
-                                                                                               command=command,
-                                                                                               source=source.name if source else None
-                                                                                               ))
+                    # retrigger
+                    self._logger.debug("{name} Retrigger delay ignored command {command} from {source!n}",
+                                                                                           name=self.name,
+                                                                                           command=command,
+                                                                                           source=source
+                                                                                           )
+            elif command == Command.STATUS:
+                # If this is a status request, dont set state just pass along the command.
+                self._logger.debug("{name} delgating 'Status' command from {source!n}",
+                                                                                           name=self.name,
+                                                                                           command=command,
+                                                                                           source=source
+                                                                                           )
+                self._delegate_command(command, original_state=self.state, *args, **kwargs)
             else:
-                self._logger.debug("{name} ignored command {command} from {source}".format(
+                self._logger.debug("{name} mapped to nothing, ignored command {command} from {source!n}",
                                                                                            name=self.name,
                                                                                            command=command,
-                                                                                           source=source.name if source else None
-                                                                                           ))
+                                                                                           source=source
+                                                                                           )
+        else:
+            self._logger.debug("{name} ignored command {command} from {source!n}",
+                                                                                       name=self.name,
+                                                                                       command=command,
+                                                                                       source=source
+                                                                                       )
 
     def _command_state_map(self, command, *args, **kwargs):
         source = kwargs.get('source', None)
@@ -297,10 +343,10 @@ class StateDevice(PytomationObject):
                 if getattr(State, attribute) == primary:
                     return command
         except Exception, ex:
-            self._logger.debug("{name} Could not find command to state for {command}".format(
+            self._logger.debug("{name} Could not find command to state for {command}",
                                                                             name=self.name,
                                                                             command=command,                                                                                                                 
-                                                                            ))
+                                                                            )
         return state
     
     def _state_to_command(self, state, command):
@@ -322,10 +368,10 @@ class StateDevice(PytomationObject):
                     return state
             return command
         except Exception, ex:
-            self._logger.debug("{name} could not map state {state} to command".format(
+            self._logger.debug("{name} could not map state {state} to command",
                                                                         name=self.name,
                                                                         state=state,
-                                                                                                    ))
+                                                                                                    )
             return command
     
     def _process_kwargs(self, kwargs):
@@ -342,7 +388,7 @@ class StateDevice(PytomationObject):
             if k.lower() != 'devices':
                 attribute = getattr(self, k)
                 if not attribute:
-                    self._logger.error('Keyword: "{0}" not found in object construction.'.format(k))
+                    self._logger.error('Keyword: "{0}" not found in object construction.',k)
                 else:
                     try:
                         attribute(**v)
@@ -365,60 +411,55 @@ class StateDevice(PytomationObject):
     def _process_maps(self, *args, **kwargs):
         source = kwargs.get(Attribute.SOURCE, None)
         command = kwargs.get(Attribute.COMMAND, None)
-        mapped = None
-
-        self._logger.debug("{name} MAPS dump: {maps}".format(
-                                                name=self.name,
-                                                maps=str(self._maps),
-                                                            ))
-
-        for (c, s), (target, timer) in self._maps.iteritems():
-            commands = []
-            sources = []
-            if isinstance(s, tuple):
-                sources = s
-            else:
-                sources = (s, )
-            if isinstance(c, tuple):
-                commands = c
-            else:
-                commands = (c, )
-            
-            # Find specific first
-            if command in commands and source in sources:
-                if not timer or not self._automatic:
-                    return target
-                else:
-                    self._logger.debug('{name} Map Timer Started for command "{command}" from source "{source}" will send "{target}" in "{secs}" secs.'.format(
-                                            name=self.name,
-                                            source=source.name if source else None,
-                                            command=command,
-                                            target=target,
-                                            secs=timer.interval,
-                    ))
-                    timer.action(self.command, (target, ), source=self, original=source)
-                    timer.restart()
-                    return None
-
-            # Go for a more general match next
-            if command in commands and None in sources:
-                if not timer or not self._automatic:
-                    return target
-                else:
-                    self._logger.debug('{name} Map Timer Started for command "{command}" from source "{source}" will send "{target}" in "{secs}" secs.'.format(
-                                            name=self.name,
-                                            source=source,
-                                            command=command,
-                                            target=target,
-                                            secs=timer.interval,
-                    ))
-                    timer.action(self.command, (target, ), source=self, original=source)
-                    timer.restart()
-                    return None
 
-        
-        return command
- 
+        if self._map_index is None:
+            self._compile_maps()
+
+        # Find specific first, then go for a more general match next
+        try:
+            entry = self._map_index.get((command, source), None)
+            if entry is None:
+                entry = self._map_index_general.get(command, None)
+        except TypeError:
+            # Unhashable command or source cannot match any mapping
+            entry = None
+        if entry is None:
+            return command
+
+        (target, timer) = entry
+        if not timer or not self._automatic:
+            return target
+        self._logger.debug('{name} Map Timer Started for command "{command}" from source "{source!n}" will send "{target}" in "{secs}" secs.',
+                                name=self.name,
+                                source=source,
+                                command=command,
+                                target=target,
+                                secs=timer.interval,
+        )
+        timer.action(self.command, (target, ), source=self, original=source)
+        timer.restart()
+        return None
+
+    def _compile_maps(self):
+        """
+        Build the lookup tables used by _process_maps from self._maps.
+        Specific (command, source) entries and wildcard source entries are
+        kept apart so specific mappings always win over general ones.
+        """
+        index = {}
+        general = {}
+        for (c, s), entry in self._maps.iteritems():
+            commands = c if isinstance(c, tuple) else (c, )
+            sources = s if isinstance(s, tuple) else (s, )
+            for command in commands:
+                for source in sources:
+                    if source is None:
+                        general.setdefault(command, entry)
+                    else:
+                        index.setdefault((command, source), entry)
+        self._map_index = index
+        self._map_index_general = general
+
     def _is_valid_state(self, state):
         isFound = state in self.STATES
         if not isFound:
@@ -427,10 +468,10 @@ class StateDevice(PytomationObject):
             except:
                 pass
         if not isFound:
-            self._logger.debug("{name} tried to be set to invalid state {state}".format(
+            self._logger.debug("{name} tried to be set to invalid state {state}",
                                                                         name=self.name,
                                                                         state=state,
-                                                                                        ))
+                                                                                        )
         return isFound
 
     def _is_valid_command(self, command):
@@ -473,6 +514,12 @@ class StateDevice(PytomationObject):
     def _delegate_command(self, command, *args, **kwargs):
         source = kwargs.get('source', None)
         original_state = kwargs.get('original_state', None)
+        dispatcher = StateDevice._dispatcher
+        queued = dispatcher or StateDevice._mailboxes
+        if queued:
+            # the devices this cascade has passed through, it does not come back to them
+            chain = current_cascade() | frozenset([self])
+            context = current_context()
         
         for delegate in self._delegates:
 #            print "here {name} s:{source} d:{delegate}".format(
@@ -483,22 +530,42 @@ class StateDevice(PytomationObject):
             if delegate != self and source != delegate and \
                 (not self._changes_only or \
                 (self._changes_only and self._state != original_state)):
-                self._logger.debug("{name} delegating command {command} from {source} to object {delegate}".format(
+                if queued and delegate in chain:
+                    self._logger.debug("{name} Avoid cyclic delegation of {command} from {source!n} to object {delegate!n}",
                                                                                    name=self.name,
                                                                                    command=command,
-                                                                                   source=source.name if source else None,
-                                                                                   delegate=delegate.name,
-                                                                           ))
-                delegate.command(command=command, source=self)
+                                                                                   source=source,
+                                                                                   delegate=delegate,
+                                                                           )
+                    continue
+                self._logger.debug("{name} delegating command {command} from {source!n} to object {delegate!n}",
+                                                                                   name=self.name,
+                                                                                   command=command,
+                                                                                   source=source,
+                                                                                   delegate=delegate,
+                                                                           )
+                if dispatcher:
+                    dispatcher.submit(delegate, self._command_delegate, delegate, command, chain, context)
+                elif queued:
+                    # queued to the delegate's mailbox, in this cascade
+                    with cascade(chain):
+                        delegate.command(command=command, source=self)
+                else:
+                    delegate.command(command=command, source=self)
             else:
-                self._logger.debug("{name} Avoid duplicate delegation of {command} from {source} to object {delegate}".format(
+                self._logger.debug("{name} Avoid duplicate delegation of {command} from {source!n} to object {delegate!n}",
                                                                                    name=self.name,
                                                                                    command=command,
-                                                                                   source=source.name if source else None,
-                                                                                   delegate=delegate.name,
-                                                                           ))
+                                                                                   source=source,
+                                                                                   delegate=delegate,
+                                                                           )
 
 
+    def _command_delegate(self, delegate, command, chain, context):
+        # on a dispatcher worker, in the cascade, priority and batch it was queued with
+        with cascade(chain), command_context(context):
+            delegate.command(command=command, source=self)
+
     def device_list(self):
         if len(self._devices) == 0:
             return None
@@ -508,6 +575,11 @@ class StateDevice(PytomationObject):
         return device_ids
 
 
+    def _detail_changed(self):
+        # sub-devices are part of the API's cached details
+        self._detail_version += 1
+        pytomation_system.stamp_state_version(self)
+
     def _delegate_state_change(self, state, *args, **kwargs):
         for _delegate in self._delegates_state_change:
             try:
@@ -543,10 +615,11 @@ class StateDevice(PytomationObject):
     def _add_device(self, device):
         if not isinstance(device, dict):
             self._devices.append(device)
-            self._logger.debug("{name} added new device {device}".format(
+            self._detail_changed()
+            self._logger.debug("{name} added new device {device}",
                                                                          name=self.name,
                                                                          device=device.name,
-                                                                         ))
+                                                                         )
             return device.on_command(device=self)
         return True
 
@@ -554,6 +627,7 @@ class StateDevice(PytomationObject):
         if device in self._devices:
             device.on_command(device=self, remove=True)
             self._devices.remove(device)
+            self._detail_changed()
             return True
         else:
             return False
@@ -578,6 +652,7 @@ class StateDevice(PytomationObject):
                 sources = (source ,)
             for s in sources:
                 self._maps.update({(c, s): (mapped, timer)}) 
+        self._map_index = None
             
     def delay(self, *args, **kwargs):
         commands = kwargs.get('command', None)
@@ -622,13 +697,13 @@ class StateDevice(PytomationObject):
     def _cancel_delays(self, command, source, original=None, source_property=None):
         if not self._get_delay(command, source, original) and source_property != Property.IDLE:
             for c, timer in self._delay_timers.iteritems():
-                self._logger.debug("{name} stopping an existing delay timer of '{interval}' secs for command: '{command}' because the same non-delayed command was now processed. From {source} original command {original}".format(
+                self._logger.debug("{name} stopping an existing delay timer of '{interval}' secs for command: '{command}' because the same non-delayed command was now processed. From {source!n} original command {original}",
                                                                                            name=self.name,
                                                                                            command=command,
-                                                                                           source=source.name if source else None,
+                                                                                           source=source,
                                                                                            interval=timer.interval,
                                                                                            original=original,
-                                                                                           ))
+                                                                                           )
                 timer.stop()
 
     def _delay_start(self, command, source, *args, **kwargs):
@@ -644,13 +719,13 @@ class StateDevice(PytomationObject):
                 timer.interval = delay['secs']
                 self._delay_timers.update({delay['mapped']: timer} )
                 timer.start()
-                self._logger.debug('{name} command "{command}" from source "{source}" delayed, mapped to "{mapped}" waiting {secs} secs. '.format(
+                self._logger.debug('{name} command "{command}" from source "{source!n}" delayed, mapped to "{mapped}" waiting {secs} secs. ',
                                                                                       name=self.name,
-                                                                                      source=source.name if source else None,
+                                                                                      source=source,
                                                                                       command=command,
                                                                                       mapped=delay['mapped'],
                                                                                       secs=delay['secs'],
-                                                                                ))
+                                                                                )
 
     @property
     def idle_time(self):
@@ -710,19 +785,19 @@ class StateDevice(PytomationObject):
                                                          Attribute.END: CronTimer.to_cron(end),
                                                      }
                                       })
-                self._logger.debug("{name} add ignore for {command} from {source}".format(
+                self._logger.debug("{name} add ignore for {command} from {source!n}",
         										name=self.name,
         										command=command,
-        										source=source.name if source else None,
-        										));
+        										source=source,
+        										);
         
     def _is_ignored(self, command, source):
         is_ignored = False
-        self._logger.debug("{name} check ignore for {command} from {source}".format(
+        self._logger.debug("{name} check ignore for {command} from {source!n}",
                                         name=self.name,
                                         command=command,
-                                        source=source.name if source else None,
-                                        ));
+                                        source=source,
+                                        );
 
         
         match = self._match_condition(command, source, self._ignores)
@@ -755,12 +830,12 @@ class StateDevice(PytomationObject):
                                                              Attribute.END: CronTimer.to_cron(end),
                                                          }
                                           })
-                    self._logger.debug("{name} add restriction for {state} from {source} on {target}".format(
+                    self._logger.debug("{name} add restriction for {state} from {source!n} on {target}",
                                                     name=self.name,
                                                     state=state,
                                                     target=target,
-                                                    source=source.name if source else None,
-                                                    ));
+                                                    source=source,
+                                                    );
 
     def _is_restricted(self, command, source):
         if self._restrictions and source != self:
@@ -768,9 +843,9 @@ class StateDevice(PytomationObject):
                 c_state = source.state
                 if (state == c_state and (target==None or target==command)):
                     if (self._match_condition_item(self._restrictions.get((state, source, target)))):
-                        self._logger.debug("{name} Restricted. ignoring".format(
+                        self._logger.debug("{name} Restricted. ignoring",
                                                                              name=self.name,
-                                                                             ))
+                                                                             )
                         return True
 
         return False
@@ -814,7 +889,7 @@ class StateDevice(PytomationObject):
                                                                   s=now[2],
                                                                   ))
                 result = crontime_in_range(now_cron, start, end)
-                self._logger.debug("Compare Time Range:("+ str(result) +")->" + str(now_cron) +"-" + str(start) + "-"+ str(end))
+                self._logger.debug("Compare Time Range:({0})->{1}-{2}-{3}", result, now_cron, start, end)
                 return result 
         return item
 
@@ -870,13 +945,13 @@ class StateDevice(PytomationObject):
                 timer.interval = trigger[Attribute.SECS]
                 self._trigger_timers.update({trigger[Attribute.MAPPED]: timer} )
                 timer.start()
-                self._logger.debug('{name} command "{command}" from source "{source}" trigger started, mapped to "{mapped}" waiting {secs} secs. '.format(
+                self._logger.debug('{name} command "{command}" from source "{source!n}" trigger started, mapped to "{mapped}" waiting {secs} secs. ',
                                                                                       name=self.name,
-                                                                                      source=source.name if source else None,
+                                                                                      source=source,
                                                                                       command=command,
                                                                                       mapped=trigger[Attribute.MAPPED],
                                                                                       secs=trigger[Attribute.SECS],
-                                                                                ))  
+                                                                                )  
             
         
 #        for trigger in self._triggers:
@@ -893,16 +968,84 @@ class StateDevice(PytomationObject):
                 (state, command) =  self._command_state_map(device.last_command)
                 if state:
                     self.initial(device)
-                    self._logger.debug("{name} initial for {command} from {state}".format(
+                    self._logger.debug("{name} initial for {command} from {state}",
         										name=self.name,
         										command=command,
         										state=state,
-        										));
+        										);
         return
     
     @property
     def last_command(self):
         return self._previous_command
+
+    def state_snapshot(self):
+        """
+        The state of the device with the deadlines of its running delay and
+        idle timers, for a StateStore to keep across a restart.
+        """
+        now = time.time()
+        delays = []
+        for (mapped, timer) in self._delay_timers.items():
+            remaining = timer.remaining()
+            if remaining is not None:
+                delays.append([mapped, now + remaining])
+        idle = []
+        for ((command, source), entry) in self._idle_timer.items():
+            remaining = entry['timer'].remaining()
+            if remaining is not None:
+                idle.append([command, source.name if source else None, now + remaining])
+        return {'state': self._state,
+                'previous_state': self._previous_state,
+                'previous_command': self._previous_command,
+                'last_set': time.mktime(self._last_set.timetuple()) + self._last_set.microsecond / 1e6,
+                'automatic': self._automatic,
+                'delays': delays,
+                'idle': idle,
+                }
+
+    def restore_state(self, snapshot):
+        """
+        Takes back a state_snapshot() without running a command, so nothing
+        is sent or delegated.  Timers whose deadline passed fire at once.
+        A device only takes it while still State.UNKNOWN or last set before
+        the snapshot, its interface may have reported the state since.
+        Runs in the device's turn like command(), returns whether it was taken.
+        """
+        mailboxes = StateDevice._mailboxes
+        if mailboxes and mailboxes.running() is not self:
+            task = mailboxes.submit(self, self._restore_state, snapshot)
+            task.wait()
+            return task.result
+        if mailboxes:
+            return self._restore_state(snapshot)
+        with self._command_lock:
+            return self._restore_state(snapshot)
+
+    def _restore_state(self, snapshot):
+        last_set = datetime.fromtimestamp(snapshot['last_set'])
+        if self._state != State.UNKNOWN and self._last_set >= last_set:
+            return False
+        self._state = snapshot['state']
+        self._previous_state = snapshot['previous_state']
+        self._previous_command = snapshot['previous_command']
+        self._last_set = last_set
+        self._automatic = snapshot['automatic']
+        now = time.time()
+        for (mapped, deadline) in snapshot.get('delays', ()):
+            timer = self._delay_timers.get(mapped, None) or CTimer()
+            timer.action(self.command, (mapped, ), source=self, original=None, source_property=Property.DELAY)
+            self._delay_timers[mapped] = timer
+            timer.start(max(deadline - now, 0))
+        for (command, source_name, deadline) in snapshot.get('idle', ()):
+            for ((idle_command, source), entry) in self._idle_timer.items():
+                if idle_command == command and (source.name if source else None) == source_name and \
+                        entry[Attribute.MAPPED]:
+                    entry['timer'].action(self.command, (entry[Attribute.MAPPED], ), source=self, original=None,
+                                          source_property=Property.IDLE)
+                    entry['timer'].start(max(deadline - now, 0))
+        pytomation_system.stamp_state_version(self)
+        return True
     
     def changes_only(self, value):
         self._changes_only=value
@@ -930,6 +1073,35 @@ class StateDevice(PytomationObject):
         self._delegates_state_change.append(func)
         return True
 
+    @staticmethod
+    def dispatch_delegates(workers=8):
+        """
+        Commands delegated from one device to another are queued to a pool
+        of workers, run in order for each device, instead of being run by
+        the thread commanding the source device.  workers=0 goes back to
+        running them in place.
+        """
+        dispatcher = StateDevice._dispatcher
+        StateDevice._dispatcher = SerialExecutor(workers, name='Delegates') if workers else None
+        if dispatcher:
+            dispatcher.shutdown()
+        return StateDevice._dispatcher
+
+    @staticmethod
+    def use_mailboxes(workers=8):
+        """
+        Each device gets a mailbox its commands are queued to, run one at a
+        time in order by a pool of workers instead of by the thread calling
+        command() under the device's lock.  command() returns the queued
+        Task; wait() on it for the command to have run.  workers=0 goes back
+        to running commands in place.
+        """
+        mailboxes = StateDevice._mailboxes
+        StateDevice._mailboxes = SerialExecutor(workers, name='Mailboxes') if workers else None
+        if mailboxes:
+            mailboxes.shutdown()
+        return StateDevice._mailboxes
+
     @staticmethod
     def onStateChangedGlobal(func):
         StateDevice._delegates_state_change.append(func)
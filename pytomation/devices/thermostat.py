@@ -1,4 +1,4 @@
-from pytomation.devices import InterfaceDevice, State
+from pytomation.devices import InterfaceDevice, State, in_turn
 from pytomation.interfaces import Command
 
 class Thermostat(InterfaceDevice):
@@ -34,14 +34,14 @@ class Thermostat(InterfaceDevice):
                 self.automatic_check()
     
     def automatic_check(self):
-        self._logger.debug('Automatic Check a:{0} ad:{1} set:{2} state:{3} ltemp:{4} mode:{5}'.format(
+        self._logger.debug('Automatic Check a:{0} ad:{1} set:{2} state:{3} ltemp:{4} mode:{5}',
                                                                                  self._automatic_mode,
                                                                                  self._automatic_delta,
                                                                                  self._setpoint,
-                                                                                 str(self._state),
+                                                                                 self._state,
                                                                                  self._last_temp,
                                                                                  self._current_mode,
-                                                                                 ))
+                                                                                 )
 
         if self._automatic_mode:
             if self._state and self._setpoint and isinstance(self._state, tuple) and self._state[0] == State.LEVEL and self._state[1] != self._setpoint:
@@ -64,6 +64,7 @@ class Thermostat(InterfaceDevice):
                         self.cool(address=self._address, source=self)
                 self._last_temp = previous_temp
 
+    @in_turn
     def command(self, command, *args, **kwargs):
         source = kwargs.get('source', None)
         primary_command = command
@@ -26,15 +26,15 @@ class XMPP_Client(StateDevice):
         self._port = kwargs.get('port', None)
 
         if not self._xmpp:
-            self._logger.info('Connecting to server for id:{id} ({server})'.format(
+            self._logger.info('Connecting to server for id:{id} ({server})',
                                                    id=self._xmpp_id,
                                                    server=self._server,
-                                                                                   ))
+                                                                                   )
             status = None
             jid = xmpp.JID(self._xmpp_id)
             self._xmpp = xmpp.Client(jid.getDomain())
             self.connect()
-            self._logger.info("Connection Result: {0}".format( status))
+            self._logger.info("Connection Result: {0}", status)
             result = self._xmpp.auth(re.match('(.*)\@.*', self._xmpp_id).group(1), self._password,'TESTING')
             #self._xmpp.sendInitPresence()   
             self._logger.debug('Processing' + str(result))
@@ -164,7 +164,7 @@ class CM11a(HAInterface):
 	chksum = 0
 	byte0 = 0x04
 	byte1 = hCode + uCode
-	self._logger.debug("[CM11a] Transmit > {b0} {b1}".format(b0=hex(byte0), b1=hex(byte1)))
+	self._logger.debug("[CM11a] Transmit > {b0} {b1}",b0=hex(byte0), b1=hex(byte1))
 	while (chksum != ((byte0 + byte1) & 0xFF)):
 	    self._interface.write(chr(byte0) + chr(byte1))
 	    chksum = ord(self._interface.read(1))
@@ -186,7 +186,7 @@ class CM11a(HAInterface):
 	byte0 = level | 0x06
 	byte1 =  hCode + command
 	chksum = 0
-	self._logger.debug("[CM11a] Transmit > {b0} {b1}".format(b0=hex(byte0), b1=hex(byte1)))
+	self._logger.debug("[CM11a] Transmit > {b0} {b1}",b0=hex(byte0), b1=hex(byte1))
 	while (chksum != ((byte0 + byte1) & 0xFF)):
 	    self._interface.write(chr(byte0))
 	    self._interface.write(chr(byte1))
@@ -118,6 +118,10 @@ class Interface(PytomationObject):
     def write(self, data):
         raise NotImplemented
 
+    def fileno(self):
+        "File descriptor to select() on, None if the interface can't be selected"
+        return None
+
     @property
     def disabled(self):
         return self._disabled
@@ -174,6 +178,9 @@ class TCP(Interface):
 #            print traceback.format_exc()
         return data
 
+    def fileno(self):
+        return self.__s.fileno()
+
     def shutdown(self):
         self.__s.shutdown(socket.SHUT_RDWR)
         self.__s.close()
@@ -244,9 +251,9 @@ class Serial(Interface):
         except serial.serialutil.SerialException, ex:
             self._disabled = True
             self.__serialDevice = None
-            self._logger.critical("{name} Could not open serial port.  Interface disabled".format(
+            self._logger.critical("{name} Could not open serial port.  Interface disabled",
                                                                                     name=self.name
-                                                                                                  ))
+                                                                                                  )
         
     
     def read(self, bufferSize=1024):
@@ -257,9 +264,9 @@ class Serial(Interface):
     def write(self, bytesToSend):
         if self.__serialDevice:
             return self.__serialDevice.write(bytesToSend)
-        self._logger.critical("{name} Could not write to closed serial port".format(
+        self._logger.critical("{name} Could not write to closed serial port",
                                                                     name=self.name
-                                                                                    ))
+                                                                                    )
         return True
 
     def inWaiting(self):
@@ -267,6 +274,11 @@ class Serial(Interface):
             return self.__serialDevice.inWaiting()
         return True
 
+    def fileno(self):
+        if self.__serialDevice:
+            return self.__serialDevice.fileno()
+        return None
+
 class USB(Interface):
     def __init__(self, device):
         return None
@@ -279,9 +291,9 @@ class HTTP(Interface):
         self._host = host
         self._username = username
         self._password = password
-        self._logger.debug("{name} HTTP Port created".format(
+        self._logger.debug("{name} HTTP Port created",
                                                                                     name=self.name
-                                                                                                  ))
+                                                                                                  )
 
     def request(self, path="", data=None, verb="GET"):
         _path = None
@@ -22,7 +22,12 @@ Notes:
 
 Created on Mar 26, 2011
 '''
+import fcntl
+import functools
 import hashlib
+import logging
+import os
+import select
 import threading
 import time
 import binascii
@@ -31,11 +36,344 @@ from collections import deque
 
 from .common import *
 from pytomation.common.pytomation_object import PytomationObject
+from pytomation.common.command_priority import Priority, command_priority, current_priority, \
+                                               waiting_for_commands, current_batch
+
+
+class OutboundQueue(object):
+    """
+    Command hashes waiting to be sent, one FIFO per Priority.  A command
+    queued with a coalesce key replaces the queued command holding the
+    same key.  Also keeps depth and wait time metrics.
+    """
+    def __init__(self):
+        self._queues = dict((priority, deque()) for priority in Priority.ALL)
+        self._queued = {}  # commandHash: (priority, time queued, key)
+        self._keys = {}  # coalesce key: commandHash
+        self._sent = 0
+        self._coalesced = 0
+        self._max_depth = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    def __len__(self):
+        return len(self._queued)
+
+    def __contains__(self, commandHash):
+        return commandHash in self._queued
+
+    def append(self, commandHash, priority=Priority.AUTOMATION, key=None, front=False):
+        """
+        Queue a command, ahead of the others of its priority with front.
+        Returns the hash of the command it superseded, if any.
+        """
+        superseded = None
+        if key is not None:
+            superseded = self._keys.get(key)
+            if superseded:
+                self.remove(superseded)
+                self._coalesced += 1
+            self._keys[key] = commandHash
+        if front:
+            self._queues[priority].appendleft(commandHash)
+        else:
+            self._queues[priority].append(commandHash)
+        self._queued[commandHash] = (priority, time.time(), key)
+        self._max_depth = max(self._max_depth, len(self._queued))
+        return superseded
+
+    def holder(self, key):
+        """ Hash of the queued command holding the coalesce key, or None """
+        return self._keys.get(key)
+
+    def remove(self, commandHash):
+        priority, queued, key = self._queued.pop(commandHash)
+        self._queues[priority].remove(commandHash)
+        if key is not None and self._keys.get(key) == commandHash:
+            del self._keys[key]
+
+    def popleft(self):
+        for priority in Priority.ALL:
+            if self._queues[priority]:
+                commandHash = self._queues[priority].popleft()
+                priority, queued, key = self._queued.pop(commandHash)
+                if key is not None and self._keys.get(key) == commandHash:
+                    del self._keys[key]
+                wait = time.time() - queued
+                self._sent += 1
+                self._total_wait += wait
+                self._max_wait = max(self._max_wait, wait)
+                return commandHash
+        raise IndexError('pop from an empty queue')
+
+    def metrics(self):
+        return {'depth': len(self._queued),
+                'depth_by_priority': dict((priority, len(queue)) for priority, queue in self._queues.iteritems()),
+                'max_depth': self._max_depth,
+                'sent': self._sent,
+                'coalesced': self._coalesced,
+                'average_wait': self._total_wait / self._sent if self._sent else 0.0,
+                'max_wait': self._max_wait,
+                }
+
+
+class PacingController(object):
+    """
+    AIMD pacing of the gap between sends: every prompt acknowledgement
+    shortens the gap by a fixed step, every NAK or timeout multiplies it.
+    Timeouts back off more gently since a single dead device also causes them.
+    """
+    def __init__(self, initial, minimum, maximum, step=0.05, backoff=2.0, timeout_backoff=1.25, prompt=1.0):
+        self.delay = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.step = step
+        self.backoff = backoff
+        self.timeout_backoff = timeout_backoff
+        self.prompt = prompt
+        self._acks = 0
+        self._naks = 0
+        self._timeouts = 0
+        self._total_latency = 0.0
+
+    def ack(self, latency=None):
+        self._acks += 1
+        if latency is not None:
+            self._total_latency += latency
+        if latency is None or latency <= self.prompt:
+            self.delay = max(self.minimum, self.delay - self.step)
+        return self.delay
+
+    def nak(self):
+        self._naks += 1
+        self.delay = min(self.maximum, self.delay * self.backoff)
+        return self.delay
+
+    def timeout(self):
+        self._timeouts += 1
+        self.delay = min(self.maximum, self.delay * self.timeout_backoff)
+        return self.delay
+
+    def metrics(self):
+        total = self._acks + self._naks + self._timeouts
+        return {'delay': self.delay,
+                'acks': self._acks,
+                'naks': self._naks,
+                'timeouts': self._timeouts,
+                'success_ratio': float(self._acks) / total if total else 1.0,
+                'average_ack_latency': self._total_latency / self._acks if self._acks else 0.0,
+                }
+
+
+class RetryPolicy(object):
+    """
+    How long to wait for the reply to a sent command and how many times
+    to resend it.  Each resend waits `backoff` times longer than the last.
+    """
+    def __init__(self, timeout=2, retries=5, backoff=1.0, max_timeout=30):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_timeout = max_timeout
+
+    def timeout_for(self, attempt, timeout=None):
+        return min(self.max_timeout, (timeout or self.timeout) * self.backoff ** attempt)
+
+    def should_retry(self, attempt):
+        return attempt < self.retries
+
+
+class OutboundCommand(dict):
+    """
+    One command handed to the interface.  Still the dict of details the
+    protocol drivers match replies against, plus its state as the interface
+    thread moves it from queued to sent to acked or failed.  Completed
+    commands are dropped from the interface's bookkeeping.
+    """
+    QUEUED = 'queued'
+    SENT = 'sent'
+    ACKED = 'acked'
+    FAILED = 'failed'
+    SUPERSEDED = 'superseded'
+    FINISHED = (ACKED, FAILED, SUPERSEDED)
+
+    def __init__(self, commandHash, details, policy):
+        super(OutboundCommand, self).__init__(details)
+        self['commandHash'] = commandHash
+        self.commandHash = commandHash
+        self.state = self.QUEUED
+        self.policy = policy
+        self.timeout = None
+        self.retries = 0
+        self.result = None
+        self._callbacks = []
+
+    def done(self):
+        return self.state in self.FINISHED
+
+    def overdue(self, now):
+        return self.state == self.SENT and \
+            now - self['sentTime'] > self.policy.timeout_for(self.retries, self.timeout)
+
+    def _finish(self, state, result):
+        self.state = state
+        self.result = result
+        self['waitEvent'].set()
+        callbacks, self._callbacks = self._callbacks, []
+        return callbacks
+
+
+class AddressIndex(object):
+    """
+    Registered devices by normalized address, so routing a packet is a
+    dict lookup.  Entries without a list of addresses may match any address
+    and are kept apart; lookup returns both in registration order.
+    """
+    def __init__(self, entries):
+        # entries: (item, addresses or None) in registration order
+        self._byAddress = dict()
+        self._wildcard = []
+        for position, (item, addresses) in enumerate(entries):
+            try:
+                keys = set(self.normalize(address) for address in addresses)
+            except TypeError:
+                # no addresses or unhashable ones, ask the item itself
+                self._wildcard.append((position, item, False))
+                continue
+            for key in keys:
+                self._byAddress.setdefault(key, []).append((position, item, True))
+
+    @staticmethod
+    def normalize(address):
+        try:
+            return address.lower()
+        except AttributeError:
+            return address
+
+    def lookup(self, address):
+        """
+        Returns (item, indexed) pairs.  indexed is False for wildcard
+        entries, which still have to check the address themselves.
+        """
+        try:
+            indexed = self._byAddress.get(self.normalize(address), [])
+        except TypeError:
+            indexed = []
+        if not self._wildcard:
+            entries = indexed
+        elif not indexed:
+            entries = self._wildcard
+        else:
+            entries = sorted(indexed + self._wildcard)
+        return [(item, exact) for position, item, exact in entries]
+
+
+class StatusRefresh(object):
+    """
+    Result of a bulk status refresh, filled in from its own thread.
+    Keeps up to `window` status requests in flight at once and lets the
+    interface match the replies back to their devices as they arrive.
+
+    results maps each address to the reply (True or the returned data),
+    or False when the device never answered.  It gives up once every
+    address could have used up its retries, or when the interface thread
+    is gone.
+    """
+    def __init__(self, interface, addresses, window=4, timeout=2, retries=1):
+        self._interface = interface
+        self.addresses = list(addresses)
+        self.window = window
+        self.timeout = timeout
+        self.retries = retries
+        self.results = dict()
+        self.elapsed = None
+        self._inFlight = 0
+        self._gaveUp = False
+        self._answered = threading.Condition()
+        self._finished = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='StatusRefresh')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def done(self):
+        return self._finished.isSet()
+
+    def wait(self, timeout=None):
+        self._finished.wait(timeout)
+        return self.results
+
+    @property
+    def non_responders(self):
+        return [address for address in self.addresses if self.results.get(address) is False]
+
+    def _run(self):
+        startTime = time.time()
+        try:
+            with command_priority(Priority.STATUS):
+                self._refresh()
+        finally:
+            self.elapsed = time.time() - startTime
+            self._finished.set()
+
+    def _refresh(self):
+        policy = RetryPolicy(timeout=self.timeout, retries=self.retries)
+        # every request, and those queued ahead of them, waited out in turn at the
+        # interface's pace, so a dead interface thread can not hold the caller
+        with self._interface._commandLock:
+            requests = len(self.addresses) + len(self._interface._outboundQueue)
+        deadline = time.time() + requests * (self.timeout + self._interface._intersend_delay) * (self.retries + 1)
+        for address in self.addresses:
+            with self._answered:
+                while self._inFlight >= self.window:
+                    if not self._waitAnswered(deadline):
+                        return self._giveUp()
+            commandExecutionDetails = self._interface._queueStatusRequest(address)
+            if commandExecutionDetails is None:
+                # this interface cannot pipeline the request, ask the slow way
+                self.results[address] = self._interface.status(address)
+            elif not commandExecutionDetails:
+                self.results[address] = False
+            else:
+                with self._answered:
+                    self._inFlight += 1
+                self._interface._whenCommandFinishes(commandExecutionDetails,
+                                                     functools.partial(self._onAnswer, address),
+                                                     policy=policy)
+        with self._answered:
+            while self._inFlight:
+                if not self._waitAnswered(deadline):
+                    return self._giveUp()
+
+    def _waitAnswered(self, deadline):
+        """ Waits for an answer with _answered held, False once none can come in time """
+        remaining = deadline - time.time()
+        if remaining <= 0 or not self._interface._main_thread.is_alive():
+            # only the interface thread answers or fails the requests
+            return False
+        self._answered.wait(min(remaining, HAInterface.IO_MAX_WAIT))
+        return True
+
+    def _giveUp(self):
+        # with _answered held, answers arriving after this are ignored
+        for address in self.addresses:
+            self.results.setdefault(address, False)
+        self._inFlight = 0
+        self._gaveUp = True
+
+    def _onAnswer(self, address, command):
+        with self._answered:
+            if self._gaveUp:
+                return
+            self.results[address] = command.result
+            self._inFlight -= 1
+            self._answered.notify()
+
 
 class HAInterface(AsynchronousInterface, PytomationObject):
     "Base protocol interface"
 
     MODEM_PREFIX = '\x02'
+    IO_MAX_WAIT = 0.5  # longest select() wait so driver housekeeping keeps running
     
     def __init__(self, interface, *args, **kwargs):
         kwargs.update({'interface': interface})
@@ -49,44 +387,119 @@ class HAInterface(AsynchronousInterface, PytomationObject):
         self._interfaceRunningEvent = threading.Event()
 
         self._commandLock = threading.Lock()
-        self._outboundQueue = deque()
+        self._outboundQueue = OutboundQueue()
+        # every unfinished OutboundCommand by hash, queued ones are also in
+        # _outboundCommandDetails and sent ones in _pendingCommandDetails
+        self._commands = dict()
         self._outboundCommandDetails = dict()
-        self._retryCount = dict()
-
         self._pendingCommandDetails = dict()
+        # resent only when someone waits for the reply or the driver says one is coming
+        self._retryPolicy = RetryPolicy()
+        self._noRetryPolicy = RetryPolicy(retries=0)
 
         self._commandReturnData = dict()
 
         self._intersend_delay = 0.15  # 150 ms between network sends
         self._lastSendTime = 0
+        self._lastSentCommandHash = None
+        self._pacing = None  # optional PacingController adjusting _intersend_delay
 
         self._interface = kwargs['interface']
         self._commandDelegates = []
         self._devices = []
+        self._routes = None  # (version, AddressIndex of _devices)
+        self._routesVersion = 0
         self._lastPacketHash = None
 
+        # _sendInterfaceCommand writes to this pipe to wake the loop out of select(),
+        # open only while run() loops so an interface never started holds no fds
+        self._interfaceFileno = None
+        self._wakeupRead = self._wakeupWrite = None
+        self._wakeupLock = threading.Lock()  # opening and closing the pipe against writes to it
+
     def shutdown(self):
         if self._interfaceRunningEvent.isSet():
             self._shutdownEvent.set()
+            self._wakeup()
 
             #wait 2 seconds for the interface to shut down
-            self._interfaceRunningEvent.wait(2000)
+            if threading.current_thread() is not self._main_thread:
+                self._main_thread.join(2)
 
     def run(self, *args, **kwargs):
+        with self._wakeupLock:
+            self._wakeupRead, self._wakeupWrite = os.pipe()
+            for fd in (self._wakeupRead, self._wakeupWrite):
+                fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
         self._interfaceRunningEvent.set()
+        self._interfaceFileno = self._getInterfaceFileno()
 
         #for checking for duplicate messages received in a row
 
         while not self._shutdownEvent.isSet():
             try:
+                self._waitForIO()
+
                 self._writeInterface()
-    
+
                 self._readInterface(self._lastPacketHash)
+
+                self._checkCommands()
             except Exception, ex:
                 self._logger.error("Problem with interface: " + str(ex))
                 
+        with self._wakeupLock:
+            os.close(self._wakeupRead)
+            os.close(self._wakeupWrite)
+            self._wakeupRead = self._wakeupWrite = None
         self._interfaceRunningEvent.clear()
 
+    def _getInterfaceFileno(self):
+        try:
+            fileno = self._interface.fileno()
+        except Exception, ex:
+            return None
+        if isinstance(fileno, (int, long)):
+            return fileno
+        return None
+
+    def _waitForIO(self):
+        """
+        Block until the interface has data, a command is queued or the
+        next send is due.  Interfaces without a file descriptor keep the
+        old behavior of _readInterface sleeping when idle.
+        """
+        if self._interfaceFileno is None:
+            return
+        timeout = self.IO_MAX_WAIT
+        if self._outboundQueue:
+            timeout = min(timeout, max(self._intersend_delay - (time.time() - self._lastSendTime), 0))
+        nextDeadline = self._nextCommandDeadline()
+        if nextDeadline is not None:
+            timeout = min(timeout, max(nextDeadline - time.time(), 0))
+        readable, writable, errored = select.select([self._interfaceFileno, self._wakeupRead], [], [], timeout)
+        if self._wakeupRead in readable:
+            try:
+                os.read(self._wakeupRead, 4096)
+            except OSError, ex:
+                pass
+
+    def _wakeup(self):
+        with self._wakeupLock:
+            if self._wakeupWrite is None:
+                # the loop has stopped
+                return
+            try:
+                os.write(self._wakeupWrite, '\0')
+            except OSError, ex:
+                # pipe is full, the loop is already due to wake
+                pass
+
+    def _idleWait(self, secs):
+        # Nothing to read.  In select mode _waitForIO has already done the waiting
+        if self._interfaceFileno is None:
+            time.sleep(secs)
+
     def onCommand(self, callback=None, address=None, device=None):
         # Register a device for notification of commands
         if not device:
@@ -96,11 +509,41 @@ class HAInterface(AsynchronousInterface, PytomationObject):
                                        })
         else:
             self._devices.append(device)
+        self.reindex()
+
+    def reindex(self):
+        """
+        Registered devices changed their addresses, rebuild the routing
+        index before the next packet is dispatched.
+        """
+        self._routesVersion += 1
+
+    def _getRoutes(self):
+        routes = self._routes
+        if routes is None or routes[0] != self._routesVersion:
+            version = self._routesVersion
+            routes = self._routes = (version, AddressIndex((device, self._deviceAddresses(device))
+                                                           for device in self._devices))
+        return routes[1]
+
+    def _deviceAddresses(self, device):
+        try:
+            addresses = device.matchedAddresses()
+        except Exception, ex:
+            return None
+        if isinstance(addresses, (list, tuple)):
+            return addresses
+        return None
+
+    def _devicesForAddress(self, address):
+        """ Registered devices matching the address, in registration order """
+        return [device for device, indexed in self._getRoutes().lookup(address)
+                if indexed or device.addressMatches(address)]
 
     def _onCommand(self, command=None, address=None):
         # Received command from interface and this will delegate to subscribers
-        self._logger.debug("Received Command:" + str(address) + ":" + str(command))
-        self._logger.debug('Delegates for Command: ' + str(self._commandDelegates))
+        self._logger.debug("Received Command:{0}:{1}", address, command)
+        self._logger.debug('Delegates for Command: {0}', self._commandDelegates)
         
         addressC = address
         try:
@@ -120,32 +563,29 @@ class HAInterface(AsynchronousInterface, PytomationObject):
                                                 address=address,
                                                 source=self
                                                 )
-        self._logger.debug('Devices for Command: ' + str(self._devices))
-        for device in self._devices:
-            if device.addressMatches(address):
-                try:
-                    device._on_command(
-                                       command=command,
-                                       address=address,
-                                       source=self,
-                                       )
-                except Exception, ex:
-                    device.command(
+        for device in self._devicesForAddress(address):
+            try:
+                device._on_command(
                                    command=command,
+                                   address=address,
                                    source=self,
-                                   address=address)
+                                   )
+            except Exception, ex:
+                device.command(
+                               command=command,
+                               source=self,
+                               address=address)
 
     def _onState(self, state, address):
-        for device in self._devices:
-            if device.addressMatches(address):
-                try:
-                    device.set_state(
-                                       state,
-                                       address=address,
-                                       source=self,
-                                       )
-                except Exception, ex:
-                    self._logger.debug('Could not set state for device: {device}'.format(device=device.name))
+        for device in self._devicesForAddress(address):
+            try:
+                device.set_state(
+                                   state,
+                                   address=address,
+                                   source=self,
+                                   )
+            except Exception, ex:
+                self._logger.debug('Could not set state for device: {device}', device=device.name)
                     
                     
     def _sendInterfaceCommand(self, modemCommand,
@@ -168,35 +608,61 @@ class HAInterface(AsynchronousInterface, PytomationObject):
             if commandDataString != None:
                 bytesToSend += commandDataString
             commandHash = hashPacket(bytesToSend)
+            finished = []
 
             self._commandLock.acquire()
             if commandHash in self._outboundCommandDetails:
                 #duplicate command.  Ignore
-                pass
+                if extraCommandDetails and extraCommandDetails.get('joinDuplicate'):
+                    # unless the caller wants the reply, it is the queued one's
+                    returnValue = self._outboundCommandDetails[commandHash]
 
             else:
+                if commandHash in self._commands:
+                    # the same packet is still waiting on its reply, the new one takes over
+                    finished.append(self._finishCommand(self._commands[commandHash],
+                                                        OutboundCommand.SUPERSEDED, True))
+
                 waitEvent = threading.Event()
 
                 basicCommandDetails = {'bytesToSend': bytesToSend,
                                        'waitEvent': waitEvent,
-                                       'modemCommand': modemCommand}
+                                       'modemCommand': modemCommand,
+                                       'priority': current_priority()}
 
                 if extraCommandDetails != None:
                     basicCommandDetails = dict(
                                        basicCommandDetails.items() + \
                                        extraCommandDetails.items())
 
-                self._outboundCommandDetails[commandHash] = basicCommandDetails
+                policy = basicCommandDetails.get('retryPolicy')
+                if policy is None:
+                    policy = self._retryPolicy if basicCommandDetails.get('expectsReply') else self._noRetryPolicy
+                command = OutboundCommand(commandHash, basicCommandDetails, policy)
+                self._commands[commandHash] = command
+                self._outboundCommandDetails[commandHash] = command
 
-                self._outboundQueue.append(commandHash)
-                self._retryCount[commandHash] = 0
+                superseded = self._outboundQueue.append(commandHash,
+                                                        command['priority'],
+                                                        command.get('coalesceKey'))
+                if superseded:
+                    # the newer command replaces it, release anyone waiting on the old one
+                    self._logger.debug("{0} superseded by {1}", superseded, commandHash)
+                    finished.append(self._finishCommand(self._commands[superseded],
+                                                        OutboundCommand.SUPERSEDED, True))
 
-                self._logger.debug("Queued %s" % commandHash)
+                self._logger.debug("Queued {0}", commandHash)
 
-                returnValue = {'commandHash': commandHash,
-                               'waitEvent': waitEvent}
+                returnValue = command
 
             self._commandLock.release()
+            self._runCallbacks(finished)
+            batch = current_batch()
+            if batch:
+                # woken once for the whole batch
+                batch.defer(self._wakeup)
+            else:
+                self._wakeup()
 
         except Exception, ex:
             print traceback.format_exc()
@@ -220,27 +686,31 @@ class HAInterface(AsynchronousInterface, PytomationObject):
             try:
                 commandExecutionDetails = self._outboundCommandDetails[commandHash]
             except Exception, ex:
-                self._logger.error('Could not find execution details: {command} {error}'.format(
+                self._logger.error('Could not find execution details: {command} {error}',
                                                                                                 command=commandHash,
-                                                                                                error=str(ex))
+                                                                                                error=ex
                                    )
             else:
                 bytesToSend = commandExecutionDetails['bytesToSend']
     
     #            self._logger.debug("Transmit>" + str(hex_dump(bytesToSend, len(bytesToSend))))
-                try:
-                    self._logger.debug("Transmit>" + Conversions.ascii_to_hex(bytesToSend))
-                except:
-                    self._logger.debug("Transmit>" + str(bytesToSend))
+                if self._logger.isEnabledFor(logging.DEBUG):
+                    try:
+                        self._logger.debug("Transmit>" + Conversions.ascii_to_hex(bytesToSend))
+                    except:
+                        self._logger.debug("Transmit>" + str(bytesToSend))
                     
 #                result = self._interface.write(bytesToSend)
                 result = self._writeInterfaceFinal(bytesToSend)
-                self._logger.debug("TransmitResult>" + str(result))
+                self._logger.debug("TransmitResult>{0}", result)
     
                 self._pendingCommandDetails[commandHash] = commandExecutionDetails
                 del self._outboundCommandDetails[commandHash]
     
                 self._lastSendTime = time.time()
+                self._lastSentCommandHash = commandHash
+                commandExecutionDetails['sentTime'] = self._lastSendTime
+                commandExecutionDetails.state = OutboundCommand.SENT
 
         try:
             self._commandLock.release()
@@ -257,93 +727,213 @@ class HAInterface(AsynchronousInterface, PytomationObject):
             try:
                 response = self._interface.read()
             except Exception, ex:
-                self._logger.debug("Error reading from interface {interface} exception: {ex}".format(
-                                                                                     interaface=str(self._interface),
-                                                                                     ex=str(ex)
-                                                                                     )
+                self._logger.debug("Error reading from interface {interface} exception: {ex}",
+                                                                                     interface=self._interface,
+                                                                                     ex=ex
                                    )
         try:
             if response and len(response) != 0:
     #            self._logger.debug("[HAInterface-Serial] Response>\n" + hex_dump(response))
-                self._logger.debug("Response>" + hex_dump(response) + "<")
+                if self._logger.isEnabledFor(logging.DEBUG):
+                    self._logger.debug("Response>" + hex_dump(response) + "<")
                 self._onCommand(command=response)
             else:
                 #print "Sleeping"
                 #X10 is slow.  Need to adjust based on protocol sent.  Or pay attention to NAK and auto adjust
                 #time.sleep(0.1)
-                time.sleep(0.5)
+                self._idleWait(0.5)
         except TypeError, ex:
             pass
 
     def _waitForCommandToFinish(self, commandExecutionDetails, timeout=None):
-
-        if type(commandExecutionDetails) != type(dict()):
+        """
+        Block until the interface thread has finished the command and return
+        its reply data, True, or False once it ran out of retries.  Inside
+        command_nowait() the OutboundCommand is returned as soon as it is queued.
+        """
+        command = self._outboundCommand(commandExecutionDetails)
+        if command is None:
             self._logger.error("Unable to wait without a valid commandExecutionDetails parameter")
             return False
 
-        waitEvent = commandExecutionDetails['waitEvent']
-        commandHash = commandExecutionDetails['commandHash']
-
-        realTimeout = 2  # default timeout of 2 seconds
-        if timeout:
-            realTimeout = timeout
-
-        timeoutOccured = False
+        self._commandLock.acquire()
+        try:
+            self._expectReply(command)
+            if timeout:
+                command.timeout = timeout
+        finally:
+            self._commandLock.release()
+        if not waiting_for_commands():
+            return command
+
+        waitEvent = command['waitEvent']
+        while not waitEvent.wait(self.IO_MAX_WAIT):
+            if not self._main_thread.is_alive():
+                # nothing is left to answer or retry it
+                self._runCallbacks([self._finishCommandLocked(command, OutboundCommand.FAILED, False)])
+                break
+        if not command.done():
+            # the protocol driver answered it, the interface thread hasn't caught up yet
+            self._runCallbacks([self._finishCommandLocked(command, OutboundCommand.ACKED)])
+        return command.result
+
+    def _whenCommandFinishes(self, commandExecutionDetails, callback, policy=None, timeout=None):
+        """
+        Call callback(command) on the interface thread once the command is
+        acked or has failed, instead of parking the caller until then.
+        """
+        command = self._outboundCommand(commandExecutionDetails)
+        self._commandLock.acquire()
+        try:
+            if policy:
+                command.policy = policy
+            else:
+                self._expectReply(command)
+            if timeout:
+                command.timeout = timeout
+            if not command.done():
+                command._callbacks.append(callback)
+                return command
+        finally:
+            self._commandLock.release()
+        callback(command)
+        return command
+
+    def _expectReply(self, command):
+        # someone waits for the reply, resend the command until it comes
+        if command.policy is self._noRetryPolicy:
+            command.policy = self._retryPolicy
+
+    def _outboundCommand(self, commandExecutionDetails):
+        if isinstance(commandExecutionDetails, OutboundCommand):
+            return commandExecutionDetails
+        if isinstance(commandExecutionDetails, dict):
+            return self._commands.get(commandExecutionDetails.get('commandHash'))
+        return None
 
-        if sys.version_info[:2] > (2, 6):
-            #python 2.7 and above waits correctly on events
-            timeoutOccured = not waitEvent.wait(realTimeout)
-        else:
-            #< then python 2.7 and we need to do the waiting manually
-            while not waitEvent.isSet() and realTimeout > 0:
-                time.sleep(0.1)
-                realTimeout -= 0.1
+    def _checkCommands(self):
+        """
+        Run by the interface thread.  Commands the protocol driver has answered
+        are acked, sent ones left unanswered past their timeout are resent or
+        failed as their RetryPolicy says.
+        """
+        finished = []
+        now = time.time()
+        self._commandLock.acquire()
+        try:
+            for command in self._commands.values():
+                if command['waitEvent'].isSet():
+                    finished.append(self._finishCommand(command, OutboundCommand.ACKED))
+                elif command.overdue(now):
+                    self._commandTimedOut(command.commandHash)
+                    if command.policy.should_retry(command.retries):
+                        self._logger.debug("Timed out for {0} - Requeueing (already had {1} retries)",
+                                           command.commandHash, command.retries)
+                        command.retries += 1
+                        self._requeueCommand(command.commandHash, locked=True, finished=finished)
+                    else:
+                        self._logger.debug("Timed out for {0} - Giving up after {1} retries",
+                                           command.commandHash, command.retries)
+                        finished.append(self._finishCommand(command, OutboundCommand.FAILED, False))
+            # replies to commands that finished without them
+            for commandHash in self._commandReturnData.keys():
+                if commandHash not in self._commands:
+                    del self._commandReturnData[commandHash]
+        finally:
+            self._commandLock.release()
+        self._runCallbacks(finished)
 
-            if realTimeout == 0:
-                timeoutOccured = True
+    def _nextCommandDeadline(self):
+        self._commandLock.acquire()
+        try:
+            deadlines = [command['sentTime'] + command.policy.timeout_for(command.retries, command.timeout)
+                         for command in self._commands.values() if command.state == OutboundCommand.SENT]
+        finally:
+            self._commandLock.release()
+        if deadlines:
+            return min(deadlines)
+        return None
 
-        if not timeoutOccured:
-            if commandHash in self._commandReturnData:
-                return self._commandReturnData[commandHash]
-            else:
-                return True
-        else:
-            #re-queue the command to try again
+    def _requeueCommand(self, commandHash, locked=False, finished=None):
+        """
+        Move a sent command back onto the outbound queue to be sent again,
+        ahead of the commands queued after it.  When a newer command with its
+        coalesce key is queued the command is superseded by it instead, its
+        callbacks added to finished by callers holding the lock.
+        """
+        superseded = []
+        if not locked:
             self._commandLock.acquire()
-
-            if self._retryCount[commandHash] >= 5:
-                #too many retries.  Bail out
-                self._commandLock.release()
+        try:
+            command = self._pendingCommandDetails.pop(commandHash, None)
+            if not command:
                 return False
-
-            self._logger.debug("Timed out for %s - Requeueing (already had %d retries)" % \
-                (commandHash, self._retryCount[commandHash]))
-
-            requiresRetry = True
-            if commandHash in self._pendingCommandDetails:
-                self._outboundCommandDetails[commandHash] = \
-                    self._pendingCommandDetails[commandHash]
-
-                del self._pendingCommandDetails[commandHash]
-
-                self._outboundQueue.append(commandHash)
-                self._retryCount[commandHash] += 1
-            else:
-                self._logger.debug("Interesting.  timed out for %s, but there are no pending command details" % commandHash)
-                #to prevent a huge loop here we bail out
-                requiresRetry = False
-
-            try:
-                self._logger.debug("Removing Lock " + str( self._commandLock))
+            key = command.get('coalesceKey')
+            newer = self._outboundQueue.holder(key) if key is not None else None
+            if newer:
+                self._logger.debug("{0} superseded by {1} instead of resent", commandHash, newer)
+                superseded.append(self._finishCommand(command, OutboundCommand.SUPERSEDED, True))
+                return False
+            command.state = OutboundCommand.QUEUED
+            self._outboundCommandDetails[commandHash] = command
+            self._outboundQueue.append(commandHash, command.get('priority', Priority.AUTOMATION), key, front=True)
+            return True
+        finally:
+            if not locked:
                 self._commandLock.release()
-            except:
-                self._logger.error("Could not release Lock! " + str(self._commandLock))
-                
-            if requiresRetry:
-                return self._waitForCommandToFinish(commandExecutionDetails,
-                                                    timeout=timeout)
+            if finished is None:
+                self._runCallbacks(superseded)
             else:
-                return False
+                finished.extend(superseded)
+
+    def _finishCommand(self, command, state, result=None):
+        """
+        Record the outcome of a command and drop it from the bookkeeping.  The
+        caller holds _commandLock and passes the return value to _runCallbacks
+        once it has released it.
+        """
+        commandHash = command.commandHash
+        if self._outboundCommandDetails.get(commandHash) is command:
+            del self._outboundCommandDetails[commandHash]
+            if commandHash in self._outboundQueue:
+                self._outboundQueue.remove(commandHash)
+        for details in (self._pendingCommandDetails, self._commands):
+            if details.get(commandHash) is command:
+                del details[commandHash]
+        if commandHash in self._commandReturnData:
+            returnData = self._commandReturnData.pop(commandHash)
+            if state == OutboundCommand.ACKED:
+                result = returnData
+        if result is None:
+            result = True
+        return (command, command._finish(state, result))
+
+    def _finishCommandLocked(self, command, state, result=None):
+        self._commandLock.acquire()
+        try:
+            if command.done():
+                return (command, [])
+            return self._finishCommand(command, state, result)
+        finally:
+            self._commandLock.release()
+
+    def _runCallbacks(self, finished):
+        for command, callbacks in finished:
+            for callback in callbacks:
+                try:
+                    callback(command)
+                except Exception, ex:
+                    self._logger.error("Command callback failed for {0}: {1}", command.commandHash, ex)
+
+    def _queueStatusRequest(self, address):
+        """
+        Queue a status request without waiting for it and return its
+        commandExecutionDetails, those of the identical request already
+        queued when there is one ('joinDuplicate' in extraCommandDetails).
+        None means this interface only has the blocking status() for that
+        address.
+        """
+        return None
 
     @property
     def name(self):
@@ -354,9 +944,49 @@ class HAInterface(AsynchronousInterface, PytomationObject):
         self.name_ex = value
         return self.name_ex
     
-    def update_status(self):
-        for d in self._devices:
-            self.status(d.address)
+    def _commandAcked(self, commandHash):
+        if self._pacing:
+            sentTime = None
+            for details in (self._pendingCommandDetails, self._outboundCommandDetails):
+                if commandHash in details:
+                    sentTime = details[commandHash].get('sentTime')
+            self._intersend_delay = self._pacing.ack(time.time() - sentTime if sentTime else None)
+
+    def _commandNaked(self, commandHash):
+        if self._pacing:
+            self._intersend_delay = self._pacing.nak()
+
+    def _commandTimedOut(self, commandHash):
+        command = self._commands.get(commandHash)
+        if command is not None and command.policy is self._noRetryPolicy:
+            # fire and forget, nothing says the line was busy
+            return
+        if self._pacing:
+            self._intersend_delay = self._pacing.timeout()
+
+    def outbound_metrics(self):
+        self._commandLock.acquire()
+        try:
+            metrics = self._outboundQueue.metrics()
+            metrics.update({'unfinished': len(self._commands)})
+            if self._pacing:
+                metrics.update({'pacing': self._pacing.metrics()})
+            return metrics
+        finally:
+            self._commandLock.release()
+
+    def update_status(self, addresses=None, window=4, timeout=2, retries=1, wait=True):
+        """
+        Refresh the status of every device (or just `addresses`) and return
+        the StatusRefresh once it is done.  With wait=False it is returned
+        right away to wait() on.
+        """
+        if addresses is None:
+            addresses = [d.address for d in self._devices]
+        refresh = StatusRefresh(self, addresses, window=window, timeout=timeout, retries=retries)
+        if wait:
+            refresh.wait()
+        return refresh
             
     def status(self, address=None):
         return None
@@ -1,6 +1,12 @@
 import BaseHTTPServer
+import Queue
 import base64
+import fcntl
+import os
+import select
+import socket
 import threading
+import time
 from SocketServer import ThreadingMixIn
 from SimpleHTTPServer import SimpleHTTPRequestHandler
 from pytomation.common import config
@@ -13,16 +19,34 @@ file_path = "/tmp"
 
 class PytoHandlerClass(SimpleHTTPRequestHandler):
     server = None
+    api = None  # shared by all requests, set by HTTPServer
+    timeout = 30  # seconds a worker waits for the rest of a request
 
     def __init__(self,req, client_addr, server):
 #        self._request = req
 #        self._address = client_addr
-        self._logger = PytoLogging(self.__class__.__name__)
-        self._api = PytomationAPI()
+        self._api = self.api or PytomationAPI()
         self._server = server
+        self.persistent = False
 
         SimpleHTTPRequestHandler.__init__(self, req, client_addr, server)
 
+    def handle(self):
+        """
+        Handles one request, or the ones a client already pipelined, then
+        leaves a persistent connection to the server instead of holding a
+        worker while it is idle.
+        """
+        self.close_connection = 1
+        self.handle_one_request()
+        while not self.close_connection and self._buffered():
+            self.handle_one_request()
+        self.persistent = not self.close_connection
+
+    def _buffered(self):
+        rbuf = getattr(self.rfile, '_rbuf', None)
+        return rbuf is not None and rbuf.tell() > 0
+
     def translate_path(self, path):
         global file_path
         path = file_path + path
@@ -36,6 +60,8 @@ class PytoHandlerClass(SimpleHTTPRequestHandler):
 
     def do_AUTHHEAD(self):
         print "send header"
+        # the message that follows has no length, the connection ends it
+        self.close_connection = 1
         self.send_response(401)
         self.send_header('WWW-Authenticate', 'Basic realm=\"Test\"')
         self.send_header('Content-type', 'text/html')
@@ -43,12 +69,9 @@ class PytoHandlerClass(SimpleHTTPRequestHandler):
 
     def do_OPTIONS(self):
         self.send_response(200, "ok")
-        self.send_header('Access-Control-Allow-Origin', '*')
-        if config.auth_enabled == 'Y':
-            self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS, ON, OFF, DELETE, PUT, AUTHHEAD, HEAD')
-            self.send_header("Access-Control-Allow-Headers", "Authorization")
-        else:
-            self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS, ON, OFF, DELETE, PUT, HEAD')
+        self.send_access_headers()
+        self.send_header("Content-length", 0)
+        self.end_headers()
 
     def do_GET(self):
         auth_credentials = base64.b64encode(config.admin_user + ":" + config.admin_password)
@@ -95,28 +118,159 @@ class PytoHandlerClass(SimpleHTTPRequestHandler):
                 length = int(self.headers.getheader('content-length'))
                 data = self.rfile.read(length)
 #                print 'rrrrr' + str(length) + ":" + str(data) + 'fffff' + str(self._server)
-                self.rfile.close()
-            response = self._api.get_response(method=method, path="/".join(p[2:]), type=None, data=data, source=PytoHandlerClass.server)
+            path = "/".join(p[2:])
+            etag = self._api.get_etag(path) if method.lower() == 'get' else None
+            if etag and self.headers.getheader('If-None-Match') == etag:
+                # nothing changed since the client's copy
+                self.send_response(304)
+                self.send_access_headers()
+                self.send_header("ETag", etag)
+                self.end_headers()
+                return
+            response = self._api.get_response(method=method, path=path, type=None, data=data, source=PytoHandlerClass.server)
             self.send_response(200)
-            self.send_header('Access-Control-Allow-Origin', '*')
-            if config.auth_enabled == 'Y':
-                self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS, ON, OFF, DELETE, PUT, AUTHHEAD, HEAD')
-                self.send_header("Access-Control-Allow-Headers", "Authorization")
-            else:
-                self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS, ON, OFF, DELETE, PUT, HEAD')
+            self.send_access_headers()
+            if etag:
+                self.send_header("ETag", etag)
             self.send_header("Content-length", len(response))
             self.send_header("Content-type", "application/json")
             self.end_headers()
             self.wfile.write(response)
-            self.finish()
         else:
             getattr(SimpleHTTPRequestHandler, "do_" + self.command.upper())(self)
 
+    def send_access_headers(self):
+        self.send_header('Access-Control-Allow-Origin', '*')
+        if config.auth_enabled == 'Y':
+            self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS, ON, OFF, DELETE, PUT, AUTHHEAD, HEAD')
+            self.send_header("Access-Control-Allow-Headers", "Authorization")
+        else:
+            self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS, ON, OFF, DELETE, PUT, HEAD')
+
 class ThreadedHTTPServer(ThreadingMixIn, BaseHTTPServer.HTTPServer):
     '''
     classdocs
     '''
 
+class PooledHTTPServer(BaseHTTPServer.HTTPServer):
+    """
+    HTTP server answering requests from a fixed pool of worker threads.
+    Persistent connections are watched by one thread while they are idle
+    and handed back to the pool when the next request arrives, so a
+    worker is only busy for the duration of a request.
+    """
+    daemon_threads = True
+    request_queue_size = 64  # listen backlog, the default of 5 drops bursts
+
+    def __init__(self, server_address, handler, workers=8, idle_timeout=60):
+        BaseHTTPServer.HTTPServer.__init__(self, server_address, handler)
+        self.idle_timeout = idle_timeout
+        self._requests = Queue.Queue()
+        self._idle = {}  # socket: (client_address, idle since)
+        self._idle_lock = threading.Lock()
+        self._closing = False
+        self._wakeup_read, self._wakeup_write = os.pipe()
+        for fd in (self._wakeup_read, self._wakeup_write):
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        self._threads = [threading.Thread(target=self._work, name='HTTPWorker')
+                         for i in range(workers)]
+        self._threads.append(threading.Thread(target=self._watch_idle, name='HTTPIdle'))
+        for thread in self._threads:
+            thread.setDaemon(self.daemon_threads)
+            thread.start()
+
+    def get_request(self):
+        (request, client_address) = self.socket.accept()
+        # headers and body are separate writes, don't hold the body back
+        # waiting on the client's delayed ACK of a persistent connection
+        request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return (request, client_address)
+
+    def process_request(self, request, client_address):
+        self._requests.put((request, client_address))
+
+    def finish_request(self, request, client_address):
+        return self.RequestHandlerClass(request, client_address, self)
+
+    def _keep_alive(self, request, client_address):
+        with self._idle_lock:
+            if self._closing:
+                return False
+            self._idle[request] = (client_address, time.time())
+            self._wakeup()
+        return True
+
+    def _wakeup(self):
+        # with _idle_lock held, the watcher closes the pipe under it
+        try:
+            os.write(self._wakeup_write, 'x')
+        except OSError, ex:
+            # a wakeup is already pending
+            pass
+
+    def _work(self):
+        while True:
+            item = self._requests.get()
+            if item is None:
+                return
+            request, client_address = item
+            handler = None
+            try:
+                handler = self.finish_request(request, client_address)
+            except Exception, ex:
+                self.handle_error(request, client_address)
+            if not (getattr(handler, 'persistent', False) and self._keep_alive(request, client_address)):
+                self.shutdown_request(request)
+
+    def _watch_idle(self):
+        while not self._closing:
+            with self._idle_lock:
+                sockets = self._idle.keys()
+            try:
+                readable = select.select(sockets + [self._wakeup_read], [], [], 1)[0]
+            except (select.error, socket.error), ex:
+                # a connection was closed under us, forget it
+                with self._idle_lock:
+                    for request in sockets:
+                        try:
+                            request.fileno()
+                        except socket.error:
+                            self._idle.pop(request, None)
+                continue
+            if self._wakeup_read in readable:
+                try:
+                    os.read(self._wakeup_read, 4096)
+                except OSError, ex:
+                    pass
+                readable.remove(self._wakeup_read)
+            now = time.time()
+            with self._idle_lock:
+                for request in readable:
+                    # the next request, or the client hanging up
+                    if request in self._idle:
+                        self._requests.put((request, self._idle.pop(request)[0]))
+                expired = [request for (request, (address, since)) in self._idle.items()
+                           if now - since > self.idle_timeout]
+                for request in expired:
+                    del self._idle[request]
+            for request in expired:
+                self.shutdown_request(request)
+        with self._idle_lock:
+            os.close(self._wakeup_read)
+            os.close(self._wakeup_write)
+
+    def server_close(self):
+        BaseHTTPServer.HTTPServer.server_close(self)
+        with self._idle_lock:
+            self._closing = True
+            self._wakeup()
+            idle = self._idle.keys()
+            self._idle.clear()
+        for thread in self._threads:
+            self._requests.put(None)
+        for request in idle:
+            self.shutdown_request(request)
+
 class HTTPServer(HAInterface):
     def __init__(self, address=None, port=None, path=None, *args, **kwargs):
         super(HTTPServer, self).__init__(address, *args, **kwargs)
@@ -128,8 +282,11 @@ class HTTPServer(HAInterface):
         global file_path
         self._address = kwargs.get('address', config.http_address)
         self._port = kwargs.get('port', config.http_port)
-        self._protocol = "HTTP/1.0"
+        self._protocol = kwargs.get('protocol', "HTTP/1.1")
+        self._workers = kwargs.get('workers', 8)
         self._path = kwargs.get('path', config.http_path)
+        self._api = PytomationAPI()
+        self._httpd = None
         file_path = self._path
         
     def run(self):
@@ -137,10 +294,17 @@ class HTTPServer(HAInterface):
         
         PytoHandlerClass.protocol_version = self._protocol
         PytoHandlerClass.server = self
-        httpd = ThreadedHTTPServer(server_address, PytoHandlerClass)
+        PytoHandlerClass.api = self._api
+        httpd = PooledHTTPServer(server_address, PytoHandlerClass, workers=self._workers)
+        self._httpd = httpd
         
         sa = httpd.socket.getsockname()
         print "Serving HTTP files at ", self._path, " on", sa[0], "port", sa[1], "..."
         httpd.serve_forever()
+        httpd.server_close()
         #BaseHTTPServer.test(HandlerClass, ServerClass, protocol)
 
+    def shutdown(self):
+        if self._httpd:
+            self._httpd.shutdown()
+        super(HTTPServer, self).shutdown()
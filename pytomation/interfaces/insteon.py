@@ -52,9 +52,10 @@ import struct
 import sys
 import string
 import hashlib
+import logging
 from collections import deque
 from .common import *
-from .ha_interface import HAInterface
+from .ha_interface import HAInterface, OutboundCommand, PacingController
 from pytomation.devices import State
 
 def _byteIdToStringId(idHigh, idMid, idLow):
@@ -139,12 +140,12 @@ class InsteonPLM(HAInterface):
     #(address:engineVersion) engineVersion 0x00=i1, 0x01=i2, 0x02=i2cs
     deviceList = {}         # Dynamically built list of devices [address,devcat,subcat,firmware,engine,name]
                             # we store and load this from disk and only run when network changes
-    currentCommand = ""
-    cmdQueueList = []   	# List of orphaned commands that need to be dealt with
     spinTime = 0.1   		# _readInterface loop time
     extendedCommand = False	# if extended command ack expected from PLM
     statusRequest = False   # Set to True when we do a status request
     lastUnit = ""		# last seen X10 unit code
+    _coalesceCommands = ('SD11', 'SD12', 'SD13', 'SD14')  # on, fast on, off, fast off
+    MAX_NAKS = 5            # modem NAKs before a command is given up on
 
     
     plmAddress = ""
@@ -357,10 +358,15 @@ class InsteonPLM(HAInterface):
 
         self._allLinkDatabase = dict()
         self._intersend_delay = 0.85 #850ms between network sends
+        # shrink the gap while devices answer promptly, back off on NAKs and timeouts
+        self._pacing = PacingController(initial=0.85, minimum=0.4, maximum=6.0)
 
     def _sendInterfaceCommand(self, modemCommand, commandDataString = None, extraCommandDetails = None):
-        self.currentCommand = [modemCommand, commandDataString, extraCommandDetails]
         command = binascii.unhexlify(modemCommand)
+        if extraCommandDetails and extraCommandDetails.get('commandId1') in self._coalesceCommands:
+            # a newer on/off/level for the same device replaces one still queued
+            extraCommandDetails = dict(extraCommandDetails,
+                                       coalesceKey=extraCommandDetails['destinationDevice'].upper())
         return super(InsteonPLM, self)._sendInterfaceCommand(command, commandDataString, extraCommandDetails, modemCommandPrefix='\x02')
 
     def _readInterface(self, lastPacketHash):
@@ -399,7 +405,8 @@ class InsteonPLM(HAInterface):
                     if responseSize != -1:
                         remainingBytes = self._interface.read(responseSize)
                         currentPacketHash = hashPacket(firstByte + secondByte + remainingBytes)
-                        self._logger.debug("Receive< " + hex_dump(firstByte + secondByte + remainingBytes, len(firstByte + secondByte + remainingBytes)) + currentPacketHash + "\n")
+                        if self._logger.isEnabledFor(logging.DEBUG):
+                            self._logger.debug("Receive< " + hex_dump(firstByte + secondByte + remainingBytes, len(firstByte + secondByte + remainingBytes)) + currentPacketHash + "\n")
     
                         if lastPacketHash and lastPacketHash == currentPacketHash:
                             #duplicate packet.  Ignore
@@ -408,41 +415,38 @@ class InsteonPLM(HAInterface):
                             if callBack:
                                 callBack(firstByte + secondByte + remainingBytes)
                             else:
-                                self._logger.debug("No callBack defined for for modem command %s" % modemCommand)
+                                self._logger.debug("No callBack defined for for modem command {0}", modemCommand)
     
                         self._lastPacketHash = currentPacketHash
-                        self.spinTime = 0.2     #reset spin time, there were no naks, Don't set this lower
                     else:
-                        self._logger.debug("No responseSize defined for modem command %s" % modemCommand)
+                        self._logger.debug("No responseSize defined for modem command {0}", modemCommand)
                         
                 elif firstByte[0] == '\x15':
-                    self.spinTime += 0.2
-                    self._logger.debug("first byte %s" % binascii.hexlify(firstByte[0]))
-                    self._logger.debug("Received a Modem NAK! Resending command, loop time %f" % (self.spinTime))
-                    if self.spinTime < 12.0:
-                        self._sendInterfaceCommand(self.currentCommand[0], self.currentCommand[1], self.currentCommand[2])
-                    else:
-                        self._logger.debug("Too many NAK's! Device not responding...")
+                    self._logger.debug("Received a Modem NAK! Resending command {0}, send delay {1}",
+                                       self._lastSentCommandHash, self._intersend_delay)
+                    self._resendNakedCommand(self._lastSentCommandHash)
                 else:
-                    self._logger.debug("Unknown first byte %s" % binascii.hexlify(firstByte[0]))
+                    self._logger.debug("Unknown first byte {0}", binascii.hexlify(firstByte[0]))
                 
                 self.extendedCommand = False	# go back to standard commands as default
                 
             else:
-                self._checkCommandQueue()
                 #print "Sleeping"
                 #X10 is slow.  Need to adjust based on protocol sent.  Or pay attention to NAK and auto adjust
                 #time.sleep(0.1)
-                time.sleep(self.spinTime)
+                self._idleWait(self.spinTime)
         except TypeError, ex:
             pass
 
-    def _sendStandardP2PInsteonCommand(self, destinationDevice, commandId1, commandId2):
-        self._logger.debug("Command: %s %s %s" % (destinationDevice, commandId1, commandId2))
-        return self._sendInterfaceCommand('62', _stringIdToByteIds(destinationDevice) + _buildFlags() + binascii.unhexlify(commandId1) + binascii.unhexlify(commandId2), extraCommandDetails = { 'destinationDevice': destinationDevice, 'commandId1': 'SD' + commandId1, 'commandId2': commandId2})
+    def _sendStandardP2PInsteonCommand(self, destinationDevice, commandId1, commandId2, extraCommandDetails=None):
+        self._logger.debug("Command: {0} {1} {2}", destinationDevice, commandId1, commandId2)
+        details = { 'destinationDevice': destinationDevice, 'commandId1': 'SD' + commandId1, 'commandId2': commandId2}
+        if extraCommandDetails:
+            details.update(extraCommandDetails)
+        return self._sendInterfaceCommand('62', _stringIdToByteIds(destinationDevice) + _buildFlags() + binascii.unhexlify(commandId1) + binascii.unhexlify(commandId2), extraCommandDetails = details)
 
     def _sendStandardAllLinkInsteonCommand(self, destinationGroup, commandId1, commandId2):
-        self._logger.debug("Command: %s %s %s" % (destinationGroup, commandId1, commandId2))
+        self._logger.debug("Command: {0} {1} {2}", destinationGroup, commandId1, commandId2)
         return self._sendInterfaceCommand('61', binascii.unhexlify(destinationGroup) + binascii.unhexlify(commandId1) + binascii.unhexlify(commandId2),
                 extraCommandDetails = { 'destinationDevice': destinationGroup, 'commandId1': 'SD' + commandId1, 'commandId2': commandId2})
 
@@ -458,9 +462,9 @@ class InsteonPLM(HAInterface):
 
     def _sendStandardP2PX10Command(self,destinationDevice,commandId1, commandId2 = None):
         # X10 sends 1 complete message in two commands
-        self._logger.debug("Command: %s %s %s" % (destinationDevice, commandId1, commandId2))
-        self._logger.debug("C: %s" % self._getX10UnitCommand(destinationDevice))
-        self._logger.debug("c1: %s" % self._getX10CommandCommand(destinationDevice, commandId1))
+        self._logger.debug("Command: {0} {1} {2}", destinationDevice, commandId1, commandId2)
+        self._logger.debug("C: {0}", self._getX10UnitCommand(destinationDevice))
+        self._logger.debug("c1: {0}", self._getX10CommandCommand(destinationDevice, commandId1))
             
         self._sendInterfaceCommand('63', binascii.unhexlify(self._getX10UnitCommand(destinationDevice)))
 
@@ -500,18 +504,47 @@ class InsteonPLM(HAInterface):
             if len(responseBytes) == 9:  # check for proper length
                 if ord(responseBytes[6]) == 0x19 and ord(responseBytes[8]) == 0x06:  # get a light level status
                     self.statusRequest = True
+        if ord(responseBytes[1]) in (0x61, 0x62) and responseBytes[-1] == '\x15':
+            # the modem echoed our command with a NAK, it was not sent
+            self._resendNakedCommand(self._lastSentCommandHash)
+
+    def _resendNakedCommand(self, commandHash):
+        self._commandNaked(commandHash)
+        finished = []
+        self._commandLock.acquire()
+        try:
+            commandDetails = self._pendingCommandDetails.get(commandHash)
+            if not commandDetails:
+                self._logger.debug("NAK for {0} which is no longer pending", commandHash)
+                return
+            commandDetails['naks'] = commandDetails.get('naks', 0) + 1
+            if commandDetails['naks'] > self.MAX_NAKS:
+                self._logger.debug("Too many NAK's for {0}! Device not responding...", commandHash)
+                finished.append(self._finishCommand(commandDetails, OutboundCommand.FAILED, False))
+            else:
+                self._requeueCommand(commandHash, locked=True, finished=finished)
+        finally:
+            self._commandLock.release()
+        self._runCallbacks(finished)
+
+    def _commandAcked(self, commandHash):
+        commandDetails = self._pendingCommandDetails.get(commandHash)
+        if commandDetails:
+            commandDetails.pop('naks', None)
+        super(InsteonPLM, self)._commandAcked(commandHash)
 
     def _process_StandardX10MessagePLMEcho(self, responseBytes):
         # Just ack / error echo from sending an X10 command
         pass
 
     def _validResponseMessagesForCommandId(self, commandId):
-        self._logger.debug('ValidResponseCheck: ' + hex_dump(commandId))
+        if self._logger.isEnabledFor(logging.DEBUG):
+            self._logger.debug('ValidResponseCheck: ' + hex_dump(commandId))
         if self._insteonCommands.has_key(commandId):
             commandInfo = self._insteonCommands[commandId]
-            self._logger.debug('ValidResponseCheck2: ' + str(commandInfo))
+            self._logger.debug('ValidResponseCheck2: {0}', commandInfo)
             if commandInfo.has_key('validResponseCommands'):
-                self._logger.debug('ValidResponseCheck3: ' + str(commandInfo['validResponseCommands']))
+                self._logger.debug('ValidResponseCheck3: {0}', commandInfo['validResponseCommands'])
                 return commandInfo['validResponseCommands']
 
         return False
@@ -520,7 +553,7 @@ class InsteonPLM(HAInterface):
 
         if len(responseBytes) != 11:
             self._logger.error("responseBytes< " + hex_dump(responseBytes, len(responseBytes)) + "\n")
-            self._logger.error("Command incorrect length. Expected 11, Received %s\n" % len(responseBytes))
+            self._logger.error("Command incorrect length. Expected 11, Received {0}\n", len(responseBytes))
             return
 
         (modemCommand, insteonCommand, fromIdHigh, fromIdMid, fromIdLow, toIdHigh, toIdMid, toIdLow, messageFlags, command1, command2) = struct.unpack('BBBBBBBBBBB', responseBytes)
@@ -565,15 +598,21 @@ class InsteonPLM(HAInterface):
                 if commandDetails.has_key('commandId1'):
                     originatingCommandId1 = commandDetails['commandId1']
 
+                responseCode = insteonCommandCode
+                if originatingCommandId1 == 'SD19' and isDirect and isAck:
+                    # the direct ACK to a status request carries the level whatever cmd1 holds,
+                    # statusRequest alone can't tell when several requests are in flight
+                    responseCode = 'SD19'
+
                 validResponseMessages = self._validResponseMessagesForCommandId(originatingCommandId1)
                 if validResponseMessages and len(validResponseMessages):
                     #Check to see if this received command is one that this pending command is waiting for
-                    self._logger.debug('Valid Insteon Command COde: ' + str(insteonCommandCode))
-                    if validResponseMessages.count(insteonCommandCode) == 0:
+                    self._logger.debug('Valid Insteon Command COde: {0}', responseCode)
+                    if validResponseMessages.count(responseCode) == 0:
                         #this pending command isn't waiting for a response with this command code...  Move along
                         continue
                 else:
-                    self._logger.warning("Unable to find a list of valid response messages for command %s" % originatingCommandId1)
+                    self._logger.warning("Unable to find a list of valid response messages for command {0}", originatingCommandId1)
                     continue
 
                 #since there could be multiple insteon messages flying out over the wire, check to see if this one is 
@@ -588,10 +627,10 @@ class InsteonPLM(HAInterface):
                         returnData = {} #{'isBroadcast': isBroadcast, 'isDirect': isDirect, 'isAck': isAck}
 
                         #try and look up a handler for this command code
-                        if self._insteonCommands.has_key(insteonCommandCode):
-                            if self._insteonCommands[insteonCommandCode].has_key('callBack'):
+                        if self._insteonCommands.has_key(responseCode):
+                            if self._insteonCommands[responseCode].has_key('callBack'):
                                 # Run the callback
-                                (requestCycleDone, extraReturnData) = self._insteonCommands[insteonCommandCode]['callBack'](responseBytes)
+                                (requestCycleDone, extraReturnData) = self._insteonCommands[responseCode]['callBack'](responseBytes)
                                 self.statusRequest = False
                                 
                                 if extraReturnData:
@@ -600,10 +639,10 @@ class InsteonPLM(HAInterface):
                                 if requestCycleDone:
                                     waitEvent = commandDetails['waitEvent']
                             else:
-                                self._logger.warning("No callBack for insteon command code %s" % insteonCommandCode)
+                                self._logger.warning("No callBack for insteon command code {0}", responseCode)
                                 waitEvent = commandDetails['waitEvent']
                         else:
-                            self._logger.warning("No insteonCommand lookup defined for insteon command code %s" % insteonCommandCode)
+                            self._logger.warning("No insteonCommand lookup defined for insteon command code {0}", responseCode)
 
                         if len(returnData):
                             self._commandReturnData[commandHash] = returnData
@@ -620,11 +659,12 @@ class InsteonPLM(HAInterface):
 
         if waitEvent and foundCommandHash:
             waitEvent.set()
+            self._commandAcked(foundCommandHash)
             try:
                 del self._pendingCommandDetails[foundCommandHash]
-                self._logger.debug("Command %s completed\n" % foundCommandHash)
+                self._logger.debug("Command {0} completed\n", foundCommandHash)
             except:
-                self._logger.error("Command %s couldnt be deleted!\n" % foundCommandHash)
+                self._logger.error("Command {0} couldnt be deleted!\n", foundCommandHash)
 
     def _process_InboundExtendedInsteonMessage(self, responseBytes):
         (modemCommand, insteonCommand, fromIdHigh, fromIdMid, fromIdLow, toIdHigh, toIdMid, toIdLow, messageFlags, \
@@ -654,7 +694,7 @@ class InsteonPLM(HAInterface):
                         #this pending command isn't waiting for a response with this command code...  Move along
                         continue
                 else:
-                    self._logger.warning("Unable to find a list of valid response messages for command %s" % originatingCommandId1)
+                    self._logger.warning("Unable to find a list of valid response messages for command {0}", originatingCommandId1)
                     continue
 
                 #since there could be multiple insteon messages flying out over the wire, check to see if this one is 
@@ -680,10 +720,10 @@ class InsteonPLM(HAInterface):
                                 if requestCycleDone:
                                     waitEvent = commandDetails['waitEvent']
                             else:
-                                self._logger.warning("No callBack for insteon command code %s" % insteonCommandCode)
+                                self._logger.warning("No callBack for insteon command code {0}", insteonCommandCode)
                                 waitEvent = commandDetails['waitEvent']
                         else:
-                            self._logger.warning("No insteonCommand lookup defined for insteon command code %s" % insteonCommandCode)
+                            self._logger.warning("No insteonCommand lookup defined for insteon command code {0}", insteonCommandCode)
 
                         if len(returnData):
                             self._commandReturnData[commandHash] = returnData
@@ -697,8 +737,9 @@ class InsteonPLM(HAInterface):
 
         if waitEvent and foundCommandHash:
             waitEvent.set()
+            self._commandAcked(foundCommandHash)
             del self._pendingCommandDetails[foundCommandHash]
-            self._logger.debug("Command %s completed\n" % foundCommandHash)
+            self._logger.debug("Command {0} completed\n", foundCommandHash)
     
  
     
@@ -707,23 +748,24 @@ class InsteonPLM(HAInterface):
         unitCode = None
         commandCode = None
         (byteB, byteC) = struct.unpack('xxBB', responseBytes)        
-        self._logger.debug("X10> " + hex_dump(responseBytes, len(responseBytes)))
+        if self._logger.isEnabledFor(logging.DEBUG):
+            self._logger.debug("X10> " + hex_dump(responseBytes, len(responseBytes)))
         houseCode =     (byteB & 0b11110000) >> 4 
         houseCodeDec = self._x10HouseCodes.get_key(houseCode)
-	self._logger.debug("X10> HouseCode " + houseCodeDec )
+	self._logger.debug("X10> HouseCode {0}", houseCodeDec)
 	unitCmd = (byteC & 0b10000000) >> 7
 	if unitCmd == 0 :
 		unitCode = (byteB & 0b00001111)
 		unitCodeDec = self._x10UnitCodes.get_key(unitCode)
-		self._logger.debug("X10> UnitCode " + unitCodeDec )
+		self._logger.debug("X10> UnitCode {0}", unitCodeDec)
 		self.lastUnit = unitCodeDec
 	else:
                 commandCode = (byteB & 0b00001111)
 		commandCodeDec = self._x10Commands.get_key(commandCode)
-		self._logger.debug("X10> Command: house: " + houseCodeDec + " unit: " + self.lastUnit + " command: " + commandCodeDec  )
+		self._logger.debug("X10> Command: house: {0} unit: {1} command: {2}", houseCodeDec, self.lastUnit, commandCodeDec)
 		destDeviceId = houseCodeDec.upper() + self.lastUnit
  	        if self._devices:
-			for d in self._devices:
+			for d in self._devicesForAddress(destDeviceId):
 			    if d.address.upper() == destDeviceId:
 				# only run the command if the state is different than current
 				if (commandCode == 0x03 and d.state != State.OFF):     # Never seen one not go to zero but...
@@ -773,21 +815,21 @@ class InsteonPLM(HAInterface):
         isGrpCleanupDirect = (messageFlags & 0x40) == 0x40
         # If we get an ack from a group command fire off a status request or we'll never know the on level (not off)
         if isGrpCleanupAck | isGrpBroadcast and command1 != 0x13: #| isGrpCleanupDirect: 
-            self._logger.debug("Running status request:{0}:{1}:{2}:..........".format(isGrpCleanupAck,
+            self._logger.debug("Running status request:{0}:{1}:{2}:..........", isGrpCleanupAck,
                                                                                      isGrpBroadcast,
-                                                                                     isGrpCleanupDirect))
+                                                                                     isGrpCleanupDirect)
             time.sleep(0.1)
             self.lightStatusRequest(destDeviceId, async=True)
         else:   # direct command
             
-            self._logger.debug("Setting status for:{0}:{1}:{2}..........".format(
-                                                                                 str(destDeviceId),
-                                                                                 str(command1),
-                                                                                 str(command2),
-                                                                                 ))
+            self._logger.debug("Setting status for:{0}:{1}:{2}..........",
+                                                                                 destDeviceId,
+                                                                                 command1,
+                                                                                 command2,
+                                                                                 )
             # For now lets just handle on and off until the new state code is ready.
             if self._devices:
-                for d in self._devices:
+                for d in self._devicesForAddress(destDeviceId):
                     if d.address.upper() == destDeviceId:
                         # only run the command if the state is different than current
                         if (command1 == 0x13 or (command2 < 0x02 and not isGrpCleanupDirect )) and d.state != State.OFF:     # Never seen one not go to zero but...
@@ -824,32 +866,6 @@ class InsteonPLM(HAInterface):
         #return (True, {'lightStatus': round(normalizedLightLevel, 2) })
 
 
-   	# _checkCommandQueue is run every iteration of _readInterface. It counts the commands 
-    # to find repeating ones.  If a command is repeated too many times it means it never
-    # recieved a response so we should delete the original command and delete it from the 
-    # queue.  This is a hack and will be dealt with properly in the new driver.
-    def _checkCommandQueue(self):
-        if self._pendingCommandDetails != {}:
-            for (commandHash, commandDetails) in self._pendingCommandDetails.items():
-                self.cmdQueueList.append(commandHash)
-                
-                # If we have an orphaned queue it will show up here, get the details, remove the old command
-                # from the queue and re-issue.
-                if self.cmdQueueList.count(commandHash) > 50:
-                    if commandDetails['modemCommand'] in ['\x60','\x61','\x62']:
-                        #print "deleting commandhash ", commandHash
-                        #print commandDetails
-                        cmd1 = commandDetails['commandId1']  # example SD11
-                        cmd2 = commandDetails['commandId2']
-                        deviceId = commandDetails['destinationDevice']
-                        waitEvent = commandDetails['waitEvent']
-                        waitEvent.set()
-                        del self._pendingCommandDetails[commandHash]
-                        while commandHash in self.cmdQueueList:
-                            self.cmdQueueList.remove(commandHash)
-                        # Retry the command..Do we really want this?
-                        self._sendStandardP2PInsteonCommand(deviceId, cmd1[2:], cmd2)
-
     def __getattr__(self, name):
         name = name.lower()
         # Support levels of lighting
@@ -957,10 +973,10 @@ class InsteonPLM(HAInterface):
     # if rate the bits 0-3 is 2 x ramprate +1, bits 4-7 on level + 0x0F
     def level(self, deviceId, level, rate=None, timeout=None):
         if level > 100 or level <0:
-            self._logger.error("{name} cannot set light level {level} beyond 1-15".format(
+            self._logger.error("{name} cannot set light level {level} beyond 1-15",
                                                                                     name=self.name,
                                                                                     level=level,
-                                                                                     ))
+                                                                                     )
             return
         else:
             if rate == None:
@@ -971,10 +987,10 @@ class InsteonPLM(HAInterface):
 
             else:
                 if rate > 15 or rate <1:
-                    self._logger.error("{name} cannot set light ramp rate {rate} beyond 1-15".format(
+                    self._logger.error("{name} cannot set light ramp rate {rate} beyond 1-15",
                                                                                     name=self.name,
-                                                                                    level=level,
-                                                                                     ))
+                                                                                    rate=rate,
+                                                                                     )
                     return
                 else:
                     lev = int(simpleMap(level, 1, 100, 1, 15))                                                                                     
@@ -1017,11 +1033,17 @@ class InsteonPLM(HAInterface):
 	# X10 device,  command not supported,  just return
 	return
 
-    def update_status(self):
-        for d in self._devices:
-            if len(d.address) == 8:  # real address not scene
-                print "Getting status for ", d.address
-                self.lightStatusRequest(d.address)
+    def update_status(self, addresses=None, window=4, timeout=2, retries=1, wait=True):
+        if addresses is None:
+            addresses = [d.address for d in self._devices if len(d.address) == 8]  # real address not scene
+        return super(InsteonPLM, self).update_status(addresses, window=window, timeout=timeout, retries=retries,
+                                                     wait=wait)
+
+    def _queueStatusRequest(self, address):
+        if len(address) != 2: #insteon device address
+            # a status request already queued answers for this one too
+            return self._sendStandardP2PInsteonCommand(address, '19', '00', {'joinDuplicate': True})
+        return None
 
     def update_scene(self, address, devices):
         # we are passed a scene number to update and a bunch of objects to update
@@ -1060,7 +1082,7 @@ class InsteonPLM(HAInterface):
         return str(s) if s<=1 else self.bitstring(s>>1) + str(s&1)
 
     def _sendExtendedP2PInsteonCommand(self, destinationDevice, commandId1, commandId2, d1_d14):
-        self._logger.debug("Extended Command: %s %s %s %s" % (destinationDevice, commandId1, commandId2, d1_d14))
+        self._logger.debug("Extended Command: {0} {1} {2} {3}", destinationDevice, commandId1, commandId2, d1_d14)
         self.extendedCommand = True
         return self._sendInterfaceCommand('62', _stringIdToByteIds(destinationDevice) + _buildFlags(self.extendedCommand) + binascii.unhexlify(commandId1) + binascii.unhexlify(commandId2), extraCommandDetails = { 'destinationDevice': destinationDevice, 'commandId1': 'SD' + commandId1, 'commandId2': commandId2})
     
@@ -1141,6 +1163,7 @@ class InsteonPLM(HAInterface):
 
         if waitEvent and foundCommandHash:
             waitEvent.set()
+            self._commandAcked(foundCommandHash)
             del self._pendingCommandDetails[foundCommandHash]
             #self._sendStandardAllLinkInsteonCommand(destDeviceId, originatingCommandId1[2:], originatingCommandId2)
             self._sendStandardP2PInsteonCommand(destDeviceId, originatingCommandId1[2:], originatingCommandId2)
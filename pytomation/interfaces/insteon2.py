@@ -200,6 +200,6 @@ class InsteonPLM2(HAInterface):
         return super(InsteonPLM2, self)._sendInterfaceCommand(modemCommand, commandDataString, extraCommandDetails, modemCommandPrefix='\x02')
 
     def _getDevice(self, address):
-        for d in self._devices:
+        for d in self._devicesForAddress(address):
             if (d.address == address): return d
         return None
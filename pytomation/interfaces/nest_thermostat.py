@@ -97,11 +97,11 @@ class NestThermostat(HAInterface):
         try:
             self.interface.devices[address].change_temperature(level)
         except Exception, ex:
-            self._logger.error('Error setting temperature {0} for device= {1},{2}: {3} '.format(
+            self._logger.error('Error setting temperature {0} for device= {1},{2}: {3} ',
                                                                                         level,
                                                                                         address[0],
                                                                                         address[1],
-                                                                                        str(ex)))
+                                                                                        ex)
         return 
     
     def version(self):
@@ -89,6 +89,7 @@ class RemotePi(HAInterface):
                                        })
         else:
             self._devices.append(device)
+        self.reindex()
 
         
         
\ No newline at end of file
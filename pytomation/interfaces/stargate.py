@@ -81,7 +81,7 @@ class Stargate(HAInterface):
             #print "Sleeping"
             #X10 is slow.  Need to adjust based on protocol sent.  Or pay attention to NAK and auto adjust
             #time.sleep(0.1)
-            time.sleep(0.5)
+            self._idleWait(0.5)
 
     def _processDigitalInput(self, response, lastPacketHash):
         offset = 0
@@ -114,9 +114,9 @@ class Stargate(HAInterface):
                     state = Command.ON
                 else:
                     state = Command.OFF
-		self._logger.info("Digital Input #{input} to state {state}".format(
+		self._logger.info("Digital Input #{input} to state {state}",
 				input=str(offset + i + 1),
-				state=state))
+				state=state)
                 self._onCommand(command=state,
                                 address='D' + str(offset + i + 1))
 
@@ -125,12 +125,12 @@ class Stargate(HAInterface):
         else:
             self._last_input_map_low = io_map
 	
-        self._logger.debug("Process digital input {iomap} {offset} {last_inputl} {last_inputh}".format(
+        self._logger.debug("Process digital input {iomap} {offset} {last_inputl} {last_inputh}",
                                              iomap=Conversions.int_to_hex(io_map),
                                              offset=offset,
                                              last_inputl=Conversions.int_to_hex(self._last_input_map_low),
                                              last_inputh=Conversions.int_to_hex(self._last_input_map_high),
-                                                                             ))
+                                                                             )
 
 
     def _decode_echo_mode_activity(self, activity):
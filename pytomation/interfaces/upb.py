@@ -216,7 +216,7 @@ class UPB(HAInterface):
         else:
 #            self._logger.debug('Sleeping')
             #time.sleep(0.1)
-            time.sleep(0.5)
+            self._idleWait(0.5)
 
     def _processUBP(self, response, lastPacketHash):
         foundCommandHash = None
@@ -377,7 +377,7 @@ class UPB(HAInterface):
         # Support levels of lighting
         if name[0] == 'l' and len(name) == 3:
             level = name[1:3]
-            self._logger.debug("Level->{level}".format(level=level))
+            self._logger.debug("Level->{level}",level=level)
             level = int(level)
             return lambda x, y=None: self._device_goto(x, level, timeout=y ) 
         
@@ -386,6 +386,6 @@ class UPB(HAInterface):
         self._logger.info("UPB Pytomation driver version " + self.VERSION + "\n")
 
     def _set_device_state(self, address, state):
-        for d in self._devices:
+        for d in self._devicesForAddress(address):
             if d.address == address:
                 d.state = state
@@ -101,7 +101,7 @@ class W800rf32(HAInterface):
             b2 = int(x[::-1],2)   # reverse the string and assign to byte 2
 #            if debug['W800'] > 0:
 #                pylog(self,"[W800RF32] {0:02X} {1:02X} {2:02X} {3:02X}\n".format(b1,b2,b3,b4))
-            self._logger.debug("{0:02X} {1:02X} {2:02X} {3:02X}".format(b1,b2,b3,b4))
+            self._logger.debug("{0:02X} {1:02X} {2:02X} {3:02X}",b1,b2,b3,b4)
 
             # Get the house code
             self.houseCode = self.hcodeDict[b3 & 0x0f]
@@ -138,7 +138,7 @@ class W800rf32(HAInterface):
         elif len(responses) < 3 and len(responses) > 0:
             self._logger.error('We didnt expect a shorter packet. Probably should keep track of partial reads: ' + str(responses))
         else:
-            time.sleep(0.5)
+            self._idleWait(0.5)
                 
                 
 
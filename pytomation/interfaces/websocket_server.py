@@ -8,29 +8,321 @@ David Heaps - king.dopey.10111@gmail.com
 import mimetypes
 import os
 import base64
+import itertools
+import json
+import threading
+import time
+from collections import OrderedDict
 
 from geventwebsocket import WebSocketServer, WebSocketApplication, Resource
 
 from .ha_interface import HAInterface
 from pytomation.common.pytomation_api import PytomationAPI
 from pytomation.common import config
+from pytomation.common import pytomation_system
 from pytomation.devices import StateDevice
 
 
+class SubscriptionIndex(object):
+    """
+    Which websocket clients want the state changes of which devices.
+    Clients subscribe to device ids, type names or rooms (devices whose
+    linked devices are the members); a client without any subscription
+    gets every change.
+    """
+    TOPICS = ('ids', 'type_name', 'rooms')
+
+    def __init__(self):
+        self._index = dict((topic, {}) for topic in self.TOPICS)  # topic: {value: set(ws)}
+        self._clients = {}  # ws: {topic: set(value)}
+        self._members = {}  # room id: (detail version, set(device id))
+        self._lock = threading.Lock()
+
+    def subscribe(self, ws, **topics):
+        with self._lock:
+            subscriptions = self._clients.setdefault(ws, dict((topic, set()) for topic in self.TOPICS))
+            for topic in self.TOPICS:
+                for value in topics.get(topic) or ():
+                    subscriptions[topic].add(value)
+                    self._index[topic].setdefault(value, set()).add(ws)
+        return self.counts(ws)
+
+    def unsubscribe(self, ws, **topics):
+        """ Removes the topics given, or all of them """
+        with self._lock:
+            subscriptions = self._clients.get(ws)
+            if subscriptions is None:
+                return self.counts(ws)
+            for topic in self.TOPICS:
+                values = topics.get(topic) if topics else list(subscriptions[topic])
+                for value in values or ():
+                    subscriptions[topic].discard(value)
+                    subscribers = self._index[topic].get(value)
+                    if subscribers is not None:
+                        subscribers.discard(ws)
+                        if not subscribers:
+                            del self._index[topic][value]
+            if not any(subscriptions.values()):
+                del self._clients[ws]
+        return self.counts(ws)
+
+    def counts(self, ws):
+        subscriptions = self._clients.get(ws, {})
+        return dict((topic, len(subscriptions.get(topic, ()))) for topic in self.TOPICS)
+
+    def _room_members(self, room_id):
+        room = pytomation_system.get_instances().get(room_id)
+        if room is None:
+            return ()
+        version = getattr(room, '_detail_version', None)
+        cached = self._members.get(room_id)
+        if cached is None or cached[0] != version:
+            cached = self._members[room_id] = (version, set(device.type_id for device in getattr(room, '_devices', ())))
+        return cached[1]
+
+    def subscribers(self, device):
+        """ The subscribed clients wanting changes of device """
+        with self._lock:
+            subscribers = set(self._index['ids'].get(device.type_id, ()))
+            subscribers.update(self._index['type_name'].get(device.type_name, ()))
+            for (room_id, clients) in self._index['rooms'].iteritems():
+                if room_id == device.type_id or device.type_id in self._room_members(room_id):
+                    subscribers.update(clients)
+            return subscribers
+
+    def wants(self, device):
+        """ Filter for the clients a change of device is sent to """
+        subscribers = self.subscribers(device)
+        subscribed = self._clients
+        return lambda client: client.ws not in subscribed or client.ws in subscribers
+
+    def metrics(self):
+        with self._lock:
+            return [self.counts(ws) for ws in self._clients.keys()]
+
+
 class PytoWebSocketApp(WebSocketApplication):
     _api = PytomationAPI()
+    subscriptions = SubscriptionIndex()
+    compact = {}  # socket using the compact encoding: how many device numbers its table held
+    broadcaster = None  # StateBroadcaster of the server, replies queue behind its state changes
 
     def on_open(self):
         print "WebSocket Client connected"
 
     def on_message(self, message):
         if message:
-            self.ws.send(self._api.get_response(data=message, type=self._api.WEBSOCKET))
+            response = self.control_message(message)
+            if response is None:
+                response = self._api.get_response(data=message, type=self._api.WEBSOCKET)
+            if response:
+                self.send(response)
+
+    def send(self, message):
+        if self.broadcaster is None:
+            # nothing else sends on the socket
+            self.ws.send(message)
+        else:
+            self.broadcaster.send(self, message)
+
+    def control_message(self, message):
+        """
+        Answers a message about this connection, None for any other and ''
+        when the answer was queued already.
+        """
+        try:
+            data = json.loads(message)
+            path = data['path']
+        except Exception, ex:
+            return None
+        if path in ('subscribe', 'unsubscribe'):
+            return self.subscription_message(path, data.get('command') or {})
+        if path == 'encoding':
+            return self.encoding_message(data.get('command'))
+        return None
+
+    def subscription_message(self, path, topics):
+        """
+        Handles {"path": "subscribe" or "unsubscribe", "command": {"ids": [...],
+        "type_name": [...], "rooms": [...]}}, answering the subscription counts
+        or {"status": 400, "error": ...} for anything else.
+        """
+        if not isinstance(topics, dict):
+            return json.dumps({'status': 400, 'error': 'Subscriptions must be an object of topics'})
+        for topic in SubscriptionIndex.TOPICS:
+            values = topics.get(topic, [])
+            if not isinstance(values, list) or not all(isinstance(value, basestring) for value in values):
+                return json.dumps({'status': 400, 'error': 'Topic %s must be a list of strings' % topic})
+        topics = dict((str(topic), topics[topic]) for topic in SubscriptionIndex.TOPICS if topic in topics)
+        if path == 'subscribe':
+            counts = self.subscriptions.subscribe(self.ws, **topics)
+        else:
+            counts = self.subscriptions.unsubscribe(self.ws, **topics)
+        return json.dumps({'subscriptions': counts})
+
+    def encoding_message(self, encoding):
+        """
+        Handles {"path": "encoding", "command": "compact" or "json"}.  Compact
+        state changes are [number, state, previous_state], answered here with
+        the table of device numbers.
+        """
+        if encoding == self._api.COMPACT:
+            (count, table) = self._api.get_device_table()
+            # queued before any compact frame for this client can be
+            self.send(table)
+            self.compact[self.ws] = count
+            return ''
+        self.compact.pop(self.ws, None)
+        return json.dumps({'encoding': self._api.JSON})
 
     def on_close(self, reason):
+        self.subscriptions.unsubscribe(self.ws)
+        self.compact.pop(self.ws, None)
         print("WebSocket Client disconnected: ")
 
 
+class ClientSender(object):
+    """
+    Frames waiting for one websocket client and the thread sending them.
+    The queue is bounded: a newer frame for the same key (device) replaces
+    the queued one and when full the oldest frame is dropped.
+    """
+    def __init__(self, client, size):
+        self.client = client
+        self.size = size
+        self.closed = False
+        self._frames = OrderedDict()
+        self._keys = itertools.count()
+        self._ready = threading.Condition()
+        self._sending = False
+        self._sent = 0
+        self._dropped = 0
+        self._coalesced = 0
+        self._max_depth = 0
+        self._thread = threading.Thread(target=self._run, name='ClientSender')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def put(self, message, key=None):
+        with self._ready:
+            if key is None:
+                key = ('frame', next(self._keys))
+            if key in self._frames:
+                # keeps its place in line, only the latest state is worth sending
+                self._coalesced += 1
+            elif len(self._frames) >= self.size:
+                self._frames.popitem(last=False)
+                self._dropped += 1
+            self._frames[key] = message
+            self._max_depth = max(self._max_depth, len(self._frames))
+            self._ready.notify_all()
+
+    def close(self):
+        with self._ready:
+            self.closed = True
+            self._frames.clear()
+            self._ready.notify_all()
+
+    def flush(self, timeout=None):
+        """ Waits until the frames queued so far are sent, True unless timed out """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._ready:
+            while (self._frames or self._sending) and not self.closed:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    break
+                self._ready.wait(remaining)
+            return not self._frames and not self._sending
+
+    def _run(self):
+        while True:
+            with self._ready:
+                while not self._frames and not self.closed:
+                    self._ready.wait()
+                if self.closed:
+                    return
+                key, message = self._frames.popitem(last=False)
+                self._sending = True
+            try:
+                self.client.ws.send(message)
+                sent = 1
+            except Exception, ex:
+                sent = 0
+                self.close()
+            with self._ready:
+                self._sending = False
+                self._sent += sent
+                self._ready.notify_all()
+
+    def metrics(self):
+        with self._ready:
+            return {'depth': len(self._frames),
+                    'max_depth': self._max_depth,
+                    'sent': self._sent,
+                    'dropped': self._dropped,
+                    'coalesced': self._coalesced,
+                    }
+
+
+class StateBroadcaster(object):
+    """
+    Fans messages out to websocket clients without blocking the caller,
+    through one ClientSender per client.
+    """
+    def __init__(self, queue_size=100):
+        self.queue_size = queue_size
+        self._senders = {}  # socket: ClientSender, shared by the state changes and replies to it
+        self._lock = threading.Lock()
+
+    def _sender(self, client):
+        sender = self._senders.get(client.ws)
+        if sender is None or sender.closed:
+            sender = self._senders[client.ws] = ClientSender(client, self.queue_size)
+        return sender
+
+    def broadcast(self, clients, message, key=None, wants=None):
+        """ Queues message for the clients, or those wants(client) is true for """
+        clients = list(clients)
+        with self._lock:
+            for client in clients:
+                if wants and not wants(client):
+                    continue
+                self._sender(client).put(message, key)
+            # forget clients that have disconnected
+            sockets = set(client.ws for client in clients)
+            for socket in self._senders.keys():
+                if socket not in sockets:
+                    self._senders.pop(socket).close()
+
+    def send(self, client, message):
+        """ Queues message for one client, behind what is already queued for it """
+        with self._lock:
+            self._sender(client).put(message)
+
+    def flush(self, timeout=None):
+        """ Waits until every client was sent its queued frames, True unless timed out """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._lock:
+            senders = self._senders.values()
+        flushed = True
+        for sender in senders:
+            remaining = None if deadline is None else max(deadline - time.time(), 0)
+            flushed = sender.flush(remaining) and flushed
+        return flushed
+
+    def metrics(self):
+        with self._lock:
+            senders = self._senders.values()
+        clients = [sender.metrics() for sender in senders]
+        return {'clients': len(clients),
+                'depth': sum(client['depth'] for client in clients),
+                'max_depth': max([client['max_depth'] for client in clients] or [0]),
+                'sent': sum(client['sent'] for client in clients),
+                'dropped': sum(client['dropped'] for client in clients),
+                'coalesced': sum(client['coalesced'] for client in clients),
+                }
+
+
 class PytoWebSocketServer(HAInterface):
     _api = PytomationAPI()
 
@@ -48,6 +340,7 @@ class PytoWebSocketServer(HAInterface):
             self._ssl_path = config.ssl_path
         except:
             pass
+        self._broadcaster = PytoWebSocketApp.broadcaster = StateBroadcaster(kwargs.get('queue_size', 100))
         super(PytoWebSocketServer, self)._init(*args, **kwargs)
 
     def run(self):
@@ -72,8 +365,18 @@ class PytoWebSocketServer(HAInterface):
             data = environ['wsgi.input'].read()
         else:
             data = None
-        start_response("200 OK", [("Content-Type", "text/html"), ('Access-Control-Allow-Origin', '*')])
-        return self._api.get_response(path='/'.join(environ['PATH_INFO'].split('/')[2:]), source=PytoWebSocketServer,
+        path = '/'.join(environ['PATH_INFO'].split('/')[2:])
+        if environ.get('QUERY_STRING'):
+            path += '?' + environ['QUERY_STRING']
+        etag = self._api.get_etag(path) if method == 'get' else None
+        if etag and environ.get('HTTP_IF_NONE_MATCH') == etag:
+            start_response("304 Not Modified", [("ETag", etag), ('Access-Control-Allow-Origin', '*')])
+            return ''
+        headers = [("Content-Type", "text/html"), ('Access-Control-Allow-Origin', '*')]
+        if etag:
+            headers.append(("ETag", etag))
+        start_response("200 OK", headers)
+        return self._api.get_response(path=path, source=PytoWebSocketServer,
                                       method=method, data=data)
 
     def http_file_app(self, environ, start_response):
@@ -105,11 +408,28 @@ class PytoWebSocketServer(HAInterface):
             return "404 Not Found"
 
     def broadcast_state(self, state, source, prev, device):
-        # TODO: add queue system and separate thread to avoid blocking on long network operations
         if self.ws:
-            for client in self.ws.clients.values():
-                message = self._api.get_state_changed_message(state, source, prev, device)
-                client.ws.send(message)
+            clients = self.ws.clients.values()
+            wants = PytoWebSocketApp.subscriptions.wants(device)
+            compact = PytoWebSocketApp.compact
+            message = self._api.get_state_changed_message(state, source, prev, device)
+            self._broadcaster.broadcast(clients, message, key=device.type_id,
+                                        wants=lambda client: client.ws not in compact and wants(client))
+            if compact:
+                # clients whose table was sent before the device was numbered get its static fields
+                number = self._api.get_device_number(device)
+                message = self._api.get_compact_state_changed_message(state, source, prev, device)
+                self._broadcaster.broadcast(clients, message, key=(device.type_id, 'compact'),
+                                            wants=lambda client: compact.get(client.ws, 0) > number and wants(client))
+                message = self._api.get_compact_state_changed_message(state, source, prev, device, static=True)
+                self._broadcaster.broadcast(clients, message, key=(device.type_id, 'static'),
+                                            wants=lambda client: compact.get(client.ws, number + 1) <= number and
+                                            wants(client))
+
+    def broadcast_metrics(self):
+        metrics = self._broadcaster.metrics()
+        metrics['subscriptions'] = PytoWebSocketApp.subscriptions.metrics()
+        return metrics
 
 
 def auth_hook(web_socket_handler):
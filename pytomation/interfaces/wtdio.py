@@ -119,7 +119,7 @@ class Wtdio(HAInterface):
             #print "Sleeping"
             #X10 is slow.  Need to adjust based on protocol sent.  Or pay attention to NAK and auto adjust
             #time.sleep(0.1)
-            time.sleep(0.5)
+            self._idleWait(0.5)
 
     # response[0] = board, resonse[1] = channel, response[2] = L or H    
     def _processDigitalInput(self, response, lastPacketHash):
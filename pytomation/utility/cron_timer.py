@@ -9,7 +9,7 @@ import time
 from datetime import datetime, timedelta
 from threading import Timer, Event
 
-from .periodic_timer import PeriodicTimer
+from .timer import Timer as CTimer
 
 # Some utility classes / functions first
 class AllMatch(set):
@@ -25,9 +25,21 @@ def conv_to_set(obj):  # Allow single integer to be provided
         obj = set(obj)
     return obj
 
+def _sorted_matches(values, first, last):
+    return [v for v in xrange(first, last + 1) if v in values]
+
 # The actual Event class
 class CronTimer(object):
-    FREQUENCY = 1
+    """
+    Fires its action at every datetime matching the interval sets.  Rather
+    than polling once a second, the next matching time is computed and a
+    single Timer wakeup is scheduled for it.  Wakeups are capped at
+    MAX_WAIT seconds so clock and DST changes are picked up, and a match
+    that was missed by more than MISFIRE_GRACE seconds is skipped.
+    """
+    MAX_WAIT = 3600
+    MISFIRE_GRACE = 10
+    MAX_DAYS = 366 * 8
 
     def __init__(self, *args, **kwargs):
         self.args = args
@@ -40,8 +52,10 @@ class CronTimer(object):
         self.months = None
         self.dow = None
 
-        self.timer = PeriodicTimer(self.FREQUENCY)
-        self.timer.action(self._check_for_event)
+        self._next = None
+        self._running = False
+        self.timer = CTimer()
+        self.timer.action(self._check_for_event, ())
 
     def interval(self, secs=allMatch, min=allMatch, hour=allMatch,
                        day=allMatch, month=allMatch, dow=allMatch):
@@ -71,10 +85,13 @@ class CronTimer(object):
     def start(self):
         if not self.secs:
             raise Exception('Shouldnt be starting without definition first')
-        self.timer.start()
+        self._running = True
+        self._schedule(self._now())
 
     def stop(self):
+        self._running = False
         self.timer.stop()
+        self._next = None
 
     def matchtime(self, t):
         """Return True if this event should trigger at the specified datetime"""
@@ -85,17 +102,59 @@ class CronTimer(object):
                 (t.month      in self.months) and
                 (t.isoweekday()  in self.dow))
 
+    def next_time(self, t):
+        """Return the first datetime after t that matches, or None"""
+        t = t.replace(microsecond=0) + timedelta(seconds=1)
+        hours = _sorted_matches(self.hours, 0, 23)
+        mins = _sorted_matches(self.mins, 0, 59)
+        secs = _sorted_matches(self.secs, 0, 59)
+        if not (hours and mins and secs):
+            return None
+        day = t.replace(hour=0, minute=0, second=0)
+        start = (t.hour, t.minute, t.second)
+        for i in xrange(self.MAX_DAYS):
+            if (day.day in self.days and
+                day.month in self.months and
+                day.isoweekday() in self.dow):
+                for h in hours:
+                    if h < start[0]:
+                        continue
+                    for m in mins:
+                        if (h, m) < start[:2]:
+                            continue
+                        for s in secs:
+                            if (h, m, s) >= start:
+                                return day.replace(hour=h, minute=m, second=s)
+            day += timedelta(days=1)
+            start = (0, 0, 0)
+        return None
+
+    def _now(self):
+        return datetime(*datetime.now().timetuple()[:6])
+
+    def _schedule(self, t):
+        self._next = self.next_time(t)
+        if not self._next:
+            return
+        delay = time.mktime(self._next.timetuple()) - time.time()
+        self.timer.interval = max(min(delay, self.MAX_WAIT), 0)
+        self.timer.start()
+
     def _check_for_event(self, *args, **kwargs):
-        if datetime:
-            t = datetime(*datetime.now().timetuple()[:6])
-    #        print 'Time: ' + str(t) + ":" + str(self.secs)
-            if self.matchtime(t):
-    #            print 'Run action'
+        if not self._running or not self._next:
+            return
+        t = self._now()
+        if t >= self._next:
+            if t - self._next <= timedelta(seconds=self.MISFIRE_GRACE):
                 if len(self._action_args) > 0:
                     self._action(self._action_args)
                 else:
                     self._action()
-                
+            t = max(t, self._next)
+        if self._running:
+            # Also covers early wakeups from MAX_WAIT or the clock going back
+            self._schedule(t)
+
     @staticmethod
     def to_cron(string):
         if string == None:
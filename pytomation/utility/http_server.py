@@ -8,12 +8,13 @@ from pytomation.common.pytomation_api import PytomationAPI
 file_path = "/tmp"
 
 class PytomationHandlerClass(SimpleHTTPRequestHandler):
+    api = None  # shared by all requests, set by PytomationHTTPServer
+
     def __init__(self,req, client_addr, server):
 #        self._request = req
 #        self._address = client_addr
 #        self._server = server
-        self._logger = PytoLogging(self.__class__.__name__)
-        self._api = PytomationAPI()
+        self._api = self.api or PytomationAPI()
 
         SimpleHTTPRequestHandler.__init__(self, req, client_addr, server)
     
@@ -51,8 +52,18 @@ class PytomationHandlerClass(SimpleHTTPRequestHandler):
                 data = self.rfile.read(length)
 #                print 'rrrrr' + str(length) + ":" + str(data)
                 self.rfile.close()
-            response = self._api.get_response(method=method, path="/".join(p[2:]), type=None, data=data)
+            path = "/".join(p[2:])
+            etag = self._api.get_etag(path) if method.lower() == 'get' else None
+            if etag and self.headers.getheader('If-None-Match') == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                self.finish()
+                return
+            response = self._api.get_response(method=method, path=path, type=None, data=data)
             self.send_response(200)
+            if etag:
+                self.send_header("ETag", etag)
             self.send_header("Content-type", "application/json")
             self.send_header("Content-length", len(response))
             self.end_headers()
@@ -74,6 +85,7 @@ class PytomationHTTPServer(object):
         server_address = (self._address, self._port)
         
         PytomationHandlerClass.protocol_version = self._protocol
+        PytomationHandlerClass.api = PytomationAPI()
         httpd = BaseHTTPServer.HTTPServer(server_address, PytomationHandlerClass)
         
         sa = httpd.socket.getsockname()
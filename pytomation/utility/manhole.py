@@ -24,6 +24,7 @@ class Manhole(object):
                     instance_id: instance_detail['instance']
                 }
                 )
+        factory.namespace.update({'diagnostics': get_diagnostics})
         factory.username = user
         factory.password = password
         print 'Listening on port '  + str(port)
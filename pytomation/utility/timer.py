@@ -1,20 +1,92 @@
+import heapq
+import itertools
 import time
 from datetime import datetime, timedelta
-from threading import Timer as PTimer, Event
+from threading import Condition, Event, Lock, Thread
+
+
+class TimerScheduler(object):
+    """
+    Keeps the deadlines of every running Timer in one heap serviced by a
+    single thread, instead of one threading.Timer thread per start.
+
+    Cancelling only marks the entry; dead entries are discarded when they
+    reach the top of the heap, or all at once when they make up more than
+    half of it.
+    """
+    COMPACT_MINIMUM = 1024
+
+    def __init__(self):
+        self._heap = []
+        self._cancelled = 0
+        self._sequence = itertools.count()
+        self._condition = Condition(Lock())
+        self._thread = None
+
+    def __len__(self):
+        with self._condition:
+            return len(self._heap) - self._cancelled
+
+    def schedule(self, secs, callback):
+        # [deadline, tie breaker, callback]  callback is None once cancelled or fired
+        entry = [time.time() + secs, next(self._sequence), callback]
+        with self._condition:
+            heapq.heappush(self._heap, entry)
+            if self._heap[0] is entry:
+                self._condition.notify()
+            if not self._thread:
+                self._thread = Thread(target=self._run, name='TimerScheduler')
+                self._thread.daemon = True
+                self._thread.start()
+        return entry
+
+    def cancel(self, entry):
+        with self._condition:
+            if entry[2] is None:
+                return
+            entry[2] = None
+            self._cancelled += 1
+            if self._cancelled > self.COMPACT_MINIMUM and self._cancelled * 2 > len(self._heap):
+                self._heap = [e for e in self._heap if e[2] is not None]
+                heapq.heapify(self._heap)
+                self._cancelled = 0
+
+    def _next_due(self):
+        with self._condition:
+            while True:
+                while self._heap and self._heap[0][2] is None:
+                    heapq.heappop(self._heap)
+                    self._cancelled -= 1
+                if not self._heap:
+                    self._condition.wait()
+                    continue
+                delay = self._heap[0][0] - time.time()
+                if delay <= 0:
+                    entry = heapq.heappop(self._heap)
+                    callback = entry[2]
+                    entry[2] = None
+                    return callback
+                self._condition.wait(delay)
+
+    def _run(self):
+        while True:
+            callback = self._next_due()
+            try:
+                callback()
+            except Exception, ex:
+                pass
 
 
 # The actual Event class
 class Timer(object):
+    # shared by every Timer, its thread starts with the first timer started
+    scheduler = TimerScheduler()
 
     def __init__(self, secs=60, *args, **kwargs):
-        self._timer = None
+        self._entry = None
+        self._thread = None
         self._secs = secs
         self._action = None
-        
-    def _get_timer(self, secs):
-        timer = PTimer(secs, self._run_action, ())
-        timer.daemon = True
-        return timer
 
     @property
     def interval(self):
@@ -30,7 +102,13 @@ class Timer(object):
         self._action = action
         self._action_args = action_args
         self._action_kwargs = kwargs
-    
+
+    def _fire(self):
+        # Actions may block on interface I/O, keep them off the scheduler thread
+        self._thread = Thread(target=self._run_action)
+        self._thread.daemon = True
+        self._thread.start()
+
     def _run_action(self):
         if self._action:
             if isinstance(self._action_args, tuple):
@@ -40,21 +118,29 @@ class Timer(object):
         else:
             self.stop()
 
-    def start(self):
+    def start(self, secs=None):
+        """ Fires after the interval, or once after secs when given """
         self.stop()
-        self._timer = self._get_timer(self._secs)
-        self._timer.start()
-            
+        self._entry = Timer.scheduler.schedule(self._secs if secs is None else secs, self._fire)
+
+    def remaining(self):
+        """ Seconds until the timer fires, None when it is not running """
+        entry = self._entry
+        if entry and entry[2] is not None:
+            return max(entry[0] - time.time(), 0)
+        return None
+
     def stop(self):
-        if self._timer and self._timer.isAlive():
-            self._timer.cancel()
-        if self._timer:
-            del(self._timer)
-        self._timer = None
-        
+        if self._entry:
+            Timer.scheduler.cancel(self._entry)
+        self._entry = None
+        self._thread = None
+
     def restart(self):
         self.stop()
         self.start()
 
     def isAlive(self):
-        return self._timer.isAlive() if self._timer else False
\ No newline at end of file
+        if self._entry and self._entry[2] is not None:
+            return True
+        return self._thread.isAlive() if self._thread else False
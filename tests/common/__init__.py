@@ -4,3 +4,8 @@ from .pytomation_object import *
 from .pytomation_system import *
 from .pyto_logging import *
 from .pytomation_api import *
+from .pattern_matcher import *
+from .dispatch import *
+from .state_store import *
+from .state_journal import *
+from .rollups import *
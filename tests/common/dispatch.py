@@ -0,0 +1,67 @@
+import threading
+import time
+from unittest import TestCase, main
+
+from pytomation.common.dispatch import SerialExecutor, cascade, current_cascade
+
+
+class SerialExecutorTests(TestCase):
+    def setUp(self):
+        self.executor = SerialExecutor(workers=4)
+
+    def tearDown(self):
+        self.executor.shutdown()
+
+    def test_order_per_key(self):
+        runs = {'a': [], 'b': []}
+        def task(key, i):
+            time.sleep(0.001)
+            runs[key].append(i)
+        for i in xrange(50):
+            self.executor.submit('a', task, 'a', i)
+            self.executor.submit('b', task, 'b', i)
+        self.assertTrue(self.executor.wait(5))
+        self.assertEqual(runs['a'], range(50))
+        self.assertEqual(runs['b'], range(50))
+        self.assertEqual(self.executor.pending(), 0)
+
+    def test_keys_side_by_side(self):
+        block = threading.Event()
+        ran = []
+        self.executor.submit('slow', block.wait)
+        self.executor.submit('slow', ran.append, 'slow')
+        self.executor.submit('fast', ran.append, 'fast')
+        time.sleep(0.1)
+        # the key behind the blocked task waits, the other does not
+        self.assertEqual(ran, ['fast'])
+        self.assertFalse(self.executor.wait(0.05))
+        block.set()
+        self.assertTrue(self.executor.wait(5))
+        self.assertEqual(ran, ['fast', 'slow'])
+
+    def test_task(self):
+        block = threading.Event()
+        self.executor.submit('a', block.wait)
+        task = self.executor.submit('a', lambda: self.executor.running())
+        self.assertFalse(task.wait(0.05))
+        block.set()
+        self.assertTrue(task.wait(5))
+        self.assertEqual(task.result, 'a')
+        self.assertEqual(self.executor.running(), None)
+
+    def test_failed_task(self):
+        ran = []
+        self.executor.submit('a', lambda: 1 / 0)
+        self.executor.submit('a', ran.append, 1)
+        self.assertTrue(self.executor.wait(5))
+        self.assertEqual(ran, [1])
+
+    def test_cascade(self):
+        self.assertEqual(current_cascade(), frozenset())
+        with cascade(frozenset(['a'])):
+            self.assertEqual(current_cascade(), frozenset(['a']))
+        self.assertEqual(current_cascade(), frozenset())
+
+
+if __name__ == '__main__':
+    main()
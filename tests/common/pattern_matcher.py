@@ -0,0 +1,24 @@
+from unittest import TestCase
+
+from pytomation.common.pattern_matcher import PatternMatcher
+
+class PatternMatcherTests(TestCase):
+    def test_find_all(self):
+        matcher = PatternMatcher(['he', 'she', 'his', 'hers'])
+        self.assertEqual(matcher.find_all('ushers'),
+                         [(1, 4, 'she'), (2, 4, 'he'), (2, 6, 'hers')])
+        self.assertEqual(matcher.find_all('nothing'), [])
+
+    def test_find_longest(self):
+        matcher = PatternMatcher(['lamp', 'family lamp', 'family'])
+        matcher.add('on', 'ON')
+        self.assertEqual(matcher.find('turn family lamp on'),
+                         [(5, 16, 'family lamp'), (17, 19, 'ON')])
+
+    def test_add_after_search(self):
+        matcher = PatternMatcher(['porch'])
+        self.assertEqual(matcher.find('back porch light'), [(5, 10, 'porch')])
+        matcher.add('back porch light')
+        self.assertTrue('back porch light' in matcher)
+        self.assertFalse('back porch' in matcher)
+        self.assertEqual(matcher.find('back porch light'), [(0, 16, 'back porch light')])
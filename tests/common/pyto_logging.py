@@ -1,3 +1,5 @@
+import logging
+
 from unittest import TestCase, main
 
 from pytomation.common import PytoLogging
@@ -10,4 +12,49 @@ class LoggingTests(TestCase):
         logger.warning('This is a warning statement')
         logger.error('This is an error statement')
         logger.critical('This is a critical statement')
-        self.assertTrue(True)
\ No newline at end of file
+        self.assertTrue(True)
+
+class FormatCounter(object):
+    count = 0
+
+    def __format__(self, spec):
+        FormatCounter.count += 1
+        return 'formatted'
+
+class Named(object):
+    name = 'named'
+
+
+class DeferredLoggingTests(TestCase):
+    def test_deferred_format(self):
+        logger = PytoLogging('DeferredLoggingTests')
+        logger.setLevel(logging.ERROR)
+        FormatCounter.count = 0
+        logger.debug('{name} {value}', name='test', value=FormatCounter())
+        logger.info('{0}', FormatCounter())
+        self.assertEqual(FormatCounter.count, 0)
+        logger.error('{name} {value}', name='test', value=FormatCounter())
+        self.assertEqual(FormatCounter.count, 1)
+
+    def test_literal_braces_without_args(self):
+        logger = PytoLogging('DeferredLoggingTests')
+        logger.setLevel(logging.ERROR)
+        logger.error('{not a field}')
+        self.assertTrue(logger.isEnabledFor(logging.ERROR))
+        self.assertFalse(logger.isEnabledFor(logging.DEBUG))
+
+    def test_bad_format(self):
+        logger = PytoLogging('DeferredLoggingTests')
+        logger.setLevel(logging.DEBUG)
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        logger.addHandler(handler)
+        try:
+            # logged as an error instead of raised to the caller
+            logger.debug('{missing} {0:d}', 'text')
+            logger.debug('{source!n} and {other!n}', source=Named(), other=None)
+        finally:
+            logger.removeHandler(handler)
+        self.assertEqual(records[0].levelno, logging.ERROR)
+        self.assertEqual(records[1].getMessage(), 'named and None')
@@ -1,6 +1,13 @@
+import json
+import shutil
+import tempfile
+import time
 from unittest import TestCase
 
+from pytomation.common import pytomation_system
 from pytomation.common.pytomation_api import PytomationAPI
+from pytomation.common.state_journal import StateJournal
+from pytomation.common.rollups import Rollups
 from pytomation.devices import StateDevice, State, Light
 from pytomation.interfaces import Command
 
@@ -27,6 +34,14 @@ class PytomationAPITests(TestCase):
         response = self.api.get_response(method='GET', path="device/" + str(d.type_id))
         self.assertTrue('"name": "device_test_1"' in response)
         
+    def test_diagnostics(self):
+        d=StateDevice(name='device_test_1')
+        response = self.api.get_response(method='GET', path="diagnostics")
+        self.assertTrue('"StateDevice": ' in response)
+        self.assertFalse('"collected"' in response)
+        response = self.api.get_response(method='GET', path="diagnostics/collect")
+        self.assertTrue('"collected"' in response)
+
     def test_device_on(self):
         d=StateDevice(name='device_test_1')
         d.off()
@@ -41,4 +56,179 @@ class PytomationAPITests(TestCase):
         self.assertEqual(d.state, State.OFF)
         response = self.api.get_response(method='POST', path="device/" + str(d.type_id), data=['command=level%2C72'])
         self.assertEqual(d.state, (State.LEVEL, 72))
-        self.assertTrue('"name": "device_test_1"' in response)
\ No newline at end of file
+        self.assertTrue('"name": "device_test_1"' in response)
+    def test_device_list_since(self):
+        d1=StateDevice(name='device_test_1')
+        d2=StateDevice(name='device_test_2')
+        d1.off()
+        d2.off()
+        response = json.loads(self.api.get_response(method='GET', path="devices?since=0"))
+        version = response['version']
+        self.assertTrue(d1.type_id in [device['id'] for device in response['devices']])
+        response = json.loads(self.api.get_response(method='GET', path="devices?since=%d" % version))
+        self.assertEqual(response, {'version': version, 'devices': []})
+        d2.on()
+        response = json.loads(self.api.get_response(method='GET', path="devices?since=%d" % version))
+        self.assertTrue(response['version'] > version)
+        self.assertEqual([device['id'] for device in response['devices']], [d2.type_id])
+        self.assertEqual(response['devices'][0]['state'], State.ON)
+
+    def test_etag(self):
+        d=StateDevice(name='device_test_1')
+        d.off()
+        etag = self.api.get_etag("devices")
+        self.assertEqual(self.api.get_etag("devices?since=3"), etag)
+        device_etag = self.api.get_etag("device/" + str(d.type_id))
+        self.assertIsNotNone(device_etag)
+        self.assertIsNone(self.api.get_etag("diagnostics"))
+        d.off()
+        self.assertEqual(self.api.get_etag("devices"), etag)
+        d.on()
+        self.assertNotEqual(self.api.get_etag("devices"), etag)
+        self.assertNotEqual(self.api.get_etag("device/" + str(d.type_id)), device_etag)
+
+    def test_device_history(self):
+        d=StateDevice(name='device_test_1')
+        directory = tempfile.mkdtemp()
+        journal = StateJournal(directory, batch_time=0.1)
+        pytomation_system._journal = journal
+        try:
+            journal.record(State.ON, prev=State.OFF, device=d)
+            journal.record(State.OFF, source=d, prev=State.ON, device=d)
+            path = "device/" + str(d.type_id) + "/history"
+            self.assertIsNone(self.api.get_etag(path))
+            response = json.loads(self.api.get_response(method='GET', path=path))
+            self.assertEqual(response['name'], 'device_test_1')
+            self.assertEqual([(event['state'], event['previous_state'], event['source'])
+                              for event in response['history']],
+                             [(State.ON, State.OFF, None), (State.OFF, State.ON, 'device_test_1')])
+            start = time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(time.time() + 60))
+            response = json.loads(self.api.get_response(method='GET', path=path + "?from=" + start))
+            self.assertEqual(response['history'], [])
+            response = json.loads(self.api.get_response(
+                method='GET', path=path + "?from=0&to=%f" % time.time()))
+            self.assertEqual(len(response['history']), 2)
+        finally:
+            pytomation_system._journal = None
+            journal.close()
+            shutil.rmtree(directory)
+
+    def test_device_rollups(self):
+        d=StateDevice(name='device_test_1')
+        path = "device/" + str(d.type_id) + "/rollups"
+        response = json.loads(self.api.get_response(method='GET', path=path))
+        self.assertEqual(response['buckets'], [])
+        rollups = Rollups()
+        pytomation_system._rollups = rollups
+        try:
+            rollups.add('device_test_1', 20, at=600)
+            rollups.add('device_test_1', 30, at=620)
+            rollups.add('device_test_1', 25, at=3700)
+            response = json.loads(self.api.get_response(method='GET', path=path))
+            self.assertEqual(response['resolution'], 60)
+            self.assertEqual(response['resolutions'], [60, 900, 3600])
+            self.assertEqual(response['buckets'], [[600, 20, 30, 25, 2], [3660, 25, 30, 27.5, 2]])
+            response = json.loads(self.api.get_response(method='GET', path=path + "?resolution=3600&from=0&to=3599"))
+            self.assertEqual(response['buckets'], [[0, 20, 30, 25, 2]])
+        finally:
+            pytomation_system._rollups = None
+
+    def test_compact_state_changed(self):
+        d=Light(name='device_test_1')
+        (count, table) = self.api.get_device_table()
+        table = json.loads(table)
+        self.assertEqual(table['encoding'], 'compact')
+        row = [row for row in table['devices'] if row[1] == d.type_id][0]
+        self.assertEqual(row[2:], ['device_test_1', 'Light'])
+        self.assertTrue(row[0] < count)
+        message = self.api.get_compact_state_changed_message((State.LEVEL, 40), None, State.OFF, d)
+        self.assertEqual(json.loads(message), [row[0], [State.LEVEL, 40], State.OFF])
+        self.assertTrue(len(message) < len(self.api.get_state_changed_message((State.LEVEL, 40), None, State.OFF, d)))
+        # not in that table, so a client of it gets the static fields along
+        late=Light(name='device_test_2')
+        self.assertTrue(self.api.get_device_number(late) >= count)
+        message = json.loads(self.api.get_compact_state_changed_message(State.ON, None, State.OFF, late, static=True))
+        self.assertEqual(message[1:], [State.ON, State.OFF, late.type_id, 'device_test_2', 'Light'])
+
+    def test_device_snapshot(self):
+        d1=StateDevice(name='device_test_1')
+        d2=StateDevice(name='device_test_2')
+        d1.off()
+        path = "device/" + str(d1.type_id)
+        response = json.loads(self.api.get_response(method='GET', path=path))
+        self.assertEqual(response['state'], State.OFF)
+        self.assertEqual(response['devices'], None)
+        d1.on()
+        d1.add_device(d2)
+        d1.name = 'device_test_renamed'
+        response = json.loads(self.api.get_response(method='GET', path=path))
+        self.assertEqual(response['state'], State.ON)
+        self.assertEqual(response['devices'], [d2.type_id])
+        self.assertEqual(response['name'], 'device_test_renamed')
+        response = json.loads(self.api.get_response(method='GET', path="devices"))
+        self.assertTrue(response[0]['id'] in [d['id'] for d in response])
+        self.assertTrue('device_test_renamed' in [d['name'] for d in response])
+
+    def test_voice(self):
+        lamp=Light(name='voice lamp')
+        family=Light(name='voice family lamp')
+        lamp.off()
+        family.off()
+        self.api.get_response(method='POST', path="voice", data='command[]=turn+voice+family+lamp+on')
+        self.assertEqual(family.state, State.ON)
+        self.assertEqual(lamp.state, State.OFF)
+        self.api.get_response(method='POST', path="voice", data='command[]=set+voice+lamp+to+40')
+        self.assertEqual(lamp.state, (State.LEVEL, 40))
+        response = self.api.get_response(method='POST', path="voice", data='command[]=open+the+pod+bay+doors')
+        self.assertTrue('repeat' in response)
+
+    def test_voice_overlapping_names(self):
+        porch = StateDevice(name='porch light')
+        switch = StateDevice(name='light switch')
+        porch.off()
+        switch.off()
+        # the longer name wins even though the shorter one starts first
+        self.api.get_response(method='POST', path="voice", data='command[]=porch+light+switch+on')
+        self.assertEqual(switch.state, State.ON)
+        self.assertEqual(porch.state, State.OFF)
+
+    def test_device_batch(self):
+        d1=StateDevice(name='device_test_1')
+        d2=Light(name='device_test_2')
+        d1.off()
+        d2.off()
+        operations = [{'id': d1.type_id, 'command': 'on'},
+                      {'id': d2.type_id, 'command': 'level,40'},
+                      {'id': 'NoSuchDevice', 'command': 'on'},
+                      {'id': d1.type_id, 'command': 'off'}]
+        response = json.loads(self.api.get_response(method='POST', path="devices/batch", data=json.dumps(operations)))
+        self.assertEqual([r['success'] for r in response], [True, True, False, True])
+        self.assertEqual([r['id'] for r in response], [o['id'] for o in operations])
+        self.assertEqual(response[1]['state'], [State.LEVEL, 40])
+        self.assertEqual(d1.state, State.OFF)
+        self.assertEqual(d2.state, (State.LEVEL, 40))
+        message = json.dumps({'path': 'devices/batch', 'command': [{'id': d1.type_id, 'command': 'on'},
+                                                                   {'id': d2.type_id, 'command': ['level', 60]}]})
+        response = json.loads(self.api.get_response(data=message, type=PytomationAPI.WEBSOCKET))
+        self.assertEqual([r['success'] for r in response], [True, True])
+        self.assertEqual(d1.state, State.ON)
+        self.assertEqual(d2.state, (State.LEVEL, 60))
+
+    def test_device_batch_malformed(self):
+        d1=StateDevice(name='device_test_1')
+        for data in ('{"id": "%s", "command": "on"}' % d1.type_id, 'on', '"on"'):
+            response = json.loads(self.api.get_response(method='POST', path="devices/batch", data=data))
+            self.assertEqual(response['status'], 400)
+        response = json.loads(self.api.get_response(method='POST', path="devices/batch",
+                                                    data=json.dumps([1, {'id': d1.type_id, 'command': 'on'}])))
+        self.assertEqual([r['success'] for r in response], [False, True])
+        self.assertEqual(d1.state, State.ON)
+
+    def test_device_batch_bad_id(self):
+        d1=StateDevice(name='device_test_1')
+        data = [{'id': [d1.type_id], 'command': 'off'}, {'id': {'a': 1}, 'command': 'off'},
+                {'command': 'off'}, {'id': d1.type_id, 'command': 'on'}]
+        response = json.loads(self.api.get_response(method='POST', path="devices/batch", data=json.dumps(data)))
+        self.assertEqual([r['success'] for r in response], [False, False, False, True])
+        self.assertEqual(response[0]['error'], 'Operation id must be a string')
+        self.assertEqual(d1.state, State.ON)
@@ -1,8 +1,11 @@
+import gc
 from unittest import TestCase, main
 from mock import Mock
 
 from pytomation.devices import StateDevice
 from pytomation.interfaces import UPB
+from pytomation.common import PytomationObject
+from pytomation.common.pytomation_api import PytomationAPI
 
 class PytomationObjectTests(TestCase):
     def test_interface_name(self):
@@ -25,4 +28,19 @@ class PytomationObjectTests(TestCase):
     def test_device_type_name(self):
         name = "Test"
         device = StateDevice(name=name)
-        self.assertEqual(device.type_name, "StateDevice")
\ No newline at end of file
+        self.assertEqual(device.type_name, "StateDevice")
+
+    def test_transient(self):
+        device = StateDevice(name='Test')
+        registered = (len(PytomationObject.instances), len(PytomationObject.name_to_id_map),
+                      len(PytomationObject.sorted_names_by_length))
+        transient = len(PytomationObject.transient_instances)
+        for i in range(1000):
+            api = PytomationAPI()
+            api.get_response(method='GET', path='device/' + device.type_id)
+        self.assertEqual((len(PytomationObject.instances), len(PytomationObject.name_to_id_map),
+                          len(PytomationObject.sorted_names_by_length)), registered)
+        self.assertTrue(api.type_id in PytomationObject.transient_instances)
+        del api
+        gc.collect()
+        self.assertEqual(len(PytomationObject.transient_instances), transient)
@@ -4,6 +4,7 @@ from mock import Mock
 from pytomation.common.pytomation_system import *
 from pytomation.interfaces import HAInterface
 from pytomation.devices import StateDevice
+from pytomation.utility.timer import Timer as CTimer
 
 
 class SystemTests(TestCase):
@@ -28,4 +29,17 @@ class SystemTests(TestCase):
 #        self.assertEqual(len(a), l+2)
         self.assertEqual(a[dev.type_id]['name'], 'Dev1')
         self.assertEqual(a[dev.type_id]['type_name'], 'StateDevice')
-        
+
+    def test_get_diagnostics(self):
+        dev = StateDevice(name='Dev1')
+        a = get_diagnostics()
+        self.assertTrue(a['objects']['StateDevice'] >= 1)
+        self.assertTrue('counts' in a['gc'])
+        self.assertFalse('collected' in a['gc'])
+        self.assertTrue(a['timers']['threads'] >= 1)
+        timer = CTimer(60)
+        timer.start()
+        self.assertEqual(get_diagnostics()['timers']['scheduled_timers'], a['timers']['scheduled_timers'] + 1)
+        timer.stop()
+        a = get_diagnostics(collect=True)
+        self.assertTrue('collected' in a['gc'])
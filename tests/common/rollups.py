@@ -0,0 +1,57 @@
+from unittest import TestCase, main
+
+from pytomation.common.rollups import Rollups, RollupSeries
+from pytomation.devices import StateDevice, State, Thermostat
+from pytomation.interfaces import Command
+
+
+class RollupsTests(TestCase):
+    def test_series(self):
+        series = RollupSeries(60, 3)
+        for (at, value) in ((0, 5), (30, 7), (59, 3), (60, 10), (150, 1)):
+            series.add(at, value)
+        self.assertEqual(series.buckets(), [(0, 3, 7, 5, 3), (60, 10, 10, 10, 1), (120, 1, 1, 1, 1)])
+        self.assertEqual(series.buckets(start=60, end=119), [(60, 10, 10, 10, 1)])
+        # the ring moves on, the first bucket is dropped and late samples ignored
+        series.add(200, 4, held=1)
+        series.add(10, 100)
+        self.assertEqual(series.buckets(), [(60, 10, 10, 10, 1), (120, 1, 1, 1, 1), (180, 1, 4, 2.5, 2)])
+
+    def test_value(self):
+        self.assertEqual(Rollups.value((State.LEVEL, 40)), 40.0)
+        self.assertEqual(Rollups.value((State.LEVEL, '71.5')), 71.5)
+        self.assertEqual(Rollups.value([('mode', State.HEAT), ('temp', 68)]), 68.0)
+        self.assertIsNone(Rollups.value(State.ON))
+        self.assertIsNone(Rollups.value((State.LEVEL, 'high')))
+        self.assertIsNone(Rollups.value([('mode', State.HEAT)]))
+
+    def test_bounded(self):
+        rollups = Rollups()
+        rollups.add('rollups bounded', 1, at=0)
+        memory = rollups.memory()
+        for i in xrange(100000):
+            rollups.add('rollups bounded', i % 50, at=i * 60)
+        self.assertEqual(rollups.memory(), memory)
+        self.assertEqual(len(rollups.buckets('rollups bounded')), 1440)
+        self.assertEqual(len(rollups.buckets('rollups bounded', 3600)), 720)
+        self.assertIsNone(rollups.buckets('rollups bounded', 5))
+        self.assertIsNone(rollups.buckets('rollups unknown'))
+
+    def test_state_changed(self):
+        rollups = Rollups()
+        StateDevice._delegates_state_change.append(rollups.record)
+        try:
+            thermostat = Thermostat(name='rollups thermostat')
+            thermostat.command((Command.LEVEL, 70))
+            thermostat.command((Command.LEVEL, 74))
+            device = StateDevice(name='rollups device')
+            device.on()
+        finally:
+            StateDevice._delegates_state_change.remove(rollups.record)
+        self.assertEqual(rollups.names(), ['rollups thermostat'])
+        buckets = rollups.buckets('rollups thermostat')
+        self.assertEqual(buckets[-1][1:3], (70, 74))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+from unittest import TestCase, main
+
+from pytomation.common.state_journal import StateJournal
+from pytomation.devices import StateDevice, State
+from pytomation.interfaces import Command
+
+
+class StateJournalTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.journal = StateJournal(self.directory, batch_time=0.1)
+
+    def tearDown(self):
+        self.journal.close()
+        shutil.rmtree(self.directory)
+
+    def test_history(self):
+        source = StateDevice(name='journal source')
+        device = StateDevice(name='journal device')
+        self.journal.record(State.ON, source=source, prev=State.UNKNOWN, device=device)
+        between = time.time()
+        self.journal.record((State.LEVEL, 30), source=None, prev=State.ON, device=device)
+        self.journal.record(State.ON, source=None, prev=State.OFF, device=source)
+        self.assertTrue(self.journal.flush(5))
+        history = self.journal.history('journal device')
+        self.assertEqual([event[1:] for event in history],
+                         [(State.ON, State.UNKNOWN, 'journal source'),
+                          ((State.LEVEL, 30), State.ON, None)])
+        self.assertEqual([event[1] for event in self.journal.history('journal device', start=between)],
+                         [(State.LEVEL, 30)])
+        self.assertEqual(self.journal.history('journal device', end=between - 10), [])
+
+    def test_record_threads(self):
+        device = StateDevice(name='journal threads')
+        def record():
+            for i in xrange(500):
+                self.journal.record((State.LEVEL, i), device=device)
+        threads = [threading.Thread(target=record) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertTrue(self.journal.flush(5))
+        self.assertEqual(self.journal._queued, 4000)
+        self.assertEqual(len(self.journal.history('journal threads')), 4000)
+
+    def test_segments(self):
+        self.journal.close()
+        self.journal = StateJournal(self.directory, segment_time=1, keep_segments=2, batch_time=0.1)
+        device = StateDevice(name='journal segments')
+        for i in xrange(4):
+            self.journal.record((State.LEVEL, i), device=device)
+            self.journal.flush(5)
+            time.sleep(1)
+        files = [name for name in os.listdir(self.directory) if name.endswith('.db')]
+        self.assertEqual(len(files), 2)
+        self.assertEqual([event[1] for event in self.journal.history('journal segments')],
+                         [(State.LEVEL, 2), (State.LEVEL, 3)])
+
+    def test_state_changed(self):
+        StateDevice._delegates_state_change.append(self.journal.record)
+        try:
+            device = StateDevice(name='journal changed')
+            device.on()
+            device.command((Command.LEVEL, 50))
+        finally:
+            StateDevice._delegates_state_change.remove(self.journal.record)
+        states = [event[1] for event in self.journal.history('journal changed')]
+        self.assertEqual(states[-2:], [State.ON, (State.LEVEL, 50)])
+
+
+if __name__ == '__main__':
+    main()
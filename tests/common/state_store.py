@@ -0,0 +1,80 @@
+import os
+import shutil
+import tempfile
+import time
+from unittest import TestCase, main
+
+from pytomation.common.state_store import StateStore
+from pytomation.devices import StateDevice, State, Attribute
+from pytomation.interfaces import Command
+
+
+class StateStoreTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'state.json')
+        self.store = StateStore(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_restore(self):
+        source = StateDevice(name='store source')
+        delayed = StateDevice(devices=source, name='store delayed',
+                              delay={Attribute.COMMAND: Command.OFF,
+                                     Attribute.MAPPED: (Command.LEVEL, 80),
+                                     Attribute.SOURCE: source,
+                                     Attribute.SECS: 1,
+                                     })
+        manual = StateDevice(name='store manual')
+        manual.command((Command.LEVEL, 40))
+        manual.manual()
+        source.on()
+        source.off()
+        self.assertEqual(delayed.state, State.ON)
+        self.assertTrue(self.store.save() >= 3)
+        self.assertEqual(os.listdir(self.directory), ['state.json'])
+
+        # as if restarted, the delay still pending
+        delayed._delay_timers[(Command.LEVEL, 80)].stop()
+        source._state = State.UNKNOWN
+        delayed._state = State.UNKNOWN
+        manual._state = State.UNKNOWN
+        manual._automatic = True
+        self.assertTrue(self.store.restore() >= 3)
+        self.assertEqual(manual.state, (State.LEVEL, 40))
+        self.assertEqual(manual._automatic, False)
+        self.assertEqual(delayed.state, State.ON)
+        self.assertEqual(delayed._previous_state, State.UNKNOWN)
+        time.sleep(2)
+        self.assertEqual(delayed.state, (State.LEVEL, 80))
+
+    def test_restore_reported(self):
+        device = StateDevice(name='store reported')
+        device.off()
+        self.store.save()
+        # the interface reports the state after the save, at startup
+        time.sleep(0.01)
+        device.on()
+        self.store.restore()
+        self.assertEqual(device.state, State.ON)
+        device._state = State.UNKNOWN
+        self.store.restore()
+        self.assertEqual(device.state, State.OFF)
+
+    def test_save_changed(self):
+        device = StateDevice(name='store changed')
+        self.assertTrue(self.store.save_changed() > 0)
+        self.assertEqual(self.store.save_changed(), 0)
+        device.on()
+        self.assertTrue(self.store.save_changed() > 0)
+
+    def test_unreadable(self):
+        self.assertEqual(self.store.restore(), 0)
+        with open(self.path, 'w') as output:
+            output.write('{"devi')
+        self.assertEqual(self.store.restore(), 0)
+
+
+if __name__ == '__main__':
+    main()
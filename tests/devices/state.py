@@ -1,10 +1,13 @@
+import threading
 import time
 
 from unittest import TestCase
 from datetime import datetime
 from mock import Mock, PropertyMock, MagicMock
 
-from pytomation.devices import StateDevice, State, Attribute, Attributes
+from pytomation.devices import StateDevice, State, Attribute, Attributes, InterfaceDevice
+from pytomation.common import Task, Priority, command_batch, command_nowait, command_priority, current_batch, \
+                              current_priority, waiting_for_commands
 from pytomation.interfaces import Command
 
 
@@ -564,7 +567,29 @@ class StateTests(TestCase):
         self.assertEqual(d4.state, State.ON)
         d2.on()
         self.assertEqual(d4.state, State.OFF)
-        
+
+    def test_map_specific_before_general(self):
+        d1 = StateDevice()
+        d2 = StateDevice()
+        d3 = StateDevice(devices=(d1, d2))
+        d3.mapped(command=Command.ON, mapped=Command.OFF)
+        d3.mapped(command=Command.ON, source=d1, mapped=Command.ON)
+        d1.on()
+        self.assertEqual(d3.state, State.ON)
+        d2.on()
+        self.assertEqual(d3.state, State.OFF)
+
+    def test_map_added_after_command(self):
+        d1 = StateDevice()
+        d2 = StateDevice(devices=d1)
+        d1.on()
+        self.assertEqual(d2.state, State.ON)
+        d2.mapped(command=Command.OFF, source=d1, mapped=Command.ON)
+        d2.off()
+        self.assertEqual(d2.state, State.OFF)
+        d1.off()
+        self.assertEqual(d2.state, State.ON)
+
     def test_delay_cancel_on_other_state(self):
         d1 = StateDevice()
         d2 = StateDevice(devices=d1,
@@ -820,4 +845,122 @@ class StateTests(TestCase):
         s1.on()
         StateDevice.test_onStateChangedGlobal(custom.method)
         s1.off()
-        custom.method.assert_called_with(State.OFF, source=None, prev=State.ON, device=s1)
\ No newline at end of file
+        custom.method.assert_called_with(State.OFF, source=None, prev=State.ON, device=s1)
+
+    def test_dispatch_delegates(self):
+        dispatcher = StateDevice.dispatch_delegates(4)
+        try:
+            d1 = StateDevice()
+            d2 = StateDevice(devices=d1)
+            d3 = StateDevice(devices=d2)
+            # a cycle back to the first device
+            d1.add_device(d3)
+            block = threading.Event()
+            slow = StateDevice(devices=d1)
+            slow_command = slow.command
+            def command(*args, **kwargs):
+                block.wait()
+                return slow_command(*args, **kwargs)
+            slow.command = command
+            start = time.time()
+            d1.on()
+            self.assertTrue(time.time() - start < 0.5)
+            time.sleep(0.2)
+            # the slow delegate holds up only itself
+            self.assertEqual(d3.state, State.ON)
+            self.assertEqual(slow.state, State.UNKNOWN)
+            block.set()
+            self.assertTrue(dispatcher.wait(5))
+            self.assertEqual(slow.state, State.ON)
+            # in order for each device
+            for i in xrange(20):
+                d1.off()
+                d1.on()
+            d1.off()
+            self.assertTrue(dispatcher.wait(5))
+            self.assertEqual([d2.state, d3.state, slow.state], [State.OFF] * 3)
+        finally:
+            StateDevice.dispatch_delegates(0)
+
+    def test_mailboxes(self):
+        mailboxes = StateDevice.use_mailboxes(4)
+        try:
+            d1 = StateDevice(initial=State.ON)
+            # constructed with its initial state
+            self.assertEqual(d1.state, State.ON)
+            d2 = StateDevice(devices=d1)
+            d3 = StateDevice(devices=d2)
+            # delegating to each other, which would wait on each other's locks
+            d1.add_device(d3)
+            d2.add_device(d3)
+            queued = d1.off()
+            self.assertTrue(isinstance(queued, Task))
+            self.assertTrue(queued.wait(5))
+            self.assertEqual(d1.state, State.OFF)
+            self.assertTrue(mailboxes.wait(5))
+            self.assertEqual([d2.state, d3.state], [State.OFF, State.OFF])
+        finally:
+            StateDevice.use_mailboxes(0)
+
+    def test_mailboxes_batch(self):
+        seen = []
+        class BatchInterface(object):
+            name = 'batch interface'
+            def onCommand(self, *args, **kwargs):
+                pass
+            def on(self, address):
+                seen.append((address, current_batch(), current_priority()))
+        class WaitingDevice(StateDevice):
+            def _command(self, *args, **kwargs):
+                seen.append(('waiting', waiting_for_commands()))
+                return super(WaitingDevice, self)._command(*args, **kwargs)
+        interface = BatchInterface()
+        mailboxes = StateDevice.use_mailboxes(4)
+        try:
+            devices = [InterfaceDevice(address=str(i), devices=interface) for i in range(3)]
+            waiting = WaitingDevice()
+            self.assertTrue(mailboxes.wait(5))
+            del seen[:]
+            with command_priority(Priority.INTERACTIVE), command_batch() as batch, command_nowait():
+                for device in devices:
+                    device.on()
+                waiting.on()
+                self.assertTrue(mailboxes.wait(5))
+        finally:
+            StateDevice.use_mailboxes(0)
+        # the workers issued the commands in the caller's batch, priority and nowait
+        self.assertEqual(sorted(seen), [(str(i), batch, Priority.INTERACTIVE) for i in range(3)] +
+                                       [('waiting', False)])
+
+    def test_mailboxes_interleaved(self):
+        overlaps = []
+        class CheckedDevice(StateDevice):
+            def _command(self, *args, **kwargs):
+                if self.active:
+                    overlaps.append(self)
+                self.active = True
+                try:
+                    return super(CheckedDevice, self)._command(*args, **kwargs)
+                finally:
+                    self.active = False
+        CheckedDevice.active = False
+        mailboxes = StateDevice.use_mailboxes(8)
+        try:
+            devices = [CheckedDevice() for i in range(10)]
+            # a ring delegating both ways
+            for (i, device) in enumerate(devices):
+                device.add_device(devices[i - 1])
+                devices[i - 1].add_device(device)
+            def fire(offset):
+                for i in range(250):
+                    devices[(i * 7 + offset) % len(devices)].command(Command.ON if i % 2 else Command.OFF)
+            threads = [threading.Thread(target=fire, args=(offset, )) for offset in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertTrue(mailboxes.wait(30))
+            self.assertEqual(overlaps, [])
+            self.assertEqual(mailboxes.pending(), 0)
+        finally:
+            StateDevice.use_mailboxes(0)
@@ -14,6 +14,8 @@ from .sparkio import *
 from .nest_thermostat import *
 from .tomato import *
 from .harmony_hub import *
+from .websocket_server import *
+from .http_server import *
 
 
 
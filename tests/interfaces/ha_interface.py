@@ -1,14 +1,47 @@
 
+import os
+import select
+import time
 from unittest import TestCase, main
 
 from pytomation.interfaces import HAInterface
-from pytomation.devices import StateDevice, InterfaceDevice, State
+from pytomation.interfaces.ha_interface import OutboundQueue, PacingController, RetryPolicy, OutboundCommand
+from pytomation.common.command_priority import Priority, command_priority, command_nowait, command_batch
+from pytomation.devices import StateDevice, InterfaceDevice, State, Scene, Controller
 from mock import Mock
 
+
+class PipeInterface(object):
+    """ Selectable fake device: reads from a pipe, records writes """
+    def __init__(self):
+        self._read_fd, self.device_fd = os.pipe()
+        self.written = []
+        self.disabled = False
+
+    def fileno(self):
+        return self._read_fd
+
+    def read(self, bufferSize=1024):
+        # like a serial port with a read timeout, nothing waiting reads as ''
+        readable, writable, errored = select.select([self._read_fd], [], [], 0)
+        if not readable:
+            return ''
+        return os.read(self._read_fd, bufferSize)
+
+    def write(self, data):
+        self.written.append((time.time(), data))
+        return True
+
+
 class HAInterfaceTests(TestCase):
     def setUp(self):
         di = Mock()
+        # an interface with nothing to read, a Mock read() keeps the loop busy
+        di.read.return_value = ''
         self.interface = HAInterface(di)
+
+    def tearDown(self):
+        self.interface.shutdown()
         
     def test_instances(self):
         prev = len(self.interface.instances)
@@ -30,5 +63,237 @@ class HAInterfaceTests(TestCase):
         self.assertEqual(s.state, State.OFF)
         self.interface._onState(State.ON, 'D3')
         self.assertEqual(s.state, State.ON)
-        
-        
\ No newline at end of file
+
+    def test_select_read_latency(self):
+        pipe = PipeInterface()
+        interface = HAInterface(pipe)
+        received = []
+        interface.onCommand(callback=lambda command, address, source: received.append(time.time()))
+        time.sleep(0.2)
+        sent = time.time()
+        os.write(pipe.device_fd, 'x')
+        time.sleep(0.3)
+        self.assertEqual(len(received), 1)
+        self.assertTrue(received[0] - sent < 0.1)
+        interface.shutdown()
+
+    def test_select_write_wakeup(self):
+        pipe = PipeInterface()
+        interface = HAInterface(pipe)
+        time.sleep(0.2)
+        queued = time.time()
+        interface._sendInterfaceCommand('abc')
+        time.sleep(0.3)
+        self.assertEqual(len(pipe.written), 1)
+        self.assertTrue(pipe.written[0][0] - queued < 0.1)
+        interface.shutdown()
+
+    def test_shutdown_closes_wakeup(self):
+        interface = HAInterface(PipeInterface())
+        interface._interfaceRunningEvent.wait(2)
+        wakeupRead = interface._wakeupRead
+        interface.shutdown()
+        self.assertIsNone(interface._wakeupWrite)
+        self.assertRaises(OSError, os.fstat, wakeupRead)
+        # commands after the loop stopped no longer write to the pipe
+        interface._wakeup()
+
+    def test_unstarted_opens_no_wakeup(self):
+        class Unstarted(HAInterface):
+            def run(self):
+                pass
+        interface = Unstarted(PipeInterface())
+        interface._main_thread.join(2)
+        self.assertIsNone(interface._wakeupRead)
+        # queueing a command has nothing to wake
+        interface._sendInterfaceCommand('abc')
+        interface.shutdown()
+
+    def test_command_batch_wakeup(self):
+        pipe = PipeInterface()
+        interface = HAInterface(pipe)
+        # only a wakeup ends the select() early
+        interface.IO_MAX_WAIT = 5
+        interface._wakeup()
+        time.sleep(0.2)
+        with command_batch():
+            interface._sendInterfaceCommand('abc')
+            interface._sendInterfaceCommand('def')
+            time.sleep(0.2)
+            self.assertEqual(pipe.written, [])
+        time.sleep(0.4)
+        self.assertEqual([data for (sent, data) in pipe.written], ['abc', 'def'])
+        interface.shutdown()
+
+    def test_command_batch_flushed(self):
+        woken = []
+        with command_batch() as batch:
+            batch.defer(lambda: woken.append('in'))
+            self.assertEqual(woken, [])
+        # a worker queueing after the batch ended is woken right away
+        batch.defer(lambda: woken.append('after'))
+        self.assertEqual(woken, ['in', 'after'])
+
+    def test_outbound_queue_priority(self):
+        queue = OutboundQueue()
+        queue.append('status', Priority.STATUS)
+        queue.append('automation')
+        queue.append('interactive', Priority.INTERACTIVE)
+        queue.append('automation2')
+        self.assertEqual(len(queue), 4)
+        self.assertEqual([queue.popleft() for i in range(4)],
+                         ['interactive', 'automation', 'automation2', 'status'])
+        self.assertRaises(IndexError, queue.popleft)
+        self.assertEqual(queue.metrics()['sent'], 4)
+        self.assertEqual(queue.metrics()['max_depth'], 4)
+
+    def test_outbound_queue_coalesce(self):
+        queue = OutboundQueue()
+        queue.append('off', key='a1')
+        queue.append('other')
+        self.assertEqual(queue.append('on', Priority.INTERACTIVE, key='a1'), 'off')
+        self.assertFalse('off' in queue)
+        self.assertEqual([queue.popleft(), queue.popleft()], ['on', 'other'])
+        self.assertEqual(queue.metrics()['coalesced'], 1)
+
+    def test_outbound_queue_front(self):
+        queue = OutboundQueue()
+        queue.append('first')
+        queue.append('status', Priority.STATUS)
+        queue.append('resent', key='a1', front=True)
+        self.assertEqual(queue.holder('a1'), 'resent')
+        self.assertEqual([queue.popleft() for i in range(3)], ['resent', 'first', 'status'])
+        self.assertEqual(queue.holder('a1'), None)
+
+    def test_send_priority_and_coalesce(self):
+        # hold the send loop off so commands stay queued
+        self.interface._intersend_delay = 60
+        self.interface._lastSendTime = time.time()
+        with command_priority(Priority.STATUS):
+            status = self.interface._sendInterfaceCommand('status')
+        first = self.interface._sendInterfaceCommand('off', extraCommandDetails={'coalesceKey': 'a1'})
+        with command_priority(Priority.INTERACTIVE):
+            second = self.interface._sendInterfaceCommand('on', extraCommandDetails={'coalesceKey': 'a1'})
+        self.assertTrue(first['waitEvent'].isSet())
+        self.assertFalse(second['waitEvent'].isSet())
+        metrics = self.interface.outbound_metrics()
+        self.assertEqual(metrics['depth'], 2)
+        self.assertEqual(metrics['coalesced'], 1)
+        self.assertEqual(self.interface._outboundQueue.popleft(), second['commandHash'])
+
+    def test_pacing_aimd(self):
+        pacing = PacingController(initial=1.0, minimum=0.5, maximum=3.0, step=0.25, timeout_backoff=1.5, prompt=1.0)
+        self.assertEqual(pacing.ack(0.1), 0.75)
+        self.assertEqual(pacing.ack(2.0), 0.75)  # slow ack, hold
+        self.assertEqual(pacing.ack(0.1), 0.5)
+        self.assertEqual(pacing.ack(0.1), 0.5)
+        self.assertEqual(pacing.nak(), 1.0)
+        self.assertEqual(pacing.timeout(), 1.5)
+        self.assertEqual(pacing.nak(), 3.0)
+        metrics = pacing.metrics()
+        self.assertEqual(metrics['acks'], 4)
+        self.assertEqual(metrics['naks'], 2)
+        self.assertEqual(metrics['timeouts'], 1)
+        self.assertAlmostEqual(metrics['success_ratio'], 4 / 7.0)
+
+    def test_command_retry_policy(self):
+        pipe = PipeInterface()
+        interface = HAInterface(pipe)
+        interface._intersend_delay = 0
+        interface._retryPolicy = RetryPolicy(timeout=0.2, retries=2)
+        start = time.time()
+        command = interface._sendInterfaceCommand('abc')
+        self.assertFalse(interface._waitForCommandToFinish(command))
+        self.assertTrue(time.time() - start < 2)
+        self.assertEqual(command.state, OutboundCommand.FAILED)
+        self.assertEqual(len(pipe.written), 3)
+        self.assertEqual(interface.outbound_metrics()['unfinished'], 0)
+        self.assertEqual(interface._pendingCommandDetails, {})
+        interface.shutdown()
+
+    def test_command_no_reply(self):
+        pipe = PipeInterface()
+        interface = HAInterface(pipe)
+        interface._intersend_delay = 0
+        interface._retryPolicy = RetryPolicy(timeout=0.1, retries=2)
+        interface._noRetryPolicy.timeout = 0.1
+        interface._pacing = PacingController(initial=0, minimum=0, maximum=0)
+        # fire and forget, as drivers that never get a reply send
+        command = interface._sendInterfaceCommand('abc')
+        replied = interface._sendInterfaceCommand('def', extraCommandDetails={'expectsReply': True})
+        time.sleep(1)
+        self.assertEqual([data for (at, data) in pipe.written].count('abc'), 1)
+        self.assertEqual([data for (at, data) in pipe.written].count('def'), 3)
+        self.assertTrue(command.done())
+        self.assertEqual(interface._commands, {})
+        # only the unanswered commands someone waited on tell of a busy line
+        self.assertEqual(interface._pacing.metrics()['timeouts'], 3)
+        interface.shutdown()
+
+    def test_requeue_superseded(self):
+        pipe = PipeInterface()
+        interface = HAInterface(pipe)
+        interface._intersend_delay = 0
+        interface._retryPolicy = RetryPolicy(timeout=0.2, retries=2)
+        on = interface._sendInterfaceCommand('on', extraCommandDetails={'coalesceKey': 'a1', 'expectsReply': True})
+        start = time.time()
+        while on.state != OutboundCommand.SENT and time.time() - start < 5:
+            time.sleep(0.01)
+        with interface._commandLock:
+            # hold the newer command in the queue while the older one times out
+            interface._intersend_delay = 60
+            interface._lastSendTime = time.time()
+        off = interface._sendInterfaceCommand('off', extraCommandDetails={'coalesceKey': 'a1', 'expectsReply': True})
+        self.assertTrue(on['waitEvent'].wait(5))
+        self.assertEqual(on.state, OutboundCommand.SUPERSEDED)
+        self.assertEqual([data for (at, data) in pipe.written], ['on'])
+        self.assertEqual(interface._outboundQueue.holder('a1'), off['commandHash'])
+        interface.shutdown()
+
+    def test_command_acked(self):
+        pipe = PipeInterface()
+        interface = HAInterface(pipe)
+        interface._intersend_delay = 0
+        command = interface._sendInterfaceCommand('abc')
+        time.sleep(0.2)
+        self.assertEqual(command.state, OutboundCommand.SENT)
+        # what a protocol driver does when the reply arrives
+        interface._commandReturnData[command['commandHash']] = 'reply'
+        command['waitEvent'].set()
+        del interface._pendingCommandDetails[command['commandHash']]
+        self.assertEqual(interface._waitForCommandToFinish(command), 'reply')
+        self.assertEqual(command.state, OutboundCommand.ACKED)
+        self.assertEqual(interface._commands, {})
+        self.assertEqual(interface._commandReturnData, {})
+        interface.shutdown()
+
+    def test_command_nowait(self):
+        pipe = PipeInterface()
+        interface = HAInterface(pipe)
+        interface._intersend_delay = 0
+        interface._retryPolicy = RetryPolicy(timeout=0.1, retries=0)
+        finished = []
+        with command_nowait():
+            command = interface._waitForCommandToFinish(interface._sendInterfaceCommand('abc'))
+        self.assertTrue(isinstance(command, OutboundCommand))
+        self.assertFalse(command.done())
+        interface._whenCommandFinishes(command, finished.append)
+        time.sleep(0.5)
+        self.assertEqual(finished, [command])
+        self.assertEqual(command.result, False)
+        interface.shutdown()
+
+    def test_address_routing(self):
+        light = InterfaceDevice(address='A1', devices=self.interface)
+        anything = InterfaceDevice(devices=self.interface)
+        scene = Scene(address='S1', devices=self.interface,
+                      controllers=[Controller(address='B2:01')])
+        other = Mock()
+        other.addressMatches.side_effect = lambda address: address == 'c3'
+        self.interface.onCommand(device=other)
+        self.assertEqual(self.interface._devicesForAddress('a1'), [light, anything])
+        self.assertEqual(self.interface._devicesForAddress('b2:01'), [anything, scene])
+        self.assertEqual(self.interface._devicesForAddress('c3'), [anything, other])
+        light.address = 'A2'
+        self.assertEqual(self.interface._devicesForAddress('A1'), [anything])
+        self.assertEqual(self.interface._devicesForAddress('A2'), [light, anything])
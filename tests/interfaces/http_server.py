@@ -0,0 +1,65 @@
+import base64
+import httplib
+import json
+import threading
+from unittest import TestCase
+
+from pytomation.interfaces.http_server import PytoHandlerClass, PooledHTTPServer
+from pytomation.devices import StateDevice
+from pytomation.common import config
+from pytomation.common.pytomation_api import PytomationAPI
+
+
+class QuietHandler(PytoHandlerClass):
+    protocol_version = 'HTTP/1.1'
+    api = PytomationAPI()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class PooledHTTPServerTests(TestCase):
+    def setUp(self):
+        self.server = PooledHTTPServer(('127.0.0.1', 0), QuietHandler, workers=2)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+        self.headers = {'Authorization': 'Basic ' + base64.b64encode(config.admin_user + ':' + config.admin_password)}
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _get(self, connection, path, headers=None):
+        headers = dict(headers or {}, **self.headers)
+        connection.request('GET', path, headers=headers)
+        response = connection.getresponse()
+        return (response, response.read())
+
+    def test_keep_alive(self):
+        d = StateDevice(name='device_test_1')
+        d.on()
+        connection = httplib.HTTPConnection('127.0.0.1', self.server.socket.getsockname()[1])
+        # more requests than workers on one connection
+        for i in range(5):
+            (response, body) = self._get(connection, '/api/device/' + d.type_id)
+            self.assertEqual(response.status, 200)
+            self.assertEqual(json.loads(body)['state'], 'on')
+            if i == 0:
+                sock = connection.sock
+            self.assertTrue(connection.sock is sock)
+        connection.close()
+
+    def test_not_modified(self):
+        d = StateDevice(name='device_test_1')
+        connection = httplib.HTTPConnection('127.0.0.1', self.server.socket.getsockname()[1])
+        (response, body) = self._get(connection, '/api/devices')
+        etag = response.getheader('ETag')
+        self.assertTrue(etag)
+        (response, body) = self._get(connection, '/api/devices', {'If-None-Match': etag})
+        self.assertEqual(response.status, 304)
+        d.on()
+        (response, body) = self._get(connection, '/api/devices', {'If-None-Match': etag})
+        self.assertEqual(response.status, 200)
+        self.assertTrue('device_test_1' in body)
+        connection.close()
@@ -9,6 +9,25 @@ from tests.common import MockInterface, Mock_Interface, Command
 from pytomation.interfaces import InsteonPLM, Serial, HACommand, \
                                     TCP, Conversions
 from pytomation.devices import Door, Light, State
+from pytomation.interfaces.ha_interface import RetryPolicy
+from pytomation.common.command_priority import command_nowait
+
+
+class SimulatedPLM(Mock_Interface):
+    """ Echoes every command and answers status requests except from silent devices """
+    def __init__(self, silent=None, *args, **kwargs):
+        super(SimulatedPLM, self).__init__(*args, **kwargs)
+        self.silent = silent or []
+
+    def write(self, data=None, **kwargs):
+        super(SimulatedPLM, self).write(data, **kwargs)
+        self._read_data += data + '\x06'
+        if data[:2] == '\x02\x62' and data[6:8] == '\x19\x00':
+            address = Conversions.ascii_to_hex(data[2:5])
+            if '.'.join([address[0:2], address[2:4], address[4:6]]) not in self.silent:
+                # cmd1 holds the link database delta, cmd2 the level
+                self._read_data += '\x02\x50' + data[2:5] + '\x11\x22\x33\x2B\x05\xFF'
+        return True
 
 class InsteonInterfaceTests(TestCase):
     useMock = True
@@ -49,11 +68,13 @@ class InsteonInterfaceTests(TestCase):
 #        self.ms.add_response({Conversions.hex_to_ascii('026219057B0F11FF'):
 #                              Conversions.hex_to_ascii('026219057B0F11FF06') + \
 #                              Conversions.hex_to_ascii('025019057B16F9EC2B11FF')})
-        response = self.insteon.on('19.05.7b')
+        with command_nowait():
+            command = self.insteon.on('19.05.7b')
+        time.sleep(1)
         self.assertIn(Conversions.hex_to_ascii('026219057B0F11FF'), self.ms.query_write_data())
         self.ms.put_read_data(Conversions.hex_to_ascii('026219057B0F11FF06'))
         self.ms.put_read_data(Conversions.hex_to_ascii('025019057B16F9EC2B11FF'))
-        time.sleep(2)
+        response = self.insteon._waitForCommandToFinish(command)
         self.assertEqual(response, True)
         
     def test_insteon_level2(self):
@@ -123,6 +144,8 @@ d395e51a11bb096e20f9ae84b47f8884
         self._result = command
 
     def test_insteon_status(self):
+        self.insteon.shutdown()
+        self.insteon = InsteonPLM(SimulatedPLM())
         response = self.insteon.status('44.33.22')
         self.assertEqual(response, True)
         
@@ -165,5 +188,62 @@ b78 = max hops
         time.sleep(3)
         self.assertEqual(d.state, State.OPEN)
 
+    def test_modem_nak_resends_command(self):
+        packet = Conversions.hex_to_ascii('026219057B0F11FF')
+        # only the NAK should cause a resend here, not a timeout
+        self.insteon._retryPolicy = RetryPolicy(timeout=10)
+        self.insteon._sendStandardP2PInsteonCommand('19.05.7b', '11', 'FF')
+        time.sleep(1.5)
+        self.assertEqual(self.ms.query_write_data().count(packet), 1)
+        delay = self.insteon._intersend_delay
+        self.ms.put_read_data('\x15')
+        time.sleep(2.5)
+        self.assertEqual(self.ms.query_write_data().count(packet), 2)
+        self.assertTrue(self.insteon._intersend_delay > delay)
+        self.assertEqual(self.insteon.outbound_metrics()['pacing']['naks'], 1)
+
+    def test_update_status_pipelined(self):
+        plm = SimulatedPLM(silent=['44.44.44'])
+        insteon = InsteonPLM(plm)
+        addresses = ['11.11.11', '22.22.22', '33.33.33', '44.44.44']
+        try:
+            refresh = insteon.update_status(addresses, timeout=1, retries=0)
+            results = refresh.wait(15)
+        finally:
+            insteon.shutdown()
+        self.assertTrue(refresh.done())
+        self.assertEqual(refresh.non_responders, ['44.44.44'])
+        for address in addresses[:3]:
+            self.assertTrue(results[address])
+        # asked one at a time the silent device alone waits out six 2 second timeouts
+        self.assertTrue(refresh.elapsed < 6)
+
+    def test_update_status_duplicate(self):
+        insteon = InsteonPLM(SimulatedPLM())
+        try:
+            # the first goes out, the second waits behind it in the queue
+            insteon._queueStatusRequest('11.11.11')
+            queued = insteon._queueStatusRequest('22.22.22')
+            refresh = insteon.update_status(['22.22.22'], timeout=1, retries=0, wait=False)
+            results = refresh.wait(15)
+        finally:
+            insteon.shutdown()
+        self.assertTrue(refresh.done())
+        self.assertEqual(refresh.non_responders, [])
+        self.assertTrue(results['22.22.22'])
+        self.assertEqual(queued.state, queued.ACKED)
+
+    def test_update_status_stopped(self):
+        insteon = InsteonPLM(SimulatedPLM())
+        # shutdown() leaves an interface thread that is not running yet alone
+        self.assertTrue(insteon._interfaceRunningEvent.wait(5))
+        insteon.shutdown()
+        start = time.time()
+        # nothing is left to answer, the caller is not held beyond the timeouts
+        refresh = insteon.update_status(['11.11.11', '22.22.22'], timeout=1, retries=1)
+        self.assertTrue(refresh.done())
+        self.assertEqual(refresh.non_responders, ['11.11.11', '22.22.22'])
+        self.assertTrue(time.time() - start < 2)
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,202 @@
+import json
+import threading
+from unittest import TestCase, main
+
+from pytomation.interfaces.websocket_server import ClientSender, StateBroadcaster, SubscriptionIndex, \
+    PytoWebSocketApp, PytoWebSocketServer
+from pytomation.devices import Light, Motion, Room, State
+from mock import Mock
+
+
+class FakeSocket(object):
+    def __init__(self, block=None):
+        self.sent = []
+        self.block = block
+        self.sending = threading.Event()
+
+    def send(self, message):
+        self.sending.set()
+        if self.block:
+            self.block.wait()
+        self.sent.append(message)
+
+
+class FakeClient(object):
+    def __init__(self, block=None):
+        self.ws = FakeSocket(block)
+
+
+class StateBroadcasterTests(TestCase):
+    def test_broadcast(self):
+        broadcaster = StateBroadcaster()
+        clients = [FakeClient(), FakeClient()]
+        broadcaster.broadcast(clients, 'a', key=1)
+        broadcaster.broadcast(clients, 'b', key=2)
+        self.assertTrue(broadcaster.flush(5))
+        for client in clients:
+            self.assertEqual(client.ws.sent, ['a', 'b'])
+        self.assertEqual(broadcaster.metrics()['sent'], 4)
+
+    def test_slow_client(self):
+        block = threading.Event()
+        slow = FakeClient(block)
+        fast = FakeClient()
+        broadcaster = StateBroadcaster(queue_size=2)
+        broadcaster.broadcast([slow, fast], 0, key=0)
+        # let the slow client's sender take the first frame and block on it
+        self.assertTrue(slow.ws.sending.wait(5))
+        for i in range(1, 5):
+            broadcaster.broadcast([slow, fast], i, key=i)
+        broadcaster.broadcast([slow, fast], 'latest', key=4)
+        # the fast client is never held back by the blocked one
+        self.assertTrue(broadcaster._senders[fast.ws].flush(5))
+        self.assertEqual(fast.ws.sent[-1], 'latest')
+        self.assertFalse(broadcaster._senders[slow.ws].flush(0))
+        metrics = broadcaster._senders[slow.ws].metrics()
+        self.assertEqual(metrics['dropped'], 2)
+        self.assertEqual(metrics['coalesced'], 1)
+        self.assertEqual(metrics['depth'], 2)
+        block.set()
+        self.assertTrue(broadcaster.flush(5))
+        # the first frame was already being sent, then only the newest two fit
+        self.assertEqual(slow.ws.sent, [0, 3, 'latest'])
+
+    def test_client_gone(self):
+        broadcaster = StateBroadcaster()
+        first = FakeClient()
+        second = FakeClient()
+        broadcaster.broadcast([first, second], 'a')
+        # a client that is gone loses what was not sent yet, let 'a' go out
+        self.assertTrue(broadcaster.flush(5))
+        broadcaster.broadcast([second], 'b')
+        self.assertTrue(broadcaster.flush(5))
+        self.assertEqual(first.ws.sent, ['a'])
+        self.assertEqual(second.ws.sent, ['a', 'b'])
+        self.assertEqual(broadcaster.metrics()['clients'], 1)
+
+    def test_reply_queued(self):
+        block = threading.Event()
+        ws = FakeSocket(block)
+        app = PytoWebSocketApp(ws)
+        app.broadcaster = StateBroadcaster()
+        app.broadcaster.broadcast([app], 'state', key=1)
+        self.assertTrue(ws.sending.wait(5))
+        app.on_message(json.dumps({'path': 'encoding', 'command': 'json'}))
+        # the reply waits behind the frame being sent instead of going out beside it
+        self.assertEqual(ws.sent, [])
+        block.set()
+        self.assertTrue(app.broadcaster.flush(5))
+        self.assertEqual(ws.sent, ['state', json.dumps({'encoding': 'json'})])
+
+    def test_sender_closes_on_error(self):
+        client = FakeClient()
+        client.ws.send = None
+        sender = ClientSender(client, 10)
+        sender.put('a')
+        sender.flush(5)
+        self.assertTrue(sender.closed)
+        self.assertEqual(sender.metrics()['sent'], 0)
+
+
+class SubscriptionIndexTests(TestCase):
+    def setUp(self):
+        self.light = Light(name='sub light')
+        self.motion = Motion(name='sub motion')
+        self.room = Room(name='sub room', devices=self.motion)
+
+    def test_subscribers(self):
+        index = SubscriptionIndex()
+        by_id = FakeClient()
+        by_type = FakeClient()
+        by_room = FakeClient()
+        everything = FakeClient()
+        index.subscribe(by_id.ws, ids=[self.light.type_id])
+        index.subscribe(by_type.ws, type_name=['Motion'])
+        self.assertEqual(index.subscribe(by_room.ws, rooms=[self.room.type_id]),
+                         {'ids': 0, 'type_name': 0, 'rooms': 1})
+        self.assertEqual(index.subscribers(self.light), set([by_id.ws]))
+        self.assertEqual(index.subscribers(self.motion), set([by_type.ws, by_room.ws]))
+        self.assertEqual(index.subscribers(self.room), set([by_room.ws]))
+
+        clients = [by_id, by_type, by_room, everything]
+        wants = index.wants(self.light)
+        self.assertEqual([client for client in clients if wants(client)], [by_id, everything])
+
+        # membership changes are followed
+        self.room.add_device(self.light)
+        self.assertEqual(index.subscribers(self.light), set([by_id.ws, by_room.ws]))
+
+        self.assertEqual(index.unsubscribe(by_room.ws), {'ids': 0, 'type_name': 0, 'rooms': 0})
+        self.assertEqual(index.subscribers(self.room), set())
+        self.assertTrue(index.wants(self.room)(by_room))
+        self.assertEqual(len(index.metrics()), 2)
+
+    def test_broadcast_filtered(self):
+        index = SubscriptionIndex()
+        broadcaster = StateBroadcaster()
+        subscribed = FakeClient()
+        everything = FakeClient()
+        index.subscribe(subscribed.ws, ids=[self.light.type_id])
+        broadcaster.broadcast([subscribed, everything], 'motion', key=1, wants=index.wants(self.motion))
+        broadcaster.broadcast([subscribed, everything], 'light', key=2, wants=index.wants(self.light))
+        self.assertTrue(broadcaster.flush(5))
+        self.assertEqual(subscribed.ws.sent, ['light'])
+        self.assertEqual(everything.ws.sent, ['motion', 'light'])
+
+    def test_subscription_message(self):
+        ws = FakeSocket()
+        app = PytoWebSocketApp(ws)
+        app.on_message(json.dumps({'path': 'subscribe',
+                                   'command': {'ids': [self.light.type_id], 'type_name': ['Motion']}}))
+        self.assertEqual(json.loads(ws.sent[-1]), {'subscriptions': {'ids': 1, 'type_name': 1, 'rooms': 0}})
+        app.on_message(json.dumps({'path': 'unsubscribe', 'command': {'type_name': ['Motion']}}))
+        self.assertEqual(json.loads(ws.sent[-1]), {'subscriptions': {'ids': 1, 'type_name': 0, 'rooms': 0}})
+        app.on_close(None)
+        self.assertEqual(app.subscriptions.counts(ws), {'ids': 0, 'type_name': 0, 'rooms': 0})
+
+    def test_subscription_invalid(self):
+        ws = FakeSocket()
+        app = PytoWebSocketApp(ws)
+        for command in ('ids', ['ids'], {'ids': [[1]]}, {'ids': 'abc'}, {'rooms': [self.room.type_id, 1]}):
+            app.on_message(json.dumps({'path': 'subscribe', 'command': command}))
+            self.assertEqual(json.loads(ws.sent[-1])['status'], 400)
+        self.assertEqual(app.subscriptions.counts(ws), {'ids': 0, 'type_name': 0, 'rooms': 0})
+
+    def test_encoding_message(self):
+        ws = FakeSocket()
+        app = PytoWebSocketApp(ws)
+        app.on_message(json.dumps({'path': 'encoding', 'command': 'compact'}))
+        table = json.loads(ws.sent[-1])
+        self.assertEqual(table['encoding'], 'compact')
+        self.assertTrue([self.light.type_id, 'sub light', 'Light'] in [row[1:] for row in table['devices']])
+        self.assertTrue(ws in app.compact)
+        app.on_message(json.dumps({'path': 'encoding', 'command': 'json'}))
+        self.assertEqual(json.loads(ws.sent[-1]), {'encoding': 'json'})
+        self.assertFalse(ws in app.compact)
+
+    def test_compact_late_device(self):
+        # a server that is not serving, broadcasting to the clients given
+        server = PytoWebSocketServer.__new__(PytoWebSocketServer)
+        server._broadcaster = StateBroadcaster()
+        early = PytoWebSocketApp(FakeSocket())
+        early.on_message(json.dumps({'path': 'encoding', 'command': 'compact'}))
+        late_light = Light(name='late light')
+        late = PytoWebSocketApp(FakeSocket())
+        late.on_message(json.dumps({'path': 'encoding', 'command': 'compact'}))
+        server.ws = Mock()
+        server.ws.clients = {1: early, 2: late}
+        try:
+            server.broadcast_state(State.ON, None, State.OFF, late_light)
+            self.assertTrue(server._broadcaster.flush(5))
+        finally:
+            PytoWebSocketApp.compact.clear()
+        number = server._api.get_device_number(late_light)
+        self.assertTrue(number in [row[0] for row in json.loads(late.ws.sent[0])['devices']])
+        self.assertFalse(number in [row[0] for row in json.loads(early.ws.sent[0])['devices']])
+        self.assertEqual(json.loads(late.ws.sent[-1]), [number, State.ON, State.OFF])
+        self.assertEqual(json.loads(early.ws.sent[-1]),
+                         [number, State.ON, State.OFF, late_light.type_id, 'late light', 'Light'])
+
+
+if __name__ == '__main__':
+    main()
@@ -75,6 +75,33 @@ class CronTimerTests(TestCase):
         self.assertEqual(cron[2], 18)
         self.assertEqual(cron[4], AllMatch())
 
+    def test_next_time(self):
+        self.ct.interval(secs=0, min=30, hour=7)
+        self.assertEqual(self.ct.next_time(datetime(2013, 1, 1, 7, 29, 59)),
+                         datetime(2013, 1, 1, 7, 30, 0))
+        self.assertEqual(self.ct.next_time(datetime(2013, 1, 1, 7, 30, 0)),
+                         datetime(2013, 1, 2, 7, 30, 0))
+        # Saturdays only
+        self.ct.interval(secs=0, min=0, hour=0, dow=6)
+        self.assertEqual(self.ct.next_time(datetime(2013, 1, 1, 12, 0, 0)),
+                         datetime(2013, 1, 5, 0, 0, 0))
+        self.ct.interval(secs=15, min=0, hour=12, day=29, month=2)
+        self.assertEqual(self.ct.next_time(datetime(2013, 3, 1, 12, 0, 0)),
+                         datetime(2016, 2, 29, 12, 0, 15))
+        self.ct.interval(secs=75)
+        self.assertEqual(self.ct.next_time(datetime(2013, 1, 1, 0, 0, 0)), None)
+
+    def test_single_wakeup(self):
+        m = Mock()
+        self.ct.interval(secs=0, min=0, hour=3)
+        self.ct.action(m.action, ())
+        self.ct.start()
+        self.assertTrue(self.ct.timer.isAlive())
+        self.assertTrue(self.ct.timer.interval <= CronTimer.MAX_WAIT)
+        self.ct.stop()
+        self.assertFalse(self.ct.timer.isAlive())
+        self.assertFalse(m.action.called)
+
     def callback(self):
         self.called = True
 
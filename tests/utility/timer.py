@@ -1,3 +1,4 @@
+import threading
 import time
 
 from mock import Mock
@@ -52,5 +53,32 @@ class TimerTests(TestCase):
         time.sleep(3)
         self.assertFalse(rt.isAlive())        
 
+    def test_fire_order(self):
+        fired = []
+        timers = []
+        for i in (3, 1, 2):
+            rt = CTimer(i / 2.0)
+            rt.action(fired.append, (i,))
+            rt.start()
+            timers.append(rt)
+        time.sleep(2)
+        self.assertEqual(fired, [1, 2, 3])
+
+    def test_restart_stress(self):
+        callback = Mock()
+        threads = threading.active_count()
+        timers = [CTimer(3600) for i in xrange(1000)]
+        for rt in timers:
+            rt.action(callback.test, ())
+        for i in xrange(100):
+            for rt in timers:
+                rt.restart()
+        self.assertEqual(len(CTimer.scheduler), 1000)
+        self.assertTrue(threading.active_count() <= threads + 1)
+        for rt in timers:
+            rt.stop()
+        self.assertEqual(len(CTimer.scheduler), 0)
+        self.assertFalse(callback.test.called)
+
 if __name__ == '__main__':
     main()
\ No newline at end of file